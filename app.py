@@ -1,9 +1,16 @@
-from flask import Flask, request, Response, jsonify
+from flask import Flask, request, Response, jsonify, g
 from qbwc_handler import QBWCHandler
+from health_probe import HealthProber
+import metrics
+import soap
+import request_body
+import tracing
+from circuit_breaker import STATE_VALUES
 import os
+import time
 import logging
 from datetime import datetime
-from utils import get_env_var, logger
+from utils import get_env_var, logger, set_log_ticket, source_length
 
 # Load environment variables
 from dotenv import load_dotenv
@@ -11,23 +18,58 @@ load_dotenv()
 
 app = Flask(__name__)
 qbwc_handler = QBWCHandler()
+health_prober = HealthProber(qbwc_handler)
+health_prober.start()
+metrics_flusher = metrics.MetricsFlusher()
+metrics_flusher.start()
+
+# Known actions, anything else is recorded as 'unknown' to bound label cardinality
+QBWC_ACTIONS = {
+    'serverVersion', 'clientVersion', 'authenticate', 'sendRequestXML',
+    'receiveResponseXML', 'connectionError', 'getLastError', 'closeConnection'
+}
 
 # Request logging
 @app.before_request
 def log_request():
     """Log incoming requests"""
-    logger.debug(f"{request.method} {request.path} from {request.remote_addr}")
+    g.request_start = time.perf_counter()
+    set_log_ticket(None)
+    logger.debug("%s %s from %s", request.method, request.path, request.remote_addr)
 
 @app.after_request
 def log_response(response):
     """Log outgoing responses"""
-    logger.debug(f"Response: {response.status_code}")
+    logger.debug("Response: %s", response.status_code)
+    if request.path == '/qbwc':
+        action = g.get('qbwc_action') or request.args.get('action', '')
+        action = action if action in QBWC_ACTIONS else 'unknown'
+        metrics.QBWC_REQUESTS.inc(action=action, status=response.status_code)
+        metrics.QBWC_REQUEST_DURATION.observe(time.perf_counter() - g.request_start, action=action)
+        # Decoded size (the wire size is compressed, or unknown for chunked uploads)
+        decoder = g.get('body_decoder')
+        metrics.QBWC_BODY_BYTES.observe(decoder.size if decoder else 0, action=action)
     return response
 
 @app.route('/qbwc', methods=['POST', 'GET'])
 def qbwc_endpoint():
     """
     Main QBWC endpoint - handles all QBWC protocol actions
+    
+    Accepts the Web Connector's SOAP envelopes as well as the query-string
+    protocol (?action=...&ticket=..., QBXML response in the body).
+    """
+    with tracing.span('qbwc.endpoint') as attributes, tracing.profiled('qbwc') as labels:
+        if soap.is_soap_request(request.method, request.args, request.content_type):
+            response = soap_endpoint()
+        else:
+            response = query_endpoint()
+        attributes['action'] = labels['action'] = g.get('qbwc_action') or request.args.get('action', '')
+        return response
+
+def query_endpoint():
+    """
+    Handle a query-string QBWC call
     """
     action = request.args.get('action', '')
     
@@ -37,103 +79,166 @@ def qbwc_endpoint():
     
     logger.info(f"QBWC action: {action}")
     
+    response_xml = ''
     try:
-        if action == 'serverVersion':
-            return qbwc_handler.server_version()
-        
-        elif action == 'clientVersion':
-            client_version = request.args.get('strVersion', '')
-            return qbwc_handler.client_version(client_version)
-        
-        elif action == 'authenticate':
-            username = request.args.get('strUserName', '')
-            password = request.args.get('strPassword', '')
-            if not username or not password:
-                logger.warning("Authentication attempt with missing credentials")
-                return Response('Missing credentials', status=400)
-            return qbwc_handler.authenticate(username, password)
-        
-        elif action == 'sendRequestXML':
-            ticket = request.args.get('ticket', '')
-            hcp_response = request.args.get('strHCPResponse', '')
-            company_file = request.args.get('strCompanyFileName', '')
-            if not ticket:
-                logger.warning("sendRequestXML called without ticket")
-                return Response('Missing ticket', status=400)
-            return qbwc_handler.send_request_xml(ticket, hcp_response, company_file)
-        
-        elif action == 'receiveResponseXML':
-            ticket = request.args.get('ticket', '')
-            response_xml = request.data.decode('utf-8') if request.data else ''
-            hresult = request.args.get('hresult', '')
-            message = request.args.get('message', '')
-            if not ticket:
-                logger.warning("receiveResponseXML called without ticket")
-                return Response('Missing ticket', status=400)
-            return qbwc_handler.receive_response_xml(ticket, response_xml, hresult, message)
-        
-        elif action == 'connectionError':
-            ticket = request.args.get('ticket', '')
-            hresult = request.args.get('hresult', '')
-            message = request.args.get('message', '')
-            return qbwc_handler.connection_error(ticket, hresult, message)
-        
-        elif action == 'getLastError':
-            ticket = request.args.get('ticket', '')
-            return qbwc_handler.get_last_error(ticket)
-        
-        elif action == 'closeConnection':
-            ticket = request.args.get('ticket', '')
-            return qbwc_handler.close_connection(ticket)
-        
-        else:
-            logger.warning(f"Unknown action: {action}")
-            return Response(f'Unknown action: {action}', status=400)
-            
+        if action == 'receiveResponseXML':
+            request_body.check_content_length(request.content_length)
+            g.body_decoder = request_body.BodyDecoder(request.headers.get('Content-Encoding'))
+            chunks = iter(lambda: request.stream.read(request_body.READ_CHUNK_SIZE), b'')
+            with tracing.span('qbwc.read_body') as attributes:
+                response_xml = request_body.read_body(chunks, g.body_decoder)
+                attributes['bytes'] = source_length(response_xml)
+        return call_qbwc_action(action, request.args, response_xml)
+    except request_body.BodyError as e:
+        logger.warning(f"❌ Rejected request body: {e}")
+        return Response(str(e), status=e.status)
     except Exception as e:
         logger.error(f"Error handling QBWC action {action}: {e}", exc_info=True)
         return Response(f'Internal server error: {str(e)}', status=500)
+    finally:
+        request_body.release(response_xml)
 
-@app.route('/health', methods=['GET'])
-def health():
+def soap_endpoint():
     """
-    Enhanced health check endpoint
+    Handle a QBWC SOAP envelope
     """
-    health_status = {
-        'status': 'ok',
-        'timestamp': datetime.now().isoformat(),
-        'version': '1.0.0',
-        'checks': {}
-    }
+    try:
+        # Parse while reading (and inflating) the body instead of buffering it first
+        request_body.check_content_length(request.content_length)
+        g.body_decoder = request_body.BodyDecoder(request.headers.get('Content-Encoding'))
+        chunks = iter(lambda: request.stream.read(request_body.READ_CHUNK_SIZE), b'')
+        with tracing.span('soap.parse_request'):
+            action, params = soap.parse_request(request_body.decode_chunks(chunks, g.body_decoder))
+    except request_body.BodyError as e:
+        logger.warning(f"❌ Rejected request body: {e}")
+        return Response(soap.render_fault(str(e)), status=e.status, content_type=soap.CONTENT_TYPE)
+    except soap.SoapError as e:
+        logger.warning(f"Invalid SOAP request: {e}")
+        return Response(soap.render_fault(str(e)), status=500, content_type=soap.CONTENT_TYPE)
     
-    status_code = 200
+    g.qbwc_action = action
+    logger.info(f"QBWC SOAP action: {action}")
     
-    # Check environment variables
     try:
-        get_env_var('N8N_WEBHOOK_URL', required=True)
-        get_env_var('QBWC_PASS', required=True)
-        health_status['checks']['env_vars'] = 'ok'
-    except ValueError as e:
-        health_status['checks']['env_vars'] = f'error: {str(e)}'
-        health_status['status'] = 'degraded'
-        status_code = 503
-    
-    # Check n8n connectivity (optional, don't fail if unreachable)
-    try:
-        from n8n_client import N8NClient
-        n8n_client = N8NClient()
-        # Try a simple HEAD request to check connectivity
-        import requests
-        response = requests.head(n8n_client.webhook_url, timeout=5)
-        health_status['checks']['n8n'] = 'reachable'
+        result = call_qbwc_action(action, params, params.get('response', ''))
     except Exception as e:
-        health_status['checks']['n8n'] = f'unreachable: {str(e)[:50]}'
-        # Don't fail health check if n8n is unreachable, just warn
+        logger.error(f"Error handling QBWC action {action}: {e}", exc_info=True)
+        return Response(soap.render_fault(f'Internal server error: {str(e)}'), status=500,
+                        content_type=soap.CONTENT_TYPE)
+    finally:
+        request_body.release(params.get('response'))
+    
+    if isinstance(result, Response):
+        # Invalid call (missing ticket, credentials, ...)
+        return Response(soap.render_fault(result.get_data(as_text=True)), status=500,
+                        content_type=soap.CONTENT_TYPE)
+    return Response(soap.render_response(action, result), content_type=soap.CONTENT_TYPE)
+
+def call_qbwc_action(action: str, args, response_xml):
+    """
+    Dispatch one QBWC action to the handler
+    
+    Args:
+        action: QBWC action name
+        args: Action parameters (query-string arguments or SOAP parameters)
+        response_xml: QBXML response (receiveResponseXML), text or spilled body file
+    
+    Returns:
+        Handler result string, or an error Response for invalid calls
+    """
+    set_log_ticket(args.get('ticket'))
+    
+    if action == 'serverVersion':
+        return qbwc_handler.server_version()
+    
+    elif action == 'clientVersion':
+        client_version = args.get('strVersion', '')
+        return qbwc_handler.client_version(client_version)
+    
+    elif action == 'authenticate':
+        username = args.get('strUserName', '')
+        password = args.get('strPassword', '')
+        if not username or not password:
+            logger.warning("Authentication attempt with missing credentials")
+            return Response('Missing credentials', status=400)
+        return qbwc_handler.authenticate(username, password)
     
-    # Check active sessions
-    health_status['checks']['sessions'] = len(qbwc_handler.sessions)
+    elif action == 'sendRequestXML':
+        ticket = args.get('ticket', '')
+        hcp_response = args.get('strHCPResponse', '')
+        company_file = args.get('strCompanyFileName', '')
+        if not ticket:
+            logger.warning("sendRequestXML called without ticket")
+            return Response('Missing ticket', status=400)
+        return qbwc_handler.send_request_xml(ticket, hcp_response, company_file)
     
-    return jsonify(health_status), status_code
+    elif action == 'receiveResponseXML':
+        ticket = args.get('ticket', '')
+        hresult = args.get('hresult', '')
+        message = args.get('message', '')
+        if not ticket:
+            logger.warning("receiveResponseXML called without ticket")
+            return Response('Missing ticket', status=400)
+        return qbwc_handler.receive_response_xml(ticket, response_xml, hresult, message)
+    
+    elif action == 'connectionError':
+        ticket = args.get('ticket', '')
+        hresult = args.get('hresult', '')
+        message = args.get('message', '')
+        return qbwc_handler.connection_error(ticket, hresult, message)
+    
+    elif action == 'getLastError':
+        ticket = args.get('ticket', '')
+        return qbwc_handler.get_last_error(ticket)
+    
+    elif action == 'closeConnection':
+        ticket = args.get('ticket', '')
+        return qbwc_handler.close_connection(ticket)
+    
+    else:
+        logger.warning(f"Unknown action: {action}")
+        return Response(f'Unknown action: {action}', status=400)
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    Enhanced health check endpoint (served from the background prober's cache)
+    """
+    report, status_code = health_prober.health_report()
+    return jsonify(report), status_code
+
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    """
+    Liveness probe: the process is serving requests
+    """
+    return jsonify({
+        'status': 'alive',
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """
+    Readiness probe: configuration is valid and the prober is up to date
+    """
+    report, status_code = health_prober.readiness_report()
+    return jsonify(report), status_code
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Prometheus metrics, aggregated across all workers on the host
+    """
+    gauges = {}
+    try:
+        gauges['qbwc_live_sessions'] = ('Live QBWC sessions', len(qbwc_handler.sessions))
+        gauges['n8n_circuit_state'] = ('n8n circuit breaker state of the answering worker '
+                                       '(0 closed, 1 half-open, 2 open)',
+                                       STATE_VALUES[qbwc_handler.n8n_client.breaker.state])
+    except Exception as e:
+        logger.error(f"Error counting sessions for metrics: {e}")
+    return Response(metrics.render_metrics(gauges), mimetype='text/plain; version=0.0.4')
 
 @app.route('/', methods=['GET'])
 def root():
@@ -142,8 +247,11 @@ def root():
         'service': 'QuickBooks to Monday.com Adapter',
         'version': '1.0.0',
         'endpoints': {
-            '/qbwc': 'QBWC protocol endpoint',
-            '/health': 'Health check endpoint'
+            '/qbwc': 'QBWC protocol endpoint (SOAP or query string)',
+            '/health': 'Health check endpoint',
+            '/health/live': 'Liveness probe',
+            '/health/ready': 'Readiness probe',
+            '/metrics': 'Prometheus metrics'
         }
     }), 200
 
@@ -0,0 +1,451 @@
+"""
+Asyncio serving mode (aiohttp)
+
+Serves /qbwc, the health endpoints and /metrics from an event loop, so a
+receiveResponseXML waiting on n8n only suspends a coroutine instead of
+holding a whole sync worker. QBXML conversion and SQLite access (sessions,
+spool, fingerprints, watermarks) run in a thread pool.
+
+Run with:
+    gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker --bind 0.0.0.0:$PORT
+"""
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from aiohttp import web
+from async_n8n_client import AsyncN8NClient
+from health_probe import HealthProber
+from qbwc_handler import QBWCHandler
+from scheduler import SchedulerBusy
+from utils import get_env_var, logger, set_log_ticket, source_length
+import metrics
+import soap
+import request_body
+import tracing
+from circuit_breaker import STATE_VALUES
+
+# Load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+# Known actions, anything else is recorded as 'unknown' to bound label cardinality
+QBWC_ACTIONS = {
+    'serverVersion', 'clientVersion', 'authenticate', 'sendRequestXML',
+    'receiveResponseXML', 'connectionError', 'getLastError', 'closeConnection'
+}
+
+
+class AsyncQBWCHandler(QBWCHandler):
+    def __init__(self):
+        """Initialize QBWC Handler with an executor for blocking work and an async n8n client"""
+        super().__init__()
+        workers = int(get_env_var('ASYNC_EXECUTOR_WORKERS', default='8', required=False))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='qbwc-executor')
+        self.async_n8n_client = AsyncN8NClient(self.n8n_client.webhook_url, self.run_blocking)
+        self.async_company_clients = {}
+        logger.info(f"Async QBWC Handler initialized ({workers} executor threads)")
+
+    async def run_blocking(self, func, *args):
+        """
+        Run a blocking call in the executor
+
+        Args:
+            func: Function to call
+            *args: Positional arguments
+
+        Returns:
+            The function's return value
+        """
+        # Copy the context so executor threads log with the request's ticket
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(context.run, func, *args))
+
+    def _profiled(self, func, *args):
+        """
+        Call a blocking function, under cProfile for a sampled share of calls
+
+        The event loop thread runs every request's coroutines at once, so
+        async mode profiles the heavy work in the executor instead of whole
+        requests.
+        """
+        with tracing.profiled('qbwc') as labels:
+            labels['action'] = func.__name__.lstrip('_')
+            return func(*args)
+
+    async def receive_response_xml_async(self, ticket: str, response_xml, hresult: str, message: str) -> str:
+        """
+        Process QBXML response from QuickBooks (see receive_response_xml)
+
+        Args:
+            ticket: Session ticket
+            response_xml: QBXML response string or spilled body file
+            hresult: HRESULT error code
+            message: Error message
+
+        Returns:
+            Percent complete, or "-1" on error
+        """
+        with tracing.span('handler.receive_response_xml', bytes=source_length(response_xml)):
+            session = await self.run_blocking(self.sessions.get, ticket)
+            if session is None:
+                logger.warning(f"Invalid ticket in receive_response_xml: {ticket[:8]}...")
+                return "0"
+
+            try:
+                return await self._process_response_async(session, response_xml, hresult, message)
+            finally:
+                # Persist iterator and watermark state for the next call (any worker)
+                await self.run_blocking(self.sessions.set, ticket, session)
+
+    async def _process_response_async(self, session: dict, response_xml, hresult: str, message: str) -> str:
+        """
+        Convert one response in the executor and deliver it without blocking the loop
+
+        Args:
+            session: Session dictionary
+            response_xml: QBXML response string or spilled body file
+            hresult: HRESULT error code
+            message: Error message
+
+        Returns:
+            receiveResponseXML result (percent complete or "-1")
+        """
+        batch, early_result = self._begin_response(session, response_xml, hresult, message)
+        if early_result is not None:
+            return early_result
+
+        company = self._company(session)
+        if company is None:
+            return self._fail_unknown_company(session)
+        try:
+            logger.info(f"Processing response XML for {[job['entity'] for job in batch]} "
+                       f"(length: {source_length(response_xml)} bytes)")
+            delivered = None
+            if self.stream_push:
+                # Parsing feeds a blocking chunked upload, so both run in the executor
+                results, delivered = await self.run_blocking(self._profiled, self._stream_response,
+                                                             batch, response_xml, company)
+            else:
+                async with self.scheduler.slot_async(company.name, company.max_concurrent):
+                    converted = await self.run_blocking(self._profiled, self.xml_converter.convert_responses,
+                                                        response_xml, company.namespace)
+                results = {result['request_id']: result for result in converted}
+        except SchedulerBusy as e:
+            return self._fail_sync(session, str(e))
+        except Exception as e:
+            logger.error(f"Error processing response XML: {e}", exc_info=True)
+            return self._fail_sync(session, f"Error processing response XML: {e}")
+
+        if delivered is None:
+            delivered = {}
+            for result in self._deliverable_results(batch, results):
+                delivered[result['request_id']] = await self._deliver_result_async(result, company)
+        return await self.run_blocking(self._finish_response, session, batch, results, delivered)
+
+    def _async_n8n_client_for(self, company) -> AsyncN8NClient:
+        """Return the async client of a company's webhook"""
+        if not company.webhook_url or company.webhook_url == self.async_n8n_client.webhook_url:
+            return self.async_n8n_client
+        client = self.async_company_clients.get(company.webhook_url)
+        if client is None:
+            client = self.async_company_clients[company.webhook_url] = AsyncN8NClient(company.webhook_url,
+                                                                                       self.run_blocking)
+        return client
+
+    async def close_clients(self) -> None:
+        """Close the pooled connections of every async client"""
+        await self.async_n8n_client.close()
+        for client in self.async_company_clients.values():
+            await client.close()
+
+    async def _deliver_result_async(self, result: dict, company) -> bool:
+        """
+        Deliver one converted response: spool it in the executor, or push it
+        with the company's async client when the spool is disabled
+
+        Args:
+            result: Converter result (query info plus 'payload')
+            company: Company the response belongs to
+
+        Returns:
+            True if the payload was spooled or pushed successfully
+        """
+        if self.spool:
+            return await self.run_blocking(self._deliver_result, result, company)
+        with tracing.span('handler.deliver', entity=result['entity'], spooled=False):
+            try:
+                return await self._async_n8n_client_for(company).push_data(result['payload'])
+            except Exception as e:
+                logger.error(f"Error delivering {result['entity']} data: {e}", exc_info=True)
+                return False
+
+
+qbwc_handler = AsyncQBWCHandler()
+health_prober = HealthProber(qbwc_handler)
+health_prober.start()
+metrics_flusher = metrics.MetricsFlusher()
+metrics_flusher.start()
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    """Log requests and record QBWC action metrics"""
+    start = time.perf_counter()
+    logger.debug("%s %s from %s", request.method, request.path, request.remote)
+    response = await handler(request)
+    logger.debug("Response: %s", response.status)
+    if request.path == '/qbwc':
+        action = request.get('qbwc_action') or request.query.get('action', '')
+        action = action if action in QBWC_ACTIONS else 'unknown'
+        metrics.QBWC_REQUESTS.inc(action=action, status=response.status)
+        metrics.QBWC_REQUEST_DURATION.observe(time.perf_counter() - start, action=action)
+        # Decoded size (the wire size is compressed, or unknown for chunked uploads)
+        decoder = request.get('body_decoder')
+        metrics.QBWC_BODY_BYTES.observe(decoder.size if decoder else 0, action=action)
+    return response
+
+
+async def qbwc_endpoint(request: web.Request) -> web.Response:
+    """
+    Main QBWC endpoint - handles all QBWC protocol actions
+
+    Accepts the Web Connector's SOAP envelopes as well as the query-string
+    protocol (?action=...&ticket=..., QBXML response in the body).
+    """
+    with tracing.span('qbwc.endpoint') as attributes:
+        if soap.is_soap_request(request.method, request.query, request.content_type):
+            response = await soap_endpoint(request)
+        else:
+            response = await query_endpoint(request)
+        attributes['action'] = request.get('qbwc_action') or request.query.get('action', '')
+        return response
+
+
+async def query_endpoint(request: web.Request) -> web.Response:
+    """Handle a query-string QBWC call"""
+    args = request.query
+    action = args.get('action', '')
+
+    if not action:
+        logger.warning("QBWC endpoint called without action parameter")
+        return web.Response(text='Missing action parameter', status=400)
+
+    logger.info(f"QBWC action: {action}")
+
+    response_xml = ''
+    try:
+        if action == 'receiveResponseXML':
+            request_body.check_content_length(request.content_length)
+            request['body_decoder'] = request_body.BodyDecoder(request.headers.get('Content-Encoding'))
+            with tracing.span('qbwc.read_body') as attributes:
+                response_xml = await request_body.read_body_async(
+                    request.content, request['body_decoder'], qbwc_handler.run_blocking)
+                attributes['bytes'] = source_length(response_xml)
+        return await call_qbwc_action(action, args, response_xml)
+    except request_body.BodyError as e:
+        logger.warning(f"❌ Rejected request body: {e}")
+        return web.Response(text=str(e), status=e.status)
+    except Exception as e:
+        logger.error(f"Error handling QBWC action {action}: {e}", exc_info=True)
+        return web.Response(text=f'Internal server error: {str(e)}', status=500)
+    finally:
+        request_body.release(response_xml)
+
+
+def _soap_response(body: bytes, status: int = 200) -> web.Response:
+    return web.Response(body=body, status=status, content_type='text/xml', charset='utf-8')
+
+
+async def soap_endpoint(request: web.Request) -> web.Response:
+    """Handle a QBWC SOAP envelope"""
+    parser = soap.SoapRequestParser()
+    try:
+        # Parse chunks as they arrive instead of buffering the body first;
+        # inflating, parsing and spilling the response parameter run in the executor
+        request_body.check_content_length(request.content_length)
+        request['body_decoder'] = request_body.BodyDecoder(request.headers.get('Content-Encoding'))
+        with tracing.span('soap.parse_request'):
+            await request_body.feed_body_async(request.content, request['body_decoder'],
+                                               parser.feed, qbwc_handler.run_blocking)
+            action, params = await qbwc_handler.run_blocking(parser.close)
+    except request_body.BodyError as e:
+        parser.discard()
+        logger.warning(f"❌ Rejected request body: {e}")
+        return _soap_response(soap.render_fault(str(e)), status=e.status)
+    except soap.SoapError as e:
+        parser.discard()
+        logger.warning(f"Invalid SOAP request: {e}")
+        return _soap_response(soap.render_fault(str(e)), status=500)
+    except BaseException:
+        parser.discard()
+        raise
+
+    request['qbwc_action'] = action
+    logger.info(f"QBWC SOAP action: {action}")
+
+    try:
+        response = await call_qbwc_action(action, params, params.get('response', ''))
+    except Exception as e:
+        logger.error(f"Error handling QBWC action {action}: {e}", exc_info=True)
+        return _soap_response(soap.render_fault(f'Internal server error: {str(e)}'), status=500)
+    finally:
+        request_body.release(params.get('response'))
+
+    if response.status != 200:
+        # Invalid call (missing ticket, credentials, ...)
+        return _soap_response(soap.render_fault(response.text), status=500)
+    return _soap_response(soap.render_response(action, response.text))
+
+
+async def call_qbwc_action(action: str, args, response_xml) -> web.Response:
+    """
+    Dispatch one QBWC action to the handler
+
+    Args:
+        action: QBWC action name
+        args: Action parameters (query-string arguments or SOAP parameters)
+        response_xml: QBXML response (receiveResponseXML), text or spilled body file
+
+    Returns:
+        Response with the handler result, or status 400 for invalid calls
+    """
+    set_log_ticket(args.get('ticket'))
+    run = qbwc_handler.run_blocking
+
+    if action == 'serverVersion':
+        return web.Response(text=qbwc_handler.server_version())
+
+    elif action == 'clientVersion':
+        return web.Response(text=qbwc_handler.client_version(args.get('strVersion', '')))
+
+    elif action == 'authenticate':
+        username = args.get('strUserName', '')
+        password = args.get('strPassword', '')
+        if not username or not password:
+            logger.warning("Authentication attempt with missing credentials")
+            return web.Response(text='Missing credentials', status=400)
+        return web.Response(text=await run(qbwc_handler.authenticate, username, password))
+
+    elif action == 'sendRequestXML':
+        ticket = args.get('ticket', '')
+        if not ticket:
+            logger.warning("sendRequestXML called without ticket")
+            return web.Response(text='Missing ticket', status=400)
+        return web.Response(text=await run(qbwc_handler.send_request_xml, ticket,
+                                           args.get('strHCPResponse', ''), args.get('strCompanyFileName', '')))
+
+    elif action == 'receiveResponseXML':
+        ticket = args.get('ticket', '')
+        if not ticket:
+            logger.warning("receiveResponseXML called without ticket")
+            return web.Response(text='Missing ticket', status=400)
+        return web.Response(text=await qbwc_handler.receive_response_xml_async(
+            ticket, response_xml, args.get('hresult', ''), args.get('message', '')))
+
+    elif action == 'connectionError':
+        return web.Response(text=await run(qbwc_handler.connection_error, args.get('ticket', ''),
+                                           args.get('hresult', ''), args.get('message', '')))
+
+    elif action == 'getLastError':
+        return web.Response(text=await run(qbwc_handler.get_last_error, args.get('ticket', '')))
+
+    elif action == 'closeConnection':
+        return web.Response(text=await run(qbwc_handler.close_connection, args.get('ticket', '')))
+
+    else:
+        logger.warning(f"Unknown action: {action}")
+        return web.Response(text=f'Unknown action: {action}', status=400)
+
+
+async def health(request: web.Request) -> web.Response:
+    """Enhanced health check endpoint (served from the background prober's cache)"""
+    report, status_code = health_prober.health_report()
+    return web.json_response(report, status=status_code)
+
+
+async def liveness(request: web.Request) -> web.Response:
+    """Liveness probe: the event loop is serving requests"""
+    return web.json_response({'status': 'alive', 'timestamp': datetime.now().isoformat()})
+
+
+async def readiness(request: web.Request) -> web.Response:
+    """Readiness probe: configuration is valid and the prober is up to date"""
+    report, status_code = health_prober.readiness_report()
+    return web.json_response(report, status=status_code)
+
+
+def _render_metrics() -> str:
+    gauges = {}
+    try:
+        gauges['qbwc_live_sessions'] = ('Live QBWC sessions', len(qbwc_handler.sessions))
+        gauges['n8n_circuit_state'] = ('n8n circuit breaker state of the answering worker '
+                                       '(0 closed, 1 half-open, 2 open)',
+                                       STATE_VALUES[qbwc_handler.n8n_client.breaker.state])
+        scheduler_stats = qbwc_handler.scheduler.stats()
+        gauges['qbxml_conversions_active'] = ('QBXML conversions running in the answering worker',
+                                              scheduler_stats['active'])
+        gauges['qbxml_conversions_waiting'] = ('QBXML conversions waiting for a slot in the answering worker',
+                                               scheduler_stats['waiting'])
+    except Exception as e:
+        logger.error(f"Error counting sessions for metrics: {e}")
+    return metrics.render_metrics(gauges)
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """Prometheus metrics, aggregated across all workers on the host"""
+    text = await qbwc_handler.run_blocking(_render_metrics)
+    return web.Response(text=text, headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+async def root(request: web.Request) -> web.Response:
+    """Root endpoint"""
+    return web.json_response({
+        'service': 'QuickBooks to Monday.com Adapter',
+        'version': '1.0.0',
+        'mode': 'async',
+        'endpoints': {
+            '/qbwc': 'QBWC protocol endpoint (SOAP or query string)',
+            '/health': 'Health check endpoint',
+            '/health/live': 'Liveness probe',
+            '/health/ready': 'Readiness probe',
+            '/metrics': 'Prometheus metrics'
+        }
+    })
+
+
+async def _close_clients(app: web.Application) -> None:
+    await qbwc_handler.close_clients()
+
+
+def create_app() -> web.Application:
+    """
+    Create the aiohttp application
+
+    Returns:
+        aiohttp web.Application
+    """
+    # aiohttp rejects bodies over 1 MB by default; QBXML responses are often larger.
+    # Bodies are inflated by request_body in the executor, not by aiohttp on the event loop.
+    application = web.Application(middlewares=[metrics_middleware],
+                                  client_max_size=request_body.max_body_bytes(),
+                                  handler_args={'auto_decompress': False})
+    application.router.add_route('GET', '/qbwc', qbwc_endpoint)
+    application.router.add_route('POST', '/qbwc', qbwc_endpoint)
+    application.router.add_get('/health', health)
+    application.router.add_get('/health/live', liveness)
+    application.router.add_get('/health/ready', readiness)
+    application.router.add_get('/metrics', metrics_endpoint)
+    application.router.add_get('/', root)
+    application.on_cleanup.append(_close_clients)
+    return application
+
+
+app = create_app()
+
+if __name__ == '__main__':
+    port = int(get_env_var('PORT', default='5000', required=False))
+    logger.info(f"Starting aiohttp app on port {port}")
+    web.run_app(app, host='0.0.0.0', port=port)
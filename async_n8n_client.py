@@ -0,0 +1,183 @@
+"""
+Asyncio n8n webhook client (aiohttp)
+
+Same payload handling as N8NClient (validation, chunking, gzip, per-chunk
+retries), but waiting on n8n only suspends the calling coroutine.
+"""
+import asyncio
+import contextvars
+import time
+from functools import partial
+from typing import Awaitable, Callable, Optional
+import aiohttp
+from n8n_client import N8NClient
+from utils import logger
+import metrics
+import tracing
+
+
+class AsyncN8NClient(N8NClient):
+    def __init__(self, webhook_url: Optional[str] = None,
+                 run_blocking: Optional[Callable[..., Awaitable]] = None):
+        """
+        Initialize async n8n client
+
+        Args:
+            webhook_url: n8n webhook URL (optional, will use env var if not provided)
+            run_blocking: Coroutine function running a blocking call in the
+                app's executor, used for serialization (optional, the loop's
+                default executor if not provided)
+        """
+        super().__init__(webhook_url)
+        self.run_blocking = run_blocking or self._run_in_default_executor
+        self._http = None
+
+    @staticmethod
+    async def _run_in_default_executor(func, *args):
+        """Run a blocking call in the loop's default executor, in a copy of the caller's context"""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(None, partial(context.run, func, *args))
+
+    def _get_http(self) -> aiohttp.ClientSession:
+        """Get the keep-alive session (created lazily inside the running event loop)"""
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            )
+        return self._http
+
+    async def close(self) -> None:
+        """Close pooled connections"""
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+
+    async def _send_request_async(self, body: bytes) -> bool:
+        """
+        Send request to n8n webhook (internal method)
+
+        Args:
+            body: Serialized JSON payload
+
+        Returns:
+            True if successful
+
+        Raises:
+            aiohttp.ClientError: If the request fails or n8n answers with an error status
+            asyncio.TimeoutError: If the request times out
+        """
+        body, headers = self._prepare_body(body)
+        with tracing.span('n8n.post', bytes=len(body), gzip='Content-Encoding' in headers) as attributes:
+            async with self._get_http().post(self.webhook_url, data=body, headers=headers) as response:
+                attributes['status'] = response.status
+                response.raise_for_status()
+        return True
+
+    async def push_data(self, json_data, batch_id: Optional[str] = None, item_count: Optional[int] = None) -> bool:
+        """
+        Push data to n8n webhook with retry logic (see N8NClient.push_data)
+
+        Args:
+            json_data: records.Payload, or JSON data to send (bytes, string or dict)
+            batch_id: Stable batch id sent with chunks (optional, generated if not provided)
+            item_count: Number of records in already serialized JSON (optional)
+
+        Returns:
+            True if successful, False otherwise
+        """
+        start = time.perf_counter()
+        ok = await self._push_data_async(json_data, batch_id, item_count)
+        outcome = 'success' if ok else 'failure'
+        metrics.N8N_PUSH_DURATION.observe(time.perf_counter() - start, outcome=outcome)
+        metrics.N8N_PUSHES.inc(outcome=outcome)
+        return ok
+
+    async def _push_data_async(self, json_data, batch_id: Optional[str] = None,
+                               item_count: Optional[int] = None) -> bool:
+        """Serialize, chunk and deliver a payload (see push_data)"""
+        try:
+            # Serialization is CPU-bound, keep it off the event loop
+            chunks = await self.run_blocking(self._prepare_chunks, json_data, batch_id, item_count)
+            if chunks is None:
+                return False
+
+            if len(chunks) == 1:
+                return await self._send_with_retry_async(chunks[0])
+
+            logger.info(f"Sending batch {chunks[0]['batch_id']} in {len(chunks)} chunks "
+                       f"(parallelism {self.max_parallel_chunks})")
+            semaphore = asyncio.Semaphore(self.max_parallel_chunks)
+
+            async def send(chunk: dict) -> bool:
+                async with semaphore:
+                    return await self._send_with_retry_async(chunk)
+
+            results = await asyncio.gather(*(send(chunk) for chunk in chunks))
+
+            failed = [chunk['sequence'] for chunk, ok in zip(chunks, results) if not ok]
+            if failed:
+                logger.error(f"❌ {len(failed)}/{len(chunks)} chunks failed for batch "
+                            f"{chunks[0]['batch_id']}: {failed}")
+                return False
+
+            logger.info(f"✅ All {len(chunks)} chunks of batch {chunks[0]['batch_id']} sent to n8n")
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Unexpected error in push_data: {e}", exc_info=True)
+            return False
+
+    async def _send_with_retry_async(self, chunk: dict) -> bool:
+        """
+        Send one chunk with retry logic
+
+        Args:
+            chunk: Chunk from _split_chunks
+
+        Returns:
+            True if successful, False after all attempts failed
+        """
+        label = f" chunk {chunk['sequence']}/{chunk['total_chunks']}" if chunk['sequence'] else ''
+
+        last_exception = None
+        deadline = time.monotonic() + self.retry_budget
+        for attempt in range(self.max_retries):
+            if not self._circuit_allows(label):
+                return False
+            try:
+                await self._send_request_async(chunk['body'])
+                self.breaker.record_success()
+                metrics.N8N_PUSH_ATTEMPTS.inc(outcome='success')
+                logger.info(f"✅ Successfully sent{label} to n8n (attempt {attempt + 1})")
+                return True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_exception = e
+                self._record_attempt_failure(e.status if isinstance(e, aiohttp.ClientResponseError) else None)
+                metrics.N8N_PUSH_ATTEMPTS.inc(outcome=type(e).__name__)
+                if attempt < self.max_retries - 1:
+                    wait_time = self._retry_wait(attempt, deadline, label)
+                    if wait_time is None:
+                        break
+                    logger.warning(
+                        f"Attempt {attempt + 1}/{self.max_retries}{label} failed: {e!r}. "
+                        f"Retrying in {wait_time:.1f} seconds..."
+                    )
+                    await asyncio.sleep(wait_time)
+                else:
+                    logger.error(f"All {self.max_retries} attempts failed{label}")
+            except BaseException:
+                # Not an answer from n8n (or cancelled): free a half-open probe without judging the webhook
+                self.breaker.release_probe()
+                raise
+
+        # Handle specific exception types
+        if isinstance(last_exception, asyncio.TimeoutError):
+            logger.error(f"❌ Timeout sending to n8n after {self.read_timeout} seconds")
+        elif isinstance(last_exception, aiohttp.ClientResponseError):
+            logger.error(f"❌ HTTP error from n8n: {last_exception.status} {last_exception.message}")
+        elif isinstance(last_exception, aiohttp.ClientConnectionError):
+            logger.error(f"❌ Connection error to n8n: {last_exception!r}")
+        else:
+            logger.error(f"❌ Unexpected error pushing to n8n: {last_exception!r}")
+
+        return False
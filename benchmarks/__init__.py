@@ -0,0 +1,3 @@
+"""
+Benchmarks and load-testing tools (not imported by the application)
+"""
@@ -0,0 +1,479 @@
+"""
+End-to-end load test with simulated Web Connector clients
+
+Each client runs the QBWC cycle against /qbwc the way the Windows Web
+Connector does (serverVersion, clientVersion, authenticate, then
+sendRequestXML / receiveResponseXML until 100%, then closeConnection) and
+answers every query like a QuickBooks company file with a fixed number of
+synthetic invoices, honouring iterators. n8n is replaced by a local stub
+webhook with configurable latency and error rate.
+
+Reports per-action latency percentiles and error rates, webhook deliveries
+and, when the server is spawned or --server-pid is given, its memory.
+
+Usage:
+    python -m benchmarks.loadtest --clients 20 --cycles 5 --invoices 2000
+    python -m benchmarks.loadtest --workers 4 --webhook-latency 0.3 --webhook-error-rate 0.05
+    python -m benchmarks.loadtest --async-mode --workers 1 --clients 200 --webhook-latency 1
+    python -m benchmarks.loadtest --soap --clients 20
+    python -m benchmarks.loadtest --url http://localhost:5000 --server-pid 1234
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from contextlib import closing
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape
+
+import requests
+
+from benchmarks.qbxml_generator import InvoiceGenerator
+from benchmarks.stub_webhook import StubWebhook
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NO_MATCH_STATUS = '1'
+QBWC_NS = '{http://developer.intuit.com/}'
+
+
+class SimulatedCompany:
+    def __init__(self, invoices: int, lines_per_invoice: int, seed: int):
+        """
+        Initialize a simulated QuickBooks company file
+        
+        Args:
+            invoices: Number of invoices returned by an InvoiceQuery
+            lines_per_invoice: Maximum line items per invoice
+            seed: Random seed for the invoice generator
+        """
+        self.invoices = invoices
+        self.generator = InvoiceGenerator(lines_per_invoice=lines_per_invoice, customer_ref_list_ratio=0.1,
+                                          missing_field_ratio=0.05, invalid_ratio=0.01, seed=seed)
+        self.iterators = {}  # iteratorID -> next invoice index
+    
+    def respond(self, request_xml: str) -> str:
+        """
+        Answer a QBXML request like QuickBooks would
+        
+        Args:
+            request_xml: QBXML document from sendRequestXML
+        
+        Returns:
+            QBXML response document
+        """
+        root = ET.fromstring(request_xml.encode('utf-8'))
+        parts = ['<?xml version="1.0" ?>\n<QBXML><QBXMLMsgsRs>']
+        for query in root.find('QBXMLMsgsRq'):
+            request_id = query.get('requestID', '1')
+            rs_tag = query.tag[:-len('Rq')] + 'Rs'
+            if query.tag != 'InvoiceQueryRq':
+                parts.append(f'<{rs_tag} requestID="{request_id}" statusCode="{NO_MATCH_STATUS}" '
+                             f'statusSeverity="Info" statusMessage="A query request did not find a matching object"/>')
+                continue
+            
+            max_returned = query.findtext('MaxReturned')
+            if query.get('iterator') is None or max_returned is None:
+                parts.extend(self.generator.iter_query_rs(self.invoices, request_id=request_id))
+                continue
+            
+            if query.get('iterator') == 'Start':
+                iterator_id = '{' + str(uuid.uuid4()) + '}'
+                first = 1
+            else:
+                iterator_id = query.get('iteratorID')
+                first = self.iterators.pop(iterator_id, self.invoices + 1)
+            count = max(0, min(int(max_returned), self.invoices - first + 1))
+            remaining = self.invoices - (first + count - 1)
+            if remaining > 0:
+                self.iterators[iterator_id] = first + count
+            parts.extend(self.generator.iter_query_rs(count, request_id=request_id, iterator_id=iterator_id,
+                                                      iterator_remaining=remaining, first_index=first))
+        parts.append('</QBXMLMsgsRs></QBXML>')
+        return ''.join(parts)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.cycles = 0
+        self.failed_cycles = 0
+        self._lock = threading.Lock()
+    
+    def record(self, action: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.latencies[action].append(seconds)
+            if not ok:
+                self.errors[action] += 1
+    
+    def cycle_done(self, ok: bool) -> None:
+        with self._lock:
+            self.cycles += 1
+            if not ok:
+                self.failed_cycles += 1
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class WebConnectorClient:
+    def __init__(self, base_url: str, username: str, password: str, company: SimulatedCompany,
+                 stats: Stats, timeout: float, use_soap: bool = False):
+        """
+        Initialize a simulated Web Connector
+        
+        Args:
+            base_url: Adapter base URL
+            username: QBWC username
+            password: QBWC password
+            company: Company file answering the queries
+            stats: Shared statistics
+            timeout: HTTP timeout in seconds
+            use_soap: Post SOAP envelopes like the real Web Connector
+                instead of query-string calls
+        """
+        self.url = base_url.rstrip('/') + '/qbwc'
+        self.username = username
+        self.password = password
+        self.company = company
+        self.stats = stats
+        self.timeout = timeout
+        self.use_soap = use_soap
+        self.http = requests.Session()
+        self.company_file = f"C:\\Company\\loadtest-{uuid.uuid4().hex[:8]}.qbw"
+    
+    def call(self, action: str, data: Optional[str] = None, **params) -> Optional[str]:
+        """Call one QBWC action; returns the response text or None on an HTTP error"""
+        if self.use_soap:
+            return self.call_soap(action, data, **params)
+        start = time.perf_counter()
+        try:
+            response = self.http.post(self.url, params={'action': action, **params},
+                                      data=data.encode('utf-8') if data else None, timeout=self.timeout)
+            ok = response.status_code == 200
+            text = response.text if ok else None
+        except requests.exceptions.RequestException:
+            ok, text = False, None
+        self.stats.record(action, time.perf_counter() - start, ok)
+        return text
+    
+    def call_soap(self, action: str, data: Optional[str] = None, **params) -> Optional[str]:
+        """Call one QBWC action as a SOAP envelope; returns the result like call()"""
+        if data is not None:
+            params['response'] = data
+        fields = ''.join(f'<{name}>{escape(str(value))}</{name}>' for name, value in params.items())
+        envelope = ('<?xml version="1.0" encoding="utf-8"?>'
+                    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+                    f'<soap:Body><{action} xmlns="http://developer.intuit.com/">{fields}</{action}>'
+                    '</soap:Body></soap:Envelope>')
+        start = time.perf_counter()
+        text = None
+        try:
+            response = self.http.post(self.url, data=envelope.encode('utf-8'), timeout=self.timeout, headers={
+                'Content-Type': 'text/xml; charset=utf-8',
+                'SOAPAction': f'"http://developer.intuit.com/{action}"'
+            })
+            ok = response.status_code == 200
+            if ok:
+                result = ET.fromstring(response.content).find(f'.//{QBWC_NS}{action}Result')
+                if action == 'authenticate':
+                    text = '\n'.join(value.text or '' for value in result.iter(f'{QBWC_NS}string'))
+                else:
+                    text = result.text or ''
+        except (requests.exceptions.RequestException, ET.ParseError, AttributeError):
+            ok, text = False, None
+        self.stats.record(action, time.perf_counter() - start, ok)
+        return text
+    
+    def run_cycle(self) -> bool:
+        """
+        Run one full sync session
+        
+        Returns:
+            True if the session reached 100% without errors
+        """
+        self.call('serverVersion')
+        self.call('clientVersion', strVersion='2.3.0.215')
+        auth = self.call('authenticate', strUserName=self.username, strPassword=self.password)
+        if not auth:
+            return False
+        ticket, status = (auth.split('\n') + ['', ''])[:2]
+        if status == 'nvu' or ticket == 'nvu':
+            return False
+        
+        ok = False
+        while True:
+            request_xml = self.call('sendRequestXML', ticket=ticket, strHCPResponse='',
+                                    strCompanyFileName=self.company_file)
+            if not request_xml:
+                self.call('getLastError', ticket=ticket)
+                break
+            response_xml = self.company.respond(request_xml)
+            progress = self.call('receiveResponseXML', data=response_xml, ticket=ticket,
+                                 hresult='', message='')
+            try:
+                progress = int(progress)
+            except (TypeError, ValueError):
+                break
+            if progress < 0:
+                self.call('getLastError', ticket=ticket)
+                break
+            if progress >= 100:
+                ok = True
+                break
+        self.call('closeConnection', ticket=ticket)
+        return ok
+
+
+def process_tree_rss(pid: int) -> int:
+    """Resident memory of a process and its children in bytes (Linux /proc)"""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.5):
+        super().__init__(name='memory-sampler', daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stopped = threading.Event()
+    
+    def stop(self) -> None:
+        self._stopped.set()
+    
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            rss = process_tree_rss(self.pid)
+            if rss:
+                self.samples.append(rss)
+            self._stopped.wait(self.interval)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(webhook_url: str, workers: int, password: str, extra_env: Dict[str, str],
+                 async_mode: bool = False) -> subprocess.Popen:
+    """Start the adapter (sync Flask app or async_app) under gunicorn with throwaway state files"""
+    workdir = tempfile.mkdtemp(prefix='qbwc-loadtest-')
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'N8N_WEBHOOK_URL': webhook_url,
+        'QBWC_PASS': password,
+        'SESSION_DB_PATH': os.path.join(workdir, 'sessions.db'),
+        'N8N_SPOOL_PATH': os.path.join(workdir, 'spool.db'),
+        'FINGERPRINT_DB_PATH': os.path.join(workdir, 'fingerprints.db'),
+        'WATERMARK_DB_PATH': os.path.join(workdir, 'watermarks.db'),
+        'METRICS_DIR': os.path.join(workdir, 'metrics')
+    })
+    env.update(extra_env)
+    log_path = os.path.join(workdir, 'server.log')
+    command = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--timeout', '300']
+    if async_mode:
+        command[3:4] = ['async_app:app', '--worker-class', 'aiohttp.GunicornWebWorker']
+    with open(log_path, 'w') as log_file:
+        process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    process.base_url = f'http://127.0.0.1:{port}'
+    process.log_path = log_path
+    process.spool_path = env['N8N_SPOOL_PATH']
+    
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}, see {log_path}")
+        try:
+            requests.get(process.base_url + '/health/live', timeout=1)
+            return process
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("gunicorn did not start within 30 seconds")
+
+
+def wait_for_drain(stub: StubWebhook, spool_path: Optional[str], timeout: float, quiet: float = 10.0) -> float:
+    """
+    Wait until the server's spool has delivered everything to the stub webhook
+    
+    Args:
+        stub: Stub webhook
+        spool_path: Spool database of a spawned server (None: wait until the
+            webhook has been quiet for `quiet` seconds)
+        timeout: Maximum seconds to wait
+        quiet: Quiet period used without a spool path
+    
+    Returns:
+        Seconds waited
+    """
+    start = time.monotonic()
+    last_requests, last_change = stub.requests, start
+    while time.monotonic() - start < timeout:
+        if spool_path and not os.path.exists(spool_path):
+            break  # Spool disabled, pushes happened inside the requests
+        if spool_path:
+            try:
+                with closing(sqlite3.connect(spool_path, timeout=5)) as conn:
+                    pending = conn.execute("SELECT COUNT(*) FROM spool WHERE delivered_at IS NULL").fetchone()[0]
+            except sqlite3.Error:
+                pending = None
+            if pending == 0:
+                break
+        else:
+            if stub.requests != last_requests:
+                last_requests, last_change = stub.requests, time.monotonic()
+            elif time.monotonic() - last_change >= quiet:
+                break
+        time.sleep(0.5)
+    return time.monotonic() - start
+
+
+def report(stats: Stats, stub: StubWebhook, elapsed: float, drain: float, memory: Optional[List[int]]) -> Dict:
+    """Print and return the load test summary"""
+    summary = {'elapsed_seconds': elapsed, 'drain_seconds': drain, 'cycles': stats.cycles,
+               'failed_cycles': stats.failed_cycles, 'actions': {}}
+    print(f"\n{'action':22s} {'count':>7s} {'errors':>7s} {'err%':>6s} "
+          f"{'p50 ms':>8s} {'p90 ms':>8s} {'p99 ms':>8s} {'max ms':>8s}")
+    for action, values in sorted(stats.latencies.items()):
+        values = sorted(values)
+        errors = stats.errors[action]
+        row = {
+            'count': len(values),
+            'errors': errors,
+            'error_rate': errors / len(values),
+            'p50_ms': percentile(values, 50) * 1000,
+            'p90_ms': percentile(values, 90) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'max_ms': values[-1] * 1000
+        }
+        summary['actions'][action] = row
+        print(f"{action:22s} {row['count']:7d} {errors:7d} {row['error_rate'] * 100:5.1f}% "
+              f"{row['p50_ms']:8.1f} {row['p90_ms']:8.1f} {row['p99_ms']:8.1f} {row['max_ms']:8.1f}")
+    
+    summary['webhook'] = {'requests': stub.requests, 'errors': stub.errors, 'records': stub.records,
+                          'bytes': stub.bytes_received}
+    print(f"\nCycles: {stats.cycles} ({stats.failed_cycles} failed) in {elapsed:.1f}s "
+          f"= {stats.cycles / elapsed:.2f} cycles/s")
+    print(f"Webhook: {stub.requests} requests ({stub.errors} injected errors), {stub.records} records, "
+          f"spool drained {drain:.1f}s after the last client finished")
+    if memory:
+        summary['server_memory_mb'] = {'peak': max(memory) / 2 ** 20, 'final': memory[-1] / 2 ** 20}
+        print(f"Server memory (RSS, all workers): peak {max(memory) / 2 ** 20:.1f} MB, "
+              f"final {memory[-1] / 2 ** 20:.1f} MB")
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load test /qbwc with simulated Web Connector clients')
+    parser.add_argument('--url', help='Adapter base URL (default: spawn gunicorn)')
+    parser.add_argument('--server-pid', type=int, help='Server pid to sample memory from when using --url')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers when spawning')
+    parser.add_argument('--async-mode', action='store_true', help='Spawn async_app (aiohttp workers)')
+    parser.add_argument('--soap', action='store_true', help='Post SOAP envelopes instead of query strings')
+    parser.add_argument('--clients', type=int, default=10, help='Concurrent Web Connector clients')
+    parser.add_argument('--cycles', type=int, default=3, help='Sync sessions per client')
+    parser.add_argument('--invoices', type=int, default=1000, help='Invoices per company file')
+    parser.add_argument('--lines', type=int, default=3, help='Maximum line items per invoice')
+    parser.add_argument('--username', default=os.environ.get('QBWC_USER', 'admin'))
+    parser.add_argument('--password', default=os.environ.get('QBWC_PASS', 'loadtest'))
+    parser.add_argument('--timeout', type=float, default=300, help='HTTP timeout per action (seconds)')
+    parser.add_argument('--webhook-latency', type=float, default=0.0, help='Stub webhook latency (seconds)')
+    parser.add_argument('--webhook-latency-jitter', type=float, default=0.0)
+    parser.add_argument('--webhook-error-rate', type=float, default=0.0, help='Share of webhook 500s')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='Extra environment for the spawned server (repeatable)')
+    parser.add_argument('--drain-timeout', type=float, default=120,
+                        help='Seconds to wait for spooled pushes after the clients finish')
+    parser.add_argument('--output', help='Write the summary as JSON to this file')
+    args = parser.parse_args()
+    
+    stub = StubWebhook(latency=args.webhook_latency, latency_jitter=args.webhook_latency_jitter,
+                       error_rate=args.webhook_error_rate).start()
+    server = None
+    sampler = None
+    try:
+        if args.url:
+            base_url = args.url
+            server_pid = args.server_pid
+            print(f"Using adapter at {base_url}; point its N8N_WEBHOOK_URL at {stub.url}")
+        else:
+            extra_env = dict(item.split('=', 1) for item in args.env)
+            server = spawn_server(stub.url, args.workers, args.password, extra_env, args.async_mode)
+            base_url = server.base_url
+            server_pid = server.pid
+            mode = 'async' if args.async_mode else 'sync'
+            print(f"Spawned gunicorn ({args.workers} {mode} workers) at {base_url}, log: {server.log_path}")
+        
+        if server_pid:
+            sampler = MemorySampler(server_pid)
+            sampler.start()
+        
+        stats = Stats()
+        
+        def client_loop(index: int) -> None:
+            company = SimulatedCompany(args.invoices, args.lines, seed=index)
+            client = WebConnectorClient(base_url, args.username, args.password, company, stats, args.timeout,
+                                        use_soap=args.soap)
+            for _ in range(args.cycles):
+                stats.cycle_done(client.run_cycle())
+        
+        print(f"Running {args.clients} clients x {args.cycles} cycles, {args.invoices} invoices each...")
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client_loop, args=(i,), daemon=True) for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        drain = wait_for_drain(stub, server.spool_path if server else None, args.drain_timeout)
+        
+        if sampler:
+            sampler.stop()
+        summary = report(stats, stub, elapsed, drain, sampler.samples if sampler else None)
+        summary['parameters'] = vars(args)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(summary, f, indent=2)
+            print(f"Summary written to {args.output}")
+    finally:
+        if server:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Synthetic QBXML generator
+
+Produces InvoiceQueryRs documents shaped like QuickBooks Desktop responses,
+with configurable size and shape (line items, single or repeated CustomerRef,
+missing optional fields, invalid records).
+
+Usage:
+    python -m benchmarks.qbxml_generator --invoices 50000 --lines 3 > invoices.xml
+"""
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+from xml.sax.saxutils import escape
+
+# Optional InvoiceRet fields that may be dropped to exercise missing-field handling
+OPTIONAL_FIELDS = ('DueDate', 'Memo', 'BalanceRemaining', 'Subtotal', 'BillAddress')
+
+CUSTOMER_NAMES = ('Acme Corp', 'Globex', 'Initech', 'Umbrella Ltd', 'Stark & Sons',
+                  'Wayne Enterprises', 'Hooli', 'Vandelay Industries')
+ITEM_NAMES = ('Consulting', 'Hardware:Router', 'Hardware:Switch', 'Support Plan', 'Shipping')
+
+
+class InvoiceGenerator:
+    def __init__(self, lines_per_invoice: int = 3, customer_ref_list_ratio: float = 0.0,
+                 missing_field_ratio: float = 0.0, invalid_ratio: float = 0.0, seed: int = 0):
+        """
+        Initialize invoice generator
+        
+        Args:
+            lines_per_invoice: Maximum InvoiceLineRet elements per invoice
+                (each invoice gets between 0 and this many)
+            customer_ref_list_ratio: Share of invoices with repeated CustomerRef elements
+            missing_field_ratio: Chance that each optional field is left out
+            invalid_ratio: Share of invoices that fail validation (no TxnID or
+                a negative total)
+            seed: Random seed, so documents are reproducible
+        """
+        self.lines_per_invoice = lines_per_invoice
+        self.customer_ref_list_ratio = customer_ref_list_ratio
+        self.missing_field_ratio = missing_field_ratio
+        self.invalid_ratio = invalid_ratio
+        self.random = random.Random(seed)
+        self.base_time = datetime(2024, 1, 1, 8, 0, 0)
+    
+    def _customer_ref(self, index: int) -> str:
+        name = CUSTOMER_NAMES[index % len(CUSTOMER_NAMES)]
+        return (f"<CustomerRef><ListID>80000{index % len(CUSTOMER_NAMES):03d}-1234567890</ListID>"
+                f"<FullName>{escape(name)}</FullName></CustomerRef>")
+    
+    def _line(self, invoice_index: int, line_index: int) -> str:
+        item = ITEM_NAMES[self.random.randrange(len(ITEM_NAMES))]
+        quantity = self.random.randint(1, 20)
+        rate = round(self.random.uniform(5, 500), 2)
+        return (
+            "<InvoiceLineRet>"
+            f"<TxnLineID>{invoice_index:X}-{line_index}</TxnLineID>"
+            f"<ItemRef><ListID>90000{line_index:03d}-1234567890</ListID><FullName>{escape(item)}</FullName></ItemRef>"
+            f"<Desc>{escape(item)} for order {invoice_index}</Desc>"
+            f"<Quantity>{quantity}</Quantity>"
+            f"<Rate>{rate:.2f}</Rate>"
+            f"<Amount>{quantity * rate:.2f}</Amount>"
+            "</InvoiceLineRet>"
+        )
+    
+    def invoice(self, index: int) -> str:
+        """
+        Generate one InvoiceRet element
+        
+        Args:
+            index: Invoice number, used for ids and timestamps
+        
+        Returns:
+            InvoiceRet XML string
+        """
+        rnd = self.random
+        txn_date = self.base_time + timedelta(minutes=index)
+        modified = txn_date + timedelta(days=rnd.randint(0, 30))
+        lines = [self._line(index, n) for n in range(rnd.randint(0, self.lines_per_invoice))]
+        subtotal = round(rnd.uniform(10, 10000), 2)
+        balance = 0.0 if rnd.random() < 0.5 else round(rnd.uniform(0, subtotal), 2)
+        
+        invalid = rnd.random() < self.invalid_ratio
+        total = -subtotal if invalid and rnd.random() < 0.5 else subtotal
+        txn_id = '' if invalid and total >= 0 else f"{index:X}-{1700000000 + index}"
+        
+        optional = {
+            'BillAddress': ("<BillAddress><Addr1>1 Main St</Addr1><City>Springfield</City>"
+                            "<State>IL</State><PostalCode>62701</PostalCode></BillAddress>"),
+            'DueDate': f"<DueDate>{(txn_date + timedelta(days=30)).date().isoformat()}</DueDate>",
+            'Subtotal': f"<Subtotal>{subtotal:.2f}</Subtotal>",
+            'BalanceRemaining': f"<BalanceRemaining>{balance:.2f}</BalanceRemaining>",
+            'Memo': f"<Memo>{escape('Order #%d & delivery' % index)}</Memo>"
+        }
+        for field in OPTIONAL_FIELDS:
+            if rnd.random() < self.missing_field_ratio:
+                optional[field] = ''
+        
+        customer_refs = self._customer_ref(index)
+        if rnd.random() < self.customer_ref_list_ratio:
+            customer_refs += self._customer_ref(index + 1)
+        
+        return (
+            "<InvoiceRet>"
+            + (f"<TxnID>{txn_id}</TxnID>" if txn_id else "")
+            + f"<TimeCreated>{txn_date.isoformat()}-05:00</TimeCreated>"
+            f"<TimeModified>{modified.isoformat()}-05:00</TimeModified>"
+            f"<EditSequence>{1700000000 + index}</EditSequence>"
+            f"<TxnNumber>{index}</TxnNumber>"
+            + customer_refs
+            + f"<TxnDate>{txn_date.date().isoformat()}</TxnDate>"
+            f"<RefNumber>INV-{index:06d}</RefNumber>"
+            + optional['BillAddress']
+            + "<IsPending>false</IsPending>"
+            + optional['DueDate']
+            + optional['Subtotal']
+            + f"<TotalAmount>{total:.2f}</TotalAmount>"
+            f"<AppliedAmount>{balance - subtotal:.2f}</AppliedAmount>"
+            + optional['BalanceRemaining']
+            + optional['Memo']
+            + f"<IsPaid>{'true' if balance == 0 else 'false'}</IsPaid>"
+            + ''.join(lines)
+            + "</InvoiceRet>"
+        )
+    
+    def iter_query_rs(self, count: int, request_id: str = '1', iterator_id: Optional[str] = None,
+                      iterator_remaining: int = 0, first_index: int = 1) -> Iterator[str]:
+        """
+        Generate one InvoiceQueryRs element piece by piece
+        
+        Args:
+            count: Number of InvoiceRet elements
+            request_id: requestID attribute of the InvoiceQueryRs
+            iterator_id: iteratorID attribute (optional, only set for paged responses)
+            iterator_remaining: iteratorRemainingCount attribute
+            first_index: Number of the first invoice (for consecutive pages)
+        
+        Yields:
+            XML string fragments
+        """
+        iterator_attrs = ''
+        if iterator_id:
+            iterator_attrs = f' iteratorRemainingCount="{iterator_remaining}" iteratorID="{iterator_id}"'
+        yield (f'<InvoiceQueryRs requestID="{request_id}" statusCode="0" statusSeverity="Info" '
+               f'statusMessage="Status OK"{iterator_attrs}>')
+        for index in range(first_index, first_index + count):
+            yield self.invoice(index)
+        yield '</InvoiceQueryRs>'
+    
+    def iter_response(self, count: int, **kwargs) -> Iterator[str]:
+        """
+        Generate a full QBXML response document piece by piece
+        
+        Args:
+            count: Number of InvoiceRet elements
+            **kwargs: Passed to iter_query_rs
+        
+        Yields:
+            XML string fragments
+        """
+        yield '<?xml version="1.0" ?>\n<QBXML><QBXMLMsgsRs>'
+        yield from self.iter_query_rs(count, **kwargs)
+        yield '</QBXMLMsgsRs></QBXML>'
+    
+    def response(self, count: int, **kwargs) -> str:
+        """Generate a full QBXML response document (see iter_response)"""
+        return ''.join(self.iter_response(count, **kwargs))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Generate a synthetic InvoiceQueryRs document')
+    parser.add_argument('--invoices', type=int, default=1000, help='Number of invoices')
+    parser.add_argument('--lines', type=int, default=3, help='Maximum line items per invoice')
+    parser.add_argument('--customer-ref-list-ratio', type=float, default=0.0)
+    parser.add_argument('--missing-field-ratio', type=float, default=0.0)
+    parser.add_argument('--invalid-ratio', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    generator = InvoiceGenerator(args.lines, args.customer_ref_list_ratio, args.missing_field_ratio,
+                                 args.invalid_ratio, args.seed)
+    for fragment in generator.iter_response(args.invoices):
+        sys.stdout.write(fragment)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Benchmark suite for the QBXML conversion pipeline
+
+Measures throughput and peak memory of XMLConverter.qbxml_to_json and of
+the full QBWCHandler.receive_response_xml -> N8NClient.push_data path
+against a local stub webhook, on synthetic InvoiceQueryRs documents.
+
+Each run is saved to benchmarks/results/<timestamp>.json; pass --compare
+with an earlier result to report changes and fail on regressions.
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --sizes 1000,50000 --repeat 5
+    python -m benchmarks.run --compare benchmarks/results/20240101-120000.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from benchmarks.qbxml_generator import InvoiceGenerator
+from benchmarks.stub_webhook import StubWebhook
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def measure(func: Callable[[], object], repeat: int) -> Dict:
+    """
+    Time a function and measure its peak Python memory
+    
+    Timed runs and the memory run are separate, since tracemalloc slows
+    allocation-heavy code down considerably.
+    
+    Args:
+        func: Function to benchmark
+        repeat: Number of timed runs
+    
+    Returns:
+        Dictionary with best and median seconds and peak memory in MB
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    
+    return {
+        'seconds': min(timings),
+        'seconds_median': statistics.median(timings),
+        'peak_memory_mb': peak / (1024 * 1024)
+    }
+
+
+def bench_conversion(document: str, count: int, streaming: bool, repeat: int, workers: int = 0) -> Dict:
+    """Benchmark XMLConverter.qbxml_to_json on one document (workers > 0: process pool)"""
+    from xml_converter import XMLConverter
+    converter = XMLConverter()
+    converter.streaming = streaming
+    converter.parallel.workers = workers
+    converter.parallel.min_chars = 0
+    
+    try:
+        # Start the pool outside the measurement
+        payload = json.loads(converter.qbxml_to_json(document))
+        result = measure(lambda: converter.qbxml_to_json(document), repeat)
+    finally:
+        converter.parallel.shutdown()
+    result['records_out'] = payload['count']
+    return result
+
+
+def bench_pipeline(document: str, count: int, stub: StubWebhook, repeat: int, stream_push: bool = False) -> Dict:
+    """Benchmark receive_response_xml including the push to the stub webhook (stream_push: NDJSON mode)"""
+    from companies import DEFAULT_COMPANY
+    from qbwc_handler import QBWCHandler
+    handler = QBWCHandler()
+    handler.stream_push = stream_push
+    company = handler.companies_by_name[DEFAULT_COMPANY]
+    
+    def run():
+        ticket = handler.authenticate(company.username, company.password).split('\n')[0]
+        handler.send_request_xml(ticket, '', 'benchmark.qbw')
+        progress = handler.receive_response_xml(ticket, document, '', '')
+        handler.close_connection(ticket)
+        if progress != '100':
+            raise RuntimeError(f"receive_response_xml returned {progress}")
+    
+    records_before = stub.records
+    result = measure(run, repeat)
+    result['records_out'] = (stub.records - records_before) // (repeat + 1)
+    return result
+
+
+def configure_environment(stub_url: str, workdir: str) -> None:
+    """Point the application at the stub webhook and throwaway state files"""
+    os.environ.update({
+        'N8N_WEBHOOK_URL': stub_url,
+        'QBWC_PASS': os.environ.get('QBWC_PASS', 'benchmark'),
+        'SESSION_STORE': 'memory',
+        # Push synchronously so the webhook round trip is part of the measurement
+        'N8N_SPOOL_ENABLED': 'false',
+        'FINGERPRINT_ENABLED': 'false',
+        'QBWC_INCREMENTAL_SYNC': 'false',
+        'QBWC_PAGE_SIZE': '0',
+        # Also quiets the conversion pool processes
+        'LOG_LEVEL': 'ERROR',
+        'METRICS_DIR': os.path.join(workdir, 'metrics')
+    })
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(RESULTS_DIR),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict, baseline_path: str, threshold: float) -> bool:
+    """
+    Print changes against an earlier run
+    
+    Args:
+        results: Results of this run
+        baseline_path: Path of an earlier results file
+        threshold: Allowed slowdown / memory growth in percent
+    
+    Returns:
+        True if no benchmark regressed beyond the threshold
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} ({baseline.get('git_commit')}, {baseline.get('timestamp')}):")
+    
+    ok = True
+    for name, current in results['results'].items():
+        previous = baseline['results'].get(name)
+        if not previous:
+            print(f"  {name}: no baseline")
+            continue
+        for metric in ('seconds', 'peak_memory_mb'):
+            change = (current[metric] - previous[metric]) / previous[metric] * 100 if previous[metric] else 0.0
+            regressed = change > threshold
+            ok = ok and not regressed
+            print(f"  {name} {metric}: {previous[metric]:.3f} -> {current[metric]:.3f} "
+                  f"({change:+.1f}%){'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the QBXML conversion pipeline')
+    parser.add_argument('--sizes', default='1000,10000,50000', help='Comma-separated invoice counts')
+    parser.add_argument('--lines', type=int, default=3, help='Maximum line items per invoice')
+    parser.add_argument('--customer-ref-list-ratio', type=float, default=0.1)
+    parser.add_argument('--missing-field-ratio', type=float, default=0.05)
+    parser.add_argument('--invalid-ratio', type=float, default=0.01)
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark')
+    parser.add_argument('--skip-pipeline', action='store_true', help='Only benchmark qbxml_to_json')
+    parser.add_argument('--parallel-workers', type=int, default=0,
+                        help='Also benchmark process-pool conversion with this many processes')
+    parser.add_argument('--ndjson', action='store_true',
+                        help='Also benchmark the pipeline with NDJSON streaming pushes')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Regression threshold in percent')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/<timestamp>.json)')
+    args = parser.parse_args()
+    
+    sizes = [int(size) for size in args.sizes.split(',')]
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    output = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json"))
+    workdir = tempfile.mkdtemp(prefix='qbwc-bench-')
+    stub = StubWebhook().start()
+    configure_environment(stub.url, workdir)
+    os.chdir(workdir)
+    # Per-invoice logs (including skipped-record warnings) would dominate the measurements
+    logging.getLogger().setLevel(logging.ERROR)
+    from utils import logger
+    logger.setLevel(logging.ERROR)
+    
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'results': {}
+    }
+    
+    generator_args = (args.lines, args.customer_ref_list_ratio, args.missing_field_ratio, args.invalid_ratio)
+    try:
+        for size in sizes:
+            document = InvoiceGenerator(*generator_args).response(size)
+            megabytes = len(document.encode('utf-8')) / (1024 * 1024)
+            
+            benchmarks = {
+                f'qbxml_to_json[streaming,{size}]': lambda: bench_conversion(document, size, True, args.repeat),
+                f'qbxml_to_json[xmltodict,{size}]': lambda: bench_conversion(document, size, False, args.repeat),
+            }
+            if args.parallel_workers:
+                benchmarks[f'qbxml_to_json[parallel{args.parallel_workers},{size}]'] = (
+                    lambda: bench_conversion(document, size, True, args.repeat, args.parallel_workers))
+            if not args.skip_pipeline:
+                benchmarks[f'receive_to_push[{size}]'] = lambda: bench_pipeline(document, size, stub, args.repeat)
+                if args.ndjson:
+                    benchmarks[f'receive_to_push[ndjson,{size}]'] = (
+                        lambda: bench_pipeline(document, size, stub, args.repeat, stream_push=True))
+            
+            for name, bench in benchmarks.items():
+                result = bench()
+                result.update({
+                    'invoices': size,
+                    'document_mb': megabytes,
+                    'invoices_per_sec': size / result['seconds'],
+                    'mb_per_sec': megabytes / result['seconds']
+                })
+                results['results'][name] = result
+                print(f"{name:40s} {result['seconds']:8.3f}s  {result['invoices_per_sec']:10.0f} inv/s  "
+                      f"{result['mb_per_sec']:7.1f} MB/s  peak {result['peak_memory_mb']:8.1f} MB")
+    finally:
+        stub.stop()
+    
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {output}")
+    
+    if baseline and not compare(results, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
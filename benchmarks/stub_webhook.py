@@ -0,0 +1,181 @@
+"""
+Local stub of the n8n webhook
+
+Accepts JSON and NDJSON streams (N8N_PUSH_MODE=ndjson, chunked uploads),
+optionally gzip-encoded, counts requests, records and bytes, and answers HEAD for connectivity checks. Latency and a share of
+HTTP 500 errors can be injected to mimic a slow or flaky n8n.
+
+Usage:
+    python -m benchmarks.stub_webhook --port 5678 --latency 0.2 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+    
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections are expected
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class StubWebhook:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 latency_jitter: float = 0.0, error_rate: float = 0.0):
+        """
+        Initialize stub webhook (call start() to serve in a background thread)
+        
+        Args:
+            host: Bind address
+            port: Bind port (0 picks a free port)
+            latency: Seconds to wait before answering a POST
+            latency_jitter: Random extra latency, up to this many seconds
+            error_rate: Share of POSTs answered with HTTP 500
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.records = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self.server = _QuietServer((host, port), self._handler_class())
+        self._thread = None
+    
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/webhook"
+    
+    def _handler_class(self):
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            
+            def do_POST(self):
+                if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                    body = self._iter_chunks()
+                else:
+                    body = [self.rfile.read(int(self.headers.get('Content-Length', 0)))]
+                status = stub.handle(body, self.headers.get('Content-Encoding'), self.headers.get('Content-Type'))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+            
+            def _iter_chunks(self):
+                while True:
+                    size = int(self.rfile.readline().split(b';')[0], 16)
+                    if not size:
+                        # Optional trailers, then the empty line
+                        while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                            pass
+                        return
+                    yield self.rfile.read(size)
+                    self.rfile.readline()
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    def handle(self, body, content_encoding: str = None, content_type: str = None) -> int:
+        """
+        Record one webhook call
+        
+        Args:
+            body: Raw request body chunks (read while parsing, like a streaming receiver)
+            content_encoding: Content-Encoding header
+            content_type: Content-Type header (application/x-ndjson: header
+                line followed by one record per line)
+        
+        Returns:
+            HTTP status code to answer with
+        """
+        raw_bytes = 0
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if content_encoding == 'gzip' else None
+        ndjson = (content_type or '').startswith('application/x-ndjson')
+        # NDJSON: header line, then one record per line
+        records = -1 if ndjson else 0
+        data = b''
+        for chunk in body:
+            raw_bytes += len(chunk)
+            data += inflater.decompress(chunk) if inflater else chunk
+            if ndjson:
+                *lines, data = data.split(b'\n')
+                for line in lines:
+                    json.loads(line)
+                    records += 1
+        if not ndjson:
+            records = len(json.loads(data).get('data', []))
+        
+        delay = self.latency + (random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.requests += 1
+                self.errors += 1
+            return 500
+        
+        with self._lock:
+            self.requests += 1
+            self.records += records
+            self.bytes_received += raw_bytes
+        return 200
+    
+    def start(self) -> 'StubWebhook':
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.server.serve_forever, name='stub-webhook', daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self) -> None:
+        """Stop serving"""
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def __enter__(self) -> 'StubWebhook':
+        return self.start()
+    
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run a local stub of the n8n webhook')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5678)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds before each answer')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='Random extra latency (seconds)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 500')
+    args = parser.parse_args()
+    
+    stub = StubWebhook(args.host, args.port, args.latency, args.latency_jitter, args.error_rate)
+    print(f"Stub webhook listening on {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Requests: {stub.requests}, errors: {stub.errors}, records: {stub.records}, "
+          f"bytes: {stub.bytes_received}")
+
+
+if __name__ == '__main__':
+    main()
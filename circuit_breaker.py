@@ -0,0 +1,205 @@
+"""
+Circuit breaker for the n8n webhook
+
+After N8N_CIRCUIT_FAILURE_THRESHOLD consecutive failures the circuit opens
+and pushes fail immediately instead of waiting on timeouts and retries.
+After a jittered, exponentially growing delay a single half-open probe is
+let through: success closes the circuit, failure opens it again for longer.
+One breaker per webhook URL is shared by every client in the process (sync
+and async clients, spool worker, health prober).
+"""
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+from utils import get_env_var, logger
+import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Numeric state for the metrics gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def jittered_backoff(attempt: int, base: float, maximum: float) -> float:
+    """
+    Exponential backoff with jitter ("equal jitter")
+
+    Args:
+        attempt: 0-based attempt number
+        base: Delay of the first attempt
+        maximum: Upper bound of the delay
+
+    Returns:
+        Delay in seconds between half and all of min(maximum, base * 2**attempt)
+    """
+    delay = min(maximum, base * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: Optional[int] = None,
+                 reset_timeout: Optional[float] = None, max_reset_timeout: Optional[float] = None,
+                 probe_timeout: Optional[float] = None):
+        """
+        Initialize circuit breaker
+
+        Args:
+            name: Name used in logs (e.g. the webhook URL)
+            failure_threshold: Consecutive failures that open the circuit
+                (optional, will use env var if not provided)
+            reset_timeout: Open time before the first half-open probe
+                (optional, will use env var if not provided)
+            max_reset_timeout: Upper bound of the open time, which doubles
+                on every failed probe (optional, will use env var if not provided)
+            probe_timeout: Seconds after which a probe that never reported
+                back is given up and another one is let through
+                (optional, will use env var if not provided)
+        """
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold or int(
+            get_env_var('N8N_CIRCUIT_FAILURE_THRESHOLD', default='5', required=False)))
+        self.reset_timeout = reset_timeout or float(
+            get_env_var('N8N_CIRCUIT_RESET_TIMEOUT', default='10', required=False))
+        self.max_reset_timeout = max_reset_timeout or float(
+            get_env_var('N8N_CIRCUIT_MAX_RESET_TIMEOUT', default='300', required=False))
+        self.probe_timeout = probe_timeout or float(
+            get_env_var('N8N_CIRCUIT_PROBE_TIMEOUT', default='300', required=False))
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._trips = 0
+        self._open_until = 0.0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+
+    @property
+    def state(self) -> str:
+        """Current state (an open circuit whose delay has passed reports half_open)"""
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._open_until:
+                return HALF_OPEN
+            return self._state
+
+    def allow_request(self) -> bool:
+        """
+        Check whether a call may go through
+
+        Returns:
+            True when closed, or for the single probe once the open delay has
+            passed; False while open or while a probe is in flight (for at
+            most probe_timeout seconds)
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self._state == OPEN:
+                if now < self._open_until:
+                    return False
+                self._transition(HALF_OPEN)
+            if self._probe_in_flight:
+                if now - self._probe_started < self.probe_timeout:
+                    return False
+                logger.warning(f"Probe to {self.name[:50]} did not report back within "
+                               f"{self.probe_timeout:g}s, sending another")
+            self._probe_in_flight = True
+            self._probe_started = now
+            return True
+
+    def release_probe(self) -> None:
+        """
+        End a call that was let through without recording an outcome
+
+        Callers run this when an attempt ends in an error that says nothing
+        about the target (e.g. the request body could not be produced), so a
+        half-open probe does not block every later call.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        """Record a successful call (closes the circuit)"""
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self._state != CLOSED:
+                self._trips = 0
+                self._opened_at = None
+                self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        """Record a failed call (opens the circuit at the threshold or on a failed probe)"""
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._probe_in_flight = False
+                self._open()
+
+    def retry_in(self) -> float:
+        """Seconds until the next probe is allowed (0 when closed or due)"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._open_until - time.monotonic())
+
+    def snapshot(self) -> Dict:
+        """
+        Get the breaker state for monitoring
+
+        Returns:
+            Dictionary with state, consecutive_failures, trips (consecutive
+            openings), opened_at and retry_in (seconds)
+        """
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'trips': self._trips,
+                'opened_at': self._opened_at,
+                'retry_in': round(max(0.0, self._open_until - time.monotonic()), 1) if self._state == OPEN else 0.0
+            }
+
+    def _open(self) -> None:
+        """Open the circuit for the next backoff delay (lock held)"""
+        delay = jittered_backoff(self._trips, self.reset_timeout, self.max_reset_timeout)
+        self._trips += 1
+        self._open_until = time.monotonic() + delay
+        self._opened_at = self._opened_at or datetime.now().isoformat()
+        self._transition(OPEN)
+        logger.warning(f"❌ Circuit to {self.name[:50]} opened after {self._failures} failures, "
+                       f"next probe in {delay:.1f}s")
+
+    def _transition(self, state: str) -> None:
+        """Change state (lock held)"""
+        if state == self._state:
+            return
+        if state == CLOSED:
+            logger.info(f"✅ Circuit to {self.name[:50]} closed")
+        self._state = state
+        metrics.N8N_CIRCUIT_TRANSITIONS.inc(state=state)
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """
+    Get the process-wide breaker for a target
+
+    Args:
+        name: Target name (webhook URL)
+
+    Returns:
+        Shared CircuitBreaker
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
@@ -0,0 +1,122 @@
+"""
+Per-company configuration
+
+Each QuickBooks company file syncs under its own Web Connector login, with
+its own webhook, entities, start date and sync interval. Companies are read
+from the JSON file named by COMPANIES_CONFIG:
+
+    [
+        {"name": "north", "username": "qbwc-north", "password_env": "QBWC_PASS_NORTH",
+         "company_file": "C:\\\\QB\\\\North.qbw", "webhook_url": "https://n8n.example.com/webhook/north",
+         "sync_entities": ["Invoice", "Customer"], "start_date": "2020-01-01",
+         "sync_interval": 3600, "max_concurrent": 1},
+        ...
+    ]
+
+Without the file, QBWC_USER/QBWC_PASS and N8N_WEBHOOK_URL form the single
+"default" company, exactly as before.
+"""
+import json
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional
+from utils import get_env_var, logger
+
+DEFAULT_COMPANY = 'default'
+
+
+@dataclass
+class CompanyConfig:
+    name: str
+    username: str
+    password: str
+    # Company file returned to QBWC by authenticate ('' = the file open in QuickBooks)
+    company_file: str = ''
+    # n8n webhook of this company (None = N8N_WEBHOOK_URL)
+    webhook_url: Optional[str] = None
+    # Entities synced in each session (None = QBWC_SYNC_ENTITIES)
+    sync_entities: Optional[List[str]] = None
+    # FromModifiedDate of the first sync
+    start_date: str = '2000-01-01'
+    # Minimum seconds between syncs, enforced by QBWC (0 = the .qwc schedule)
+    sync_interval: int = 0
+    # Conversions of this company running at once (None = SCHEDULER_MAX_PER_COMPANY)
+    max_concurrent: Optional[int] = None
+
+    @property
+    def namespace(self) -> str:
+        """Prefix of this company's watermark and fingerprint keys ('' for the default company)"""
+        return '' if self.name == DEFAULT_COMPANY else f"{self.name}/"
+
+
+def _company_from_dict(entry: Dict) -> CompanyConfig:
+    """
+    Build a company from one entry of the configuration file
+
+    Args:
+        entry: Company dictionary; "password_env" names an env var holding
+            the password, so the file itself can be free of secrets
+
+    Returns:
+        CompanyConfig
+
+    Raises:
+        ValueError: If the entry is incomplete or has unknown keys
+    """
+    entry = dict(entry)
+    password_env = entry.pop('password_env', None)
+    if password_env:
+        entry['password'] = get_env_var(password_env, required=True)
+    known = {f.name for f in fields(CompanyConfig)}
+    unknown = [key for key in entry if key not in known]
+    if unknown:
+        raise ValueError(f"Unknown company settings for {entry.get('name')}: {unknown}")
+    missing = [key for key in ('name', 'username', 'password') if not entry.get(key)]
+    if missing:
+        raise ValueError(f"Company {entry.get('name') or entry.get('username')} is missing {missing}")
+    if isinstance(entry.get('sync_entities'), str):
+        entry['sync_entities'] = [name.strip() for name in entry['sync_entities'].split(',') if name.strip()]
+    return CompanyConfig(**entry)
+
+
+def load_companies(config_path: Optional[str] = None) -> Dict[str, CompanyConfig]:
+    """
+    Load the configured companies
+
+    Args:
+        config_path: JSON configuration file (optional, will use env var if not provided)
+
+    Returns:
+        Companies by Web Connector username
+
+    Raises:
+        ValueError: If the configuration is invalid or no company is configured
+    """
+    config_path = config_path or get_env_var('COMPANIES_CONFIG', default='', required=False)
+    companies = []
+    if config_path:
+        with open(config_path, encoding='utf-8') as f:
+            entries = json.load(f)
+        companies = [_company_from_dict(entry) for entry in entries]
+
+    # QBWC_USER/QBWC_PASS stay usable next to the file, and are required without it
+    password = get_env_var('QBWC_PASS', required=not companies)
+    if password:
+        companies.insert(0, CompanyConfig(
+            name=DEFAULT_COMPANY,
+            username=get_env_var('QBWC_USER', default='admin', required=False),
+            password=password
+        ))
+
+    by_username = {}
+    names = set()
+    for company in companies:
+        if company.username in by_username:
+            raise ValueError(f"Duplicate company username: {company.username}")
+        if company.name in names:
+            raise ValueError(f"Duplicate company name: {company.name}")
+        by_username[company.username] = company
+        names.add(company.name)
+
+    if config_path:
+        logger.info(f"Loaded {len(by_username)} companies from {config_path}")
+    return by_username
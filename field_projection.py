@@ -0,0 +1,189 @@
+"""
+Field projection shared by the QBXML requests and the converter
+
+The fields sent to n8n for each entity decide both which *Ret elements
+QuickBooks is asked to return (IncludeRetElement, IncludeLineItems, OwnerID)
+and which elements the converter extracts, so QuickBooks generates, and the
+adapter parses, only what ends up in the payload.
+"""
+from typing import Dict, FrozenSet, Optional, Tuple, Type
+from records import Record, InvoiceRecord, CustomerRecord, PaymentRecord, ItemRecord, record_class
+from utils import get_env_var, logger
+
+# Record field -> *Ret elements it is parsed from, per entity, in payload order
+ENTITY_FIELDS = {
+    'Invoice': {
+        'ref_number': ('RefNumber',),
+        'txn_id': ('TxnID',),
+        'date': ('TxnDate',),
+        'due_date': ('DueDate',),
+        'subtotal': ('Subtotal',),
+        'total_amount': ('TotalAmount',),
+        'balance_remaining': ('BalanceRemaining',),
+        'customer': ('CustomerRef',),
+        'memo': ('Memo',),
+        'is_paid': ('BalanceRemaining',),
+        'line_items': ('InvoiceLineRet',),
+        'custom_fields': ('DataExtRet',),
+    },
+    'Customer': {
+        'list_id': ('ListID',),
+        'name': ('Name',),
+        'full_name': ('FullName',),
+        'is_active': ('IsActive',),
+        'company_name': ('CompanyName',),
+        'email': ('Email',),
+        'phone': ('Phone',),
+        'balance': ('Balance',),
+        'total_balance': ('TotalBalance',),
+        'custom_fields': ('DataExtRet',),
+    },
+    'ReceivePayment': {
+        'txn_id': ('TxnID',),
+        'ref_number': ('RefNumber',),
+        'date': ('TxnDate',),
+        'customer': ('CustomerRef',),
+        'total_amount': ('TotalAmount',),
+        'payment_method': ('PaymentMethodRef',),
+        'memo': ('Memo',),
+        'applied_to': ('AppliedToTxnRet',),
+        'custom_fields': ('DataExtRet',),
+    },
+    'Item': {
+        'list_id': ('ListID',),
+        'name': ('Name',),
+        'full_name': ('FullName',),
+        'is_active': ('IsActive',),
+        'description': ('SalesDesc', 'SalesOrPurchase', 'SalesAndPurchase'),
+        'price': ('SalesPrice', 'SalesOrPurchase', 'SalesAndPurchase'),
+        'quantity_on_hand': ('QuantityOnHand',),
+        'item_type': (),
+        'custom_fields': ('DataExtRet',),
+    },
+}
+
+# Record class of each entity's default projection
+DEFAULT_RECORDS = {
+    'Invoice': InvoiceRecord,
+    'Customer': CustomerRecord,
+    'ReceivePayment': PaymentRecord,
+    'Item': ItemRecord,
+}
+
+# Fields every projection keeps (ids and what the validators check)
+REQUIRED_FIELDS = {
+    'Invoice': ('ref_number', 'txn_id', 'date', 'total_amount'),
+    'Customer': ('list_id', 'full_name'),
+    'ReceivePayment': ('txn_id', 'date', 'total_amount'),
+    'Item': ('list_id', 'full_name', 'item_type'),
+}
+
+# Elements always requested: sync watermark and change detection
+TRACKING_ELEMENTS = ('TimeModified', 'EditSequence')
+
+# Fields that need IncludeLineItems in the query
+LINE_ITEM_FIELDS = {'line_items', 'applied_to'}
+
+
+class FieldProjection:
+    def __init__(self, fields: Optional[Dict[str, Tuple[str, ...]]] = None):
+        """
+        Initialize the projection of each entity from QBXML_FIELDS_<ENTITY> env vars
+
+        Args:
+            fields: Record fields per entity (optional, will use env vars if not provided)
+        """
+        # Ask QuickBooks for the projected elements only (IncludeRetElement)
+        self.include_ret_elements = get_env_var('QBXML_INCLUDE_RET_ELEMENTS', default='true',
+                                                required=False).lower() == 'true'
+        # OwnerID of the custom fields returned when 'custom_fields' is projected (0 = public fields)
+        self.owner_id = get_env_var('QBXML_OWNER_ID', default='0', required=False)
+        self._fields = {}
+        self._elements = {}
+        self._ret_elements = {}
+        self._records = {}
+        self._query_elements = {}
+        for entity, catalogue in ENTITY_FIELDS.items():
+            if fields is not None:
+                requested = list(fields.get(entity, DEFAULT_RECORDS[entity].__slots__))
+            else:
+                default = ','.join(DEFAULT_RECORDS[entity].__slots__)
+                requested = [
+                    name.strip() for name in
+                    get_env_var(f'QBXML_FIELDS_{entity.upper()}', default=default, required=False).split(',')
+                    if name.strip()
+                ]
+            unknown = [name for name in requested if name not in catalogue]
+            if unknown:
+                raise ValueError(f"Unknown QBXML_FIELDS_{entity.upper()}: {unknown} "
+                                 f"(supported: {', '.join(catalogue)})")
+            # Payload order follows the catalogue, whatever order the env var lists
+            selected = set(requested) | set(REQUIRED_FIELDS[entity])
+            projected = tuple(name for name in catalogue if name in selected)
+            self._fields[entity] = projected
+            self._records[entity] = record_class(DEFAULT_RECORDS[entity], projected)
+            elements = [element for name in projected for element in catalogue[name]] + list(TRACKING_ELEMENTS)
+            self._ret_elements[entity] = tuple(dict.fromkeys(elements))
+            self._elements[entity] = frozenset(elements)
+            self._query_elements[entity] = self._build_query_elements(entity)
+            if projected != DEFAULT_RECORDS[entity].__slots__:
+                logger.info(f"{entity} field projection: {', '.join(projected)}")
+
+    def entities(self) -> Tuple[str, ...]:
+        """Return the entities with a projection"""
+        return tuple(self._fields)
+
+    def fields(self, entity: str) -> Tuple[str, ...]:
+        """Return the projected record fields of an entity, in payload order"""
+        return self._fields[entity]
+
+    def wants(self, entity: str, field: str) -> bool:
+        """Return True if the field is part of the entity's projection"""
+        return field in self._fields[entity]
+
+    def elements(self, entity: str) -> FrozenSet[str]:
+        """Return the *Ret child elements the converter extracts for an entity"""
+        return self._elements[entity]
+
+    def record_class(self, entity: str) -> Type[Record]:
+        """Return the record class holding exactly the projected fields"""
+        return self._records[entity]
+
+    def make_record(self, entity: str, values: Dict) -> Record:
+        """
+        Build a projected record
+
+        Args:
+            entity: Entity name
+            values: Parsed values, at least one per projected field
+
+        Returns:
+            Record with the projected fields only
+        """
+        return self._records[entity](**{name: values[name] for name in self._fields[entity]})
+
+    def query_elements(self, entity: str) -> str:
+        """Return the IncludeLineItems/IncludeRetElement/OwnerID lines for the entity's query"""
+        return self._query_elements[entity]
+
+    def _build_query_elements(self, entity: str) -> str:
+        """
+        Build the query elements selecting what QuickBooks returns
+
+        Args:
+            entity: Entity name
+
+        Returns:
+            Request lines (schema order), empty when nothing needs selecting
+        """
+        fields = self._fields[entity]
+        lines = []
+        if LINE_ITEM_FIELDS.intersection(fields):
+            lines.append("<IncludeLineItems>true</IncludeLineItems>")
+        if self.include_ret_elements:
+            # Names of direct children of the *Ret element
+            lines.extend(f"<IncludeRetElement>{element}</IncludeRetElement>"
+                         for element in self._ret_elements[entity])
+        if 'custom_fields' in fields:
+            lines.append(f"<OwnerID>{self.owner_id}</OwnerID>")
+        return "\n".join(f"      {line}" for line in lines)
@@ -0,0 +1,109 @@
+"""
+Change-detection index of records already pushed to n8n
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils import get_env_var, logger
+
+# SQLite limits the number of bound parameters per statement
+_QUERY_BATCH_SIZE = 500
+
+
+def fingerprint_record(record) -> str:
+    """
+    Hash the parsed fields of a record
+
+    Args:
+        record: Parsed record (records.Record or dictionary)
+
+    Returns:
+        Hex digest that changes whenever a parsed field changes
+    """
+    if hasattr(record, 'to_dict'):
+        record = record.to_dict()
+    encoded = json.dumps(record, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class FingerprintIndex:
+    def __init__(self, db_path: Optional[str] = None, max_entries: Optional[int] = None):
+        """
+        Initialize fingerprint index
+
+        Args:
+            db_path: SQLite database path (optional, will use env var if not provided)
+            max_entries: Maximum number of records kept; least recently seen
+                records are evicted first (optional, will use env var if not provided)
+        """
+        self.db_path = db_path or get_env_var('FINGERPRINT_DB_PATH', default='fingerprints.db', required=False)
+        self.max_entries = max_entries or int(get_env_var('FINGERPRINT_MAX_ENTRIES', default='200000', required=False))
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                " txn_id TEXT PRIMARY KEY,"
+                " edit_sequence TEXT,"
+                " fingerprint TEXT NOT NULL,"
+                " last_seen REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS fingerprints_last_seen ON fingerprints (last_seen)")
+        logger.info(f"Fingerprint index initialized at: {self.db_path} (max {self.max_entries} entries)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new SQLite connection (connections are not shared between threads)"""
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get_many(self, txn_ids: List[str]) -> Dict[str, str]:
+        """
+        Look up stored fingerprints
+
+        Args:
+            txn_ids: Record ids (TxnID)
+
+        Returns:
+            Dictionary of txn_id -> fingerprint for known records
+        """
+        known = {}
+        with closing(self._connect()) as conn:
+            for start in range(0, len(txn_ids), _QUERY_BATCH_SIZE):
+                batch = txn_ids[start:start + _QUERY_BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                known.update(conn.execute(
+                    f"SELECT txn_id, fingerprint FROM fingerprints WHERE txn_id IN ({placeholders})",
+                    batch
+                ).fetchall())
+        return known
+
+    def commit(self, fingerprints: Iterable[Tuple[str, Optional[str], str]]) -> None:
+        """
+        Store fingerprints of records that reached n8n, then evict the oldest
+        entries beyond max_entries
+
+        Args:
+            fingerprints: (txn_id, edit_sequence, fingerprint) tuples
+        """
+        now = time.time()
+        rows = [(txn_id, edit_sequence, fingerprint, now) for txn_id, edit_sequence, fingerprint in fingerprints]
+        if not rows:
+            return
+
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (txn_id, edit_sequence, fingerprint, last_seen) "
+                "VALUES (?, ?, ?, ?)",
+                rows
+            )
+            count = conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM fingerprints WHERE txn_id IN "
+                    "(SELECT txn_id FROM fingerprints ORDER BY last_seen LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+                logger.info(f"Fingerprint index evicted {count - self.max_entries} entries")
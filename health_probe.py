@@ -0,0 +1,157 @@
+"""
+Background health prober
+
+Checks configuration, n8n reachability, session count and spool depth on a
+schedule and caches the result, so health endpoints answer instantly without
+calling n8n on every request.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+from utils import get_env_var, logger
+
+
+class HealthProber(threading.Thread):
+    def __init__(self, qbwc_handler, interval: Optional[float] = None):
+        """
+        Initialize health prober
+
+        Args:
+            qbwc_handler: QBWCHandler whose sessions, spool and n8n client are checked
+            interval: Seconds between probes (optional, will use env var if not provided)
+        """
+        super().__init__(name='health-prober', daemon=True)
+        self.qbwc_handler = qbwc_handler
+        self.interval = interval or float(get_env_var('HEALTH_PROBE_INTERVAL', default='30', required=False))
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        # Cheap checks right away; n8n is probed by the background thread
+        self._state = self._probe(check_n8n=False)
+
+    def stop(self) -> None:
+        """Stop the prober"""
+        self._stopped.set()
+
+    def run(self) -> None:
+        """Probe until stopped"""
+        while not self._stopped.is_set():
+            try:
+                state = self._probe(check_n8n=True)
+                with self._lock:
+                    self._state = state
+            except Exception as e:
+                logger.error(f"Error in health prober: {e}", exc_info=True)
+            self._stopped.wait(self.interval)
+
+    def snapshot(self) -> dict:
+        """
+        Get the cached health state
+
+        Returns:
+            Copy of the last probe result, with 'stale' set when the prober
+            has not completed a probe for three intervals; the circuit breaker
+            state is always current
+        """
+        with self._lock:
+            state = dict(self._state)
+            state['checks'] = dict(self._state['checks'])
+        state['stale'] = time.monotonic() - state.pop('_probed_at') > 3 * self.interval
+        state['checks']['n8n_circuit'] = self.qbwc_handler.n8n_client.breaker.snapshot()
+        return state
+
+    def health_report(self) -> tuple:
+        """
+        Build the /health response from the cached state
+        
+        Returns:
+            (response dictionary, HTTP status code)
+        """
+        state = self.snapshot()
+        report = {
+            'status': state['status'],
+            'timestamp': datetime.now().isoformat(),
+            'version': '1.0.0',
+            'checked_at': state['checked_at'],
+            'stale': state['stale'],
+            'checks': state['checks']
+        }
+        return report, 200 if state['status'] == 'ok' else 503
+    
+    def readiness_report(self) -> tuple:
+        """
+        Build the /health/ready response: configuration is valid and the
+        prober is up to date
+        
+        Returns:
+            (response dictionary, HTTP status code)
+        """
+        state = self.snapshot()
+        ready = state['ready'] and not state['stale']
+        report = {
+            'status': 'ready' if ready else 'not_ready',
+            'checked_at': state['checked_at'],
+            'stale': state['stale'],
+            'queue_depth': state['checks'].get('queue_depth'),
+            'sessions': state['checks'].get('sessions'),
+            'n8n': state['checks'].get('n8n'),
+            'n8n_circuit': state['checks']['n8n_circuit']['state']
+        }
+        return report, 200 if ready else 503
+    
+    def _probe(self, check_n8n: bool) -> dict:
+        """
+        Run all checks once
+
+        Args:
+            check_n8n: Whether to contact the n8n webhook
+
+        Returns:
+            Health state dictionary
+        """
+        checks = {}
+        config_ok = True
+
+        # Check environment variables
+        try:
+            get_env_var('N8N_WEBHOOK_URL', required=True)
+            if not self.qbwc_handler.companies:
+                raise ValueError("No company configured (QBWC_PASS or COMPANIES_CONFIG)")
+            checks['env_vars'] = 'ok'
+        except ValueError as e:
+            checks['env_vars'] = f'error: {str(e)}'
+            config_ok = False
+
+        # Check n8n connectivity (informational, the spool absorbs outages)
+        n8n_client = self.qbwc_handler.n8n_client
+        if check_n8n:
+            try:
+                n8n_client.check_connectivity()
+                checks['n8n'] = 'reachable'
+            except Exception as e:
+                checks['n8n'] = f'unreachable: {str(e)[:50]}'
+                # Failed probes count towards opening the shared circuit, so pushes
+                # fail fast even before a sync has hit the outage
+                n8n_client.breaker.record_failure()
+        else:
+            checks['n8n'] = 'pending'
+
+        # Check active sessions and undelivered payloads
+        try:
+            checks['sessions'] = len(self.qbwc_handler.sessions)
+        except Exception as e:
+            checks['sessions'] = f'error: {str(e)[:50]}'
+            config_ok = False
+        try:
+            spool = self.qbwc_handler.spool
+            checks['queue_depth'] = spool.pending_count() if spool else 0
+        except Exception as e:
+            checks['queue_depth'] = f'error: {str(e)[:50]}'
+
+        return {
+            'status': 'ok' if config_ok else 'degraded',
+            'ready': config_ok,
+            'checked_at': datetime.now().isoformat(),
+            '_probed_at': time.monotonic(),
+            'checks': checks
+        }
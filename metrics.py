@@ -0,0 +1,329 @@
+"""
+Prometheus-style metrics shared across gunicorn workers
+
+Each process updates in-memory counters and histograms (one small lock per
+metric, no I/O on the hot path) and a background thread periodically writes a
+snapshot to METRICS_DIR/metrics_<pid>.json. The /metrics endpoint merges the
+snapshots of every worker on the host and renders the Prometheus text format.
+Snapshots of workers that exited are folded into METRICS_DIR/metrics_dead.json
+while merging, so counters and histograms keep their totals when gunicorn
+recycles workers (gauge values of dead workers are dropped).
+"""
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+from utils import get_env_var, logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock around metrics_dead.json
+    fcntl = None
+
+# Default latency buckets (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Request body size buckets (bytes)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8)
+# Accumulated counters and histograms of workers that exited
+DEAD_SNAPSHOT = 'metrics_dead.json'
+
+_registry = []
+
+
+class _Metric:
+    metric_type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """
+        Initialize metric and register it
+
+        Args:
+            name: Metric name
+            documentation: HELP text
+            labelnames: Label names, values are passed as keyword arguments
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def snapshot(self) -> dict:
+        """Return a JSON-serializable copy of the metric values"""
+        with self._lock:
+            values = [[list(key), self._copy_value(value)] for key, value in self._values.items()]
+        return {
+            'type': self.metric_type,
+            'help': self.documentation,
+            'labelnames': list(self.labelnames),
+            'values': values
+        }
+
+    def _copy_value(self, value):
+        return value
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Increment the counter for a label set"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        """Record an observation for a label set"""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            entry['counts'][index] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the wrapped block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        data = super().snapshot()
+        data['buckets'] = list(self.buckets)
+        return data
+
+    def _copy_value(self, value):
+        return {'counts': list(value['counts']), 'sum': value['sum'], 'count': value['count']}
+
+
+# QBWC endpoint
+QBWC_REQUESTS = Counter('qbwc_requests_total', 'QBWC actions handled', ('action', 'status'))
+QBWC_REQUEST_DURATION = Histogram('qbwc_request_duration_seconds', 'QBWC action latency', ('action',))
+QBWC_BODY_BYTES = Histogram('qbwc_request_body_bytes', 'QBWC request body size', ('action',), SIZE_BUCKETS)
+
+# Conversion
+QBXML_PARSE_DURATION = Histogram('qbxml_parse_duration_seconds', 'QBXML response conversion time')
+QBXML_RECORDS_PARSED = Counter('qbxml_records_parsed_total', 'Records parsed and validated', ('type',))
+QBXML_RECORDS_SKIPPED = Counter('qbxml_records_skipped_total', 'Records skipped by parsing or validation', ('type',))
+QBXML_CONVERSION_WAIT = Histogram('qbxml_conversion_wait_seconds', 'Time spent waiting for a conversion slot')
+
+# n8n delivery
+N8N_PUSH_DURATION = Histogram('n8n_push_duration_seconds', 'push_data latency', ('outcome',))
+N8N_PUSH_ATTEMPTS = Counter('n8n_push_attempts_total', 'HTTP attempts to the n8n webhook', ('outcome',))
+N8N_PUSHES = Counter('n8n_pushes_total', 'push_data calls', ('outcome',))
+N8N_CIRCUIT_TRANSITIONS = Counter('n8n_circuit_transitions_total', 'n8n circuit breaker state changes', ('state',))
+
+
+def _metrics_dir() -> str:
+    path = get_env_var('METRICS_DIR', default=os.path.join(tempfile.gettempdir(), 'qbwc_metrics'),
+                       required=False)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _process_alive(pid: str) -> bool:
+    """Return True if the process that wrote a snapshot is still running (on this host)"""
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        # Running under another user
+        pass
+    return True
+
+
+def _read_snapshot(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(directory: str, path: str, data: dict) -> None:
+    """Write a snapshot file (atomic rename)"""
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics_')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _retire_snapshot(directory: str, filename: str) -> None:
+    """
+    Fold the snapshot of a worker that exited into metrics_dead.json and delete it
+
+    gunicorn restarts workers with new pids; keeping their counts makes the
+    summed counters monotonic, as Prometheus expects.
+    """
+    path = os.path.join(directory, filename)
+    dead_path = os.path.join(directory, DEAD_SNAPSHOT)
+    lock_file = open(os.path.join(directory, 'metrics_dead.lock'), 'a')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # Another worker rendering /metrics may have retired it meanwhile
+        if not os.path.exists(path):
+            return
+        try:
+            snapshot = _read_snapshot(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Discarding unreadable metrics snapshot {filename}: {e}")
+            snapshot = {}
+        snapshot = {name: data for name, data in snapshot.items() if data['type'] != 'gauge'}
+        if snapshot:
+            dead = _read_snapshot(dead_path) if os.path.exists(dead_path) else {}
+            _write_json(directory, dead_path, _unmerge(_merge([dead, snapshot])))
+        os.remove(path)
+        logger.info(f"Folded metrics snapshot of exited worker {filename} into {DEAD_SNAPSHOT}")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not retire metrics snapshot {path}: {e}")
+    finally:
+        lock_file.close()
+
+
+def write_snapshot() -> None:
+    """Write this process's metrics to METRICS_DIR (atomic rename)"""
+    directory = _metrics_dir()
+    path = os.path.join(directory, f"metrics_{os.getpid()}.json")
+    _write_json(directory, path, {metric.name: metric.snapshot() for metric in _registry})
+
+
+class MetricsFlusher(threading.Thread):
+    def __init__(self, interval: Optional[float] = None):
+        """
+        Initialize periodic snapshot writer
+
+        Args:
+            interval: Seconds between snapshots (optional, will use env var if not provided)
+        """
+        super().__init__(name='metrics-flusher', daemon=True)
+        self.interval = interval or float(get_env_var('METRICS_FLUSH_INTERVAL', default='5', required=False))
+        self._stopped = threading.Event()
+
+    def stop(self) -> None:
+        """Stop the flusher"""
+        self._stopped.set()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                write_snapshot()
+            except Exception as e:
+                logger.error(f"Error writing metrics snapshot: {e}", exc_info=True)
+
+
+def _merge(snapshots: List[dict]) -> Dict[str, dict]:
+    """Sum counters and histogram buckets of the same metric/labels across processes"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, data in snapshot.items():
+            target = merged.setdefault(name, {**data, 'values': {}})
+            for labels, value in data['values']:
+                key = tuple(labels)
+                if data['type'] == 'histogram':
+                    current = target['values'].get(key)
+                    if current is None or len(current['counts']) != len(value['counts']):
+                        target['values'][key] = value
+                    else:
+                        current['counts'] = [a + b for a, b in zip(current['counts'], value['counts'])]
+                        current['sum'] += value['sum']
+                        current['count'] += value['count']
+                else:
+                    target['values'][key] = target['values'].get(key, 0) + value
+    return merged
+
+
+def _unmerge(merged: Dict[str, dict]) -> Dict[str, dict]:
+    """Turn merged metrics back into the snapshot layout (values as [labels, value] pairs)"""
+    return {name: {**data, 'values': [[list(key), value] for key, value in data['values'].items()]}
+            for name, data in merged.items()}
+
+
+def _format_labels(labelnames: List[str], labels: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, labels))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render_metrics(gauges: Optional[Dict[str, Tuple[str, float]]] = None) -> str:
+    """
+    Render metrics of every worker on the host in Prometheus text format
+
+    Args:
+        gauges: Extra point-in-time gauges computed by the caller,
+            name -> (help text, value)
+
+    Returns:
+        Prometheus exposition text (version 0.0.4)
+    """
+    write_snapshot()
+    directory = _metrics_dir()
+    filenames = [filename for filename in os.listdir(directory)
+                 if filename.startswith('metrics_') and filename.endswith('.json')]
+    for filename in filenames:
+        if filename != DEAD_SNAPSHOT and not _process_alive(filename[len('metrics_'):-len('.json')]):
+            _retire_snapshot(directory, filename)
+    # List again: the retired counts are now in metrics_dead.json
+    snapshots = []
+    for filename in os.listdir(directory):
+        if not filename.startswith('metrics_') or not filename.endswith('.json'):
+            continue
+        try:
+            snapshots.append(_read_snapshot(os.path.join(directory, filename)))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable metrics snapshot {filename}: {e}")
+
+    lines = []
+    for name, data in sorted(_merge(snapshots).items()):
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['type']}")
+        labelnames = data['labelnames']
+        for labels, value in sorted(data['values'].items()):
+            if data['type'] != 'histogram':
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(data['buckets']) + [float('inf')], value['counts']):
+                cumulative += count
+                le = _format_number(bound) if bound != float('inf') else '+Inf'
+                lines.append(f"{name}_bucket{_format_labels(labelnames, labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_number(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels)} {value['count']}")
+
+    for name, (documentation, value) in sorted((gauges or {}).items()):
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_format_number(value)}")
+
+    return '\n'.join(lines) + '\n'
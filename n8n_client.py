@@ -1,8 +1,44 @@
 import requests
+import gzip
 import json
+import threading
 import time
-from typing import Optional
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+from requests.adapters import HTTPAdapter
+from records import Payload, dumps
+from circuit_breaker import get_circuit_breaker, jittered_backoff
 from utils import get_env_var, logger
+import metrics
+import tracing
+
+# Shared keep-alive sessions, one per pool configuration
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_http_session(pool_size: int) -> requests.Session:
+    """
+    Get the process-wide HTTP session with a keep-alive connection pool
+    
+    Args:
+        pool_size: Maximum number of pooled connections per host
+    
+    Returns:
+        Shared requests.Session
+    """
+    with _sessions_lock:
+        session = _sessions.get(pool_size)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=False)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[pool_size] = session
+        return session
+
 
 class N8NClient:
     def __init__(self, webhook_url: Optional[str] = None):
@@ -16,14 +52,31 @@ class N8NClient:
         self.timeout = int(get_env_var('N8N_TIMEOUT', default='30', required=False))
         self.max_retries = int(get_env_var('N8N_MAX_RETRIES', default='3', required=False))
         self.retry_delay = int(get_env_var('N8N_RETRY_DELAY', default='2', required=False))
+        # Retries back off exponentially (with jitter) from retry_delay up to this
+        self.retry_max_delay = float(get_env_var('N8N_RETRY_MAX_DELAY', default='30', required=False))
+        # Seconds a chunk may spend in attempts and waits before retries stop
+        self.retry_budget = float(get_env_var('N8N_RETRY_BUDGET', default='30', required=False))
+        self.connect_timeout = float(get_env_var('N8N_CONNECT_TIMEOUT', default='5', required=False))
+        self.read_timeout = float(get_env_var('N8N_READ_TIMEOUT', default=str(self.timeout), required=False))
+        self.pool_size = int(get_env_var('N8N_POOL_SIZE', default='10', required=False))
+        self.gzip_enabled = get_env_var('N8N_GZIP', default='false', required=False).lower() == 'true'
+        # Bodies smaller than this are sent uncompressed
+        self.gzip_min_bytes = int(get_env_var('N8N_GZIP_MIN_BYTES', default='1024', required=False))
+        self.session = get_http_session(self.pool_size)
+        # Chunking of large batches (0 disables the limit)
+        self.chunk_size = int(get_env_var('N8N_CHUNK_SIZE', default='500', required=False))
+        self.chunk_max_bytes = int(get_env_var('N8N_CHUNK_MAX_BYTES', default='0', required=False))
+        self.max_parallel_chunks = max(1, int(get_env_var('N8N_MAX_PARALLEL_CHUNKS', default='4', required=False)))
+        # Shared with every client of this webhook in the process (and the health prober)
+        self.breaker = get_circuit_breaker(self.webhook_url)
         logger.info(f"N8N Client initialized with URL: {self.webhook_url[:50]}...")
     
-    def _send_request(self, data: dict) -> bool:
+    def _send_request(self, body: bytes) -> bool:
         """
         Send request to n8n webhook (internal method)
         
         Args:
-            data: Data dictionary to send
+            body: Serialized JSON payload
         
         Returns:
             True if successful
@@ -31,80 +84,420 @@ class N8NClient:
         Raises:
             requests.exceptions.RequestException: If request fails
         """
-        response = requests.post(
-            self.webhook_url,
-            json=data,
-            headers={'Content-Type': 'application/json'},
-            timeout=self.timeout
-        )
-        response.raise_for_status()
+        body, headers = self._prepare_body(body)
+        with tracing.span('n8n.post', bytes=len(body), gzip='Content-Encoding' in headers) as attributes:
+            response = self.session.post(
+                self.webhook_url,
+                data=body,
+                headers=headers,
+                timeout=(self.connect_timeout, self.read_timeout)
+            )
+            attributes['status'] = response.status_code
+            response.raise_for_status()
+        return True
+    
+    def _prepare_body(self, body: bytes) -> tuple:
+        """
+        Prepare a serialized payload for the webhook
+        
+        Args:
+            body: Serialized JSON payload
+        
+        Returns:
+            (body bytes, headers), gzip-compressed when enabled and large enough
+        """
+        headers = {'Content-Type': 'application/json'}
+        if self.gzip_enabled and len(body) >= self.gzip_min_bytes:
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+        return body, headers
+    
+    def check_connectivity(self) -> bool:
+        """
+        Check that the webhook host is reachable, reusing pooled connections
+        
+        Returns:
+            True if the webhook answered (any HTTP status)
+        
+        Raises:
+            requests.exceptions.RequestException: If the webhook is unreachable
+        """
+        response = self.session.head(self.webhook_url, timeout=(self.connect_timeout, 5))
+        response.close()
         return True
     
-    def push_data(self, json_data: str) -> bool:
+    def push_data(self, json_data: Union[Payload, bytes, str, dict], batch_id: Optional[str] = None,
+                  item_count: Optional[int] = None) -> bool:
         """
         Push data to n8n webhook with retry logic
         
+        Large batches are split into chunks (N8N_CHUNK_SIZE items and/or
+        N8N_CHUNK_MAX_BYTES) that are delivered in parallel; each chunk is
+        retried on its own, so a failure never resends chunks already delivered.
+        Records are serialized once, straight to the request body.
+        
         Args:
-            json_data: JSON data to send (string or dict)
+            json_data: records.Payload, or JSON data to send (bytes, string or dict)
+            batch_id: Stable batch id sent with chunks (optional, generated if not provided)
+            item_count: Number of records in already serialized JSON; lets a
+                payload that needs no chunking be sent without decoding it
         
         Returns:
             True if successful, False otherwise
         """
-        try:
+        start = time.perf_counter()
+        ok = self._push_data(json_data, batch_id, item_count)
+        outcome = 'success' if ok else 'failure'
+        metrics.N8N_PUSH_DURATION.observe(time.perf_counter() - start, outcome=outcome)
+        metrics.N8N_PUSHES.inc(outcome=outcome)
+        return ok
+    
+    def _load_payload(self, json_data) -> Optional[Payload]:
+        """
+        Parse and check a payload before sending
+        
+        Args:
+            json_data: records.Payload, or JSON data (bytes, string or dict)
+        
+        Returns:
+            Payload, or None if it is not valid JSON or not a dictionary
+        """
+        if isinstance(json_data, Payload):
+            payload = json_data
+        else:
             # Parse JSON if string
-            if isinstance(json_data, str):
+            if isinstance(json_data, (str, bytes)):
                 try:
                     data = json.loads(json_data)
                 except json.JSONDecodeError as e:
                     logger.error(f"Invalid JSON data: {e}")
-                    return False
+                    return None
             else:
                 data = json_data
             
             # Validate data structure
             if not isinstance(data, dict):
                 logger.error(f"Data must be a dictionary, got {type(data)}")
-                return False
+                return None
             
             if 'type' not in data or 'data' not in data:
                 logger.warning("Data missing 'type' or 'data' field, sending anyway")
+            payload = Payload.from_dict(data)
+        
+        logger.info(f"Sending data to n8n: type={payload.type or 'unknown'}, "
+                   f"items={len(payload.records)}")
+        return payload
+    
+    def _prepare_chunks(self, json_data, batch_id: Optional[str] = None,
+                        item_count: Optional[int] = None) -> Optional[List[dict]]:
+        """
+        Serialize a payload into request bodies
+        
+        Args:
+            json_data: Payload or JSON data (see push_data)
+            batch_id: Batch id for the chunks (optional)
+            item_count: Number of records in already serialized JSON (optional)
+        
+        Returns:
+            List of chunks ({'body', 'sequence', 'total_chunks', 'batch_id'}),
+            or None if the payload is invalid
+        """
+        if isinstance(json_data, bytes) and item_count is not None and self._fits_one_chunk(item_count, len(json_data)):
+            logger.info(f"Sending data to n8n: pre-serialized payload, items={item_count}")
+            return [{'body': json_data, 'sequence': None}]
+        
+        with tracing.span('n8n.serialize') as attributes:
+            payload = self._load_payload(json_data)
+            if payload is None:
+                return None
+            chunks = self._split_chunks(payload, batch_id)
+            attributes.update(records=len(payload.records), chunks=len(chunks))
+            return chunks
+    
+    def _push_data(self, json_data, batch_id: Optional[str] = None, item_count: Optional[int] = None) -> bool:
+        """Serialize, chunk and deliver a payload (see push_data)"""
+        try:
+            chunks = self._prepare_chunks(json_data, batch_id, item_count)
+            if chunks is None:
+                return False
             
             # Send request with retry logic
-            logger.info(f"Sending data to n8n: type={data.get('type', 'unknown')}, "
-                       f"items={len(data.get('data', []))}")
+            if len(chunks) == 1:
+                return self._send_with_retry(chunks[0])
             
-            last_exception = None
-            for attempt in range(self.max_retries):
-                try:
-                    self._send_request(data)
-                    logger.info(f"✅ Successfully sent to n8n (attempt {attempt + 1})")
-                    return True
-                except requests.exceptions.RequestException as e:
-                    last_exception = e
-                    if attempt < self.max_retries - 1:
-                        wait_time = self.retry_delay * (attempt + 1)
-                        logger.warning(
-                            f"Attempt {attempt + 1}/{self.max_retries} failed: {e}. "
-                            f"Retrying in {wait_time} seconds..."
-                        )
-                        time.sleep(wait_time)
-                    else:
-                        logger.error(f"All {self.max_retries} attempts failed")
+            logger.info(f"Sending batch {chunks[0]['batch_id']} in {len(chunks)} chunks "
+                       f"(parallelism {self.max_parallel_chunks})")
+            with ThreadPoolExecutor(max_workers=min(self.max_parallel_chunks, len(chunks))) as executor:
+                results = list(executor.map(self._send_with_retry, chunks))
             
-            # Handle specific exception types
-            if isinstance(last_exception, requests.exceptions.Timeout):
-                logger.error(f"❌ Timeout sending to n8n after {self.timeout} seconds")
-            elif isinstance(last_exception, requests.exceptions.ConnectionError):
-                logger.error(f"❌ Connection error to n8n: {last_exception}")
-            elif isinstance(last_exception, requests.exceptions.HTTPError):
-                logger.error(f"❌ HTTP error from n8n: {last_exception}")
-                if hasattr(last_exception, 'response') and last_exception.response is not None:
-                    logger.error(f"Response: {last_exception.response.text}")
-            else:
-                logger.error(f"❌ Unexpected error pushing to n8n: {last_exception}")
+            failed = [chunk['sequence'] for chunk, ok in zip(chunks, results) if not ok]
+            if failed:
+                logger.error(f"❌ {len(failed)}/{len(chunks)} chunks failed for batch "
+                            f"{chunks[0]['batch_id']}: {failed}")
+                return False
             
-            return False
+            logger.info(f"✅ All {len(chunks)} chunks of batch {chunks[0]['batch_id']} sent to n8n")
+            return True
             
         except Exception as e:
             logger.error(f"❌ Unexpected error in push_data: {e}", exc_info=True)
             return False
+    
+    def _fits_one_chunk(self, item_count: int, size: Optional[int] = None) -> bool:
+        """Whether a payload of item_count records (and size bytes, if known) needs no splitting"""
+        if self.chunk_size > 0 and item_count > self.chunk_size:
+            return False
+        return self.chunk_max_bytes <= 0 or (size is not None and size <= self.chunk_max_bytes)
+    
+    def _split_chunks(self, payload: Payload, batch_id: Optional[str] = None) -> List[dict]:
+        """
+        Serialize a payload into chunks by item count and serialized size
+        
+        Every record is encoded exactly once: with a size limit the records
+        are encoded one by one and the chunk bodies are assembled from them.
+        
+        Args:
+            payload: Payload to send
+            batch_id: Batch id for the chunks (optional)
+        
+        Returns:
+            List of chunks ({'body', 'sequence', 'total_chunks', 'batch_id'});
+            a single chunk without batch fields if the payload needs no
+            splitting, otherwise bodies carrying batch_id, sequence (1-based)
+            and total_chunks
+        """
+        records = payload.records
+        if not records or (self.chunk_max_bytes <= 0 and self._fits_one_chunk(len(records))):
+            return [{'body': payload.encode(), 'sequence': None}]
+        
+        chunk_size = self.chunk_size if self.chunk_size > 0 else len(records)
+        encoded = payload.encode_records() if self.chunk_max_bytes > 0 else None
+        groups = []
+        group_start = 0
+        current_bytes = 0
+        for index in range(len(records)):
+            if encoded is not None:
+                item_bytes = len(encoded[index]) + 1
+                if index > group_start and current_bytes + item_bytes > self.chunk_max_bytes:
+                    groups.append((group_start, index))
+                    group_start, current_bytes = index, 0
+                current_bytes += item_bytes
+            if index + 1 - group_start >= chunk_size:
+                groups.append((group_start, index + 1))
+                group_start, current_bytes = index + 1, 0
+        if group_start < len(records):
+            groups.append((group_start, len(records)))
+        
+        if len(groups) == 1:
+            body = payload.assemble(encoded) if encoded is not None else payload.encode()
+            return [{'body': body, 'sequence': None}]
+        
+        batch_id = batch_id or str(uuid.uuid4())
+        chunks = []
+        for sequence, (first, last) in enumerate(groups, start=1):
+            meta = {"batch_id": batch_id, "sequence": sequence, "total_chunks": len(groups)}
+            if encoded is not None:
+                body = payload.assemble(encoded[first:last], **meta)
+            else:
+                body = Payload(payload.fields, records[first:last]).encode(**meta)
+            chunks.append({'body': body, **meta})
+        return chunks
+    
+    def push_stream(self, header: Dict, groups: Iterable[List]) -> bool:
+        """
+        Stream records to n8n as newline-delimited JSON (one attempt)
+        
+        The body is a chunked upload: the first line holds the payload header
+        fields (type, timestamp, batch_id), every following line one record.
+        Each group is sent as soon as it is produced, so delivery starts while
+        the response is still being parsed and memory holds one group at a
+        time. The groups cannot be replayed; callers retry by producing them
+        again (see QBWCHandler._stream_response).
+        
+        Args:
+            header: Payload header fields
+            groups: Lists of records, consumed while uploading
+        
+        Returns:
+            True if n8n accepted the stream, False otherwise
+        """
+        label = f" batch {header.get('batch_id')}"
+        if not self._circuit_allows(label):
+            metrics.N8N_PUSHES.inc(outcome='failure')
+            return False
+        
+        start = time.perf_counter()
+        headers = {'Content-Type': 'application/x-ndjson'}
+        if self.gzip_enabled:
+            headers['Content-Encoding'] = 'gzip'
+        try:
+            # Covers parsing too: the groups are produced while the body is sent
+            with tracing.span('n8n.push_stream', type=header.get('type'), batch_id=header.get('batch_id'),
+                              gzip=self.gzip_enabled) as attributes:
+                response = self.session.post(
+                    self.webhook_url,
+                    data=self._ndjson_body(header, groups),
+                    headers=headers,
+                    timeout=(self.connect_timeout, self.read_timeout)
+                )
+                attributes['status'] = response.status_code
+                response.raise_for_status()
+            self.breaker.record_success()
+            metrics.N8N_PUSH_ATTEMPTS.inc(outcome='success')
+            logger.info(f"✅ Successfully streamed{label} to n8n")
+            outcome = 'success'
+        except requests.exceptions.RequestException as e:
+            response = getattr(e, 'response', None)
+            self._record_attempt_failure(response.status_code if response is not None else None)
+            metrics.N8N_PUSH_ATTEMPTS.inc(outcome=type(e).__name__)
+            logger.error(f"❌ Failed to stream{label} to n8n: {e}")
+            outcome = 'failure'
+        except BaseException:
+            # Raised while producing the body (e.g. a truncated response): the webhook
+            # is not at fault, but a half-open probe must not stay in flight
+            self.breaker.release_probe()
+            metrics.N8N_PUSHES.inc(outcome='failure')
+            raise
+        
+        metrics.N8N_PUSH_DURATION.observe(time.perf_counter() - start, outcome=outcome)
+        metrics.N8N_PUSHES.inc(outcome=outcome)
+        return outcome == 'success'
+    
+    def _ndjson_body(self, header: Dict, groups: Iterable[List]) -> Iterator[bytes]:
+        """
+        Serialize a stream body one group at a time
+        
+        Args:
+            header: Payload header fields (first line)
+            groups: Lists of records
+        
+        Yields:
+            Body chunks, gzip-compressed when enabled (flushed per group so
+            n8n receives each group right away)
+        """
+        compressor = zlib.compressobj(5, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if self.gzip_enabled else None
+        
+        def encode(lines: List[bytes]) -> bytes:
+            data = b'\n'.join(lines) + b'\n'
+            return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else data
+        
+        yield encode([dumps(header)])
+        for group in groups:
+            yield encode([dumps(record) for record in group])
+        if compressor:
+            yield compressor.flush()
+    
+    def _circuit_allows(self, label: str) -> bool:
+        """
+        Check the circuit breaker before an attempt
+        
+        Args:
+            label: Chunk label for the log message
+        
+        Returns:
+            True if the attempt may be sent; False (fast fail) while the circuit is open
+        """
+        if self.breaker.allow_request():
+            return True
+        metrics.N8N_PUSH_ATTEMPTS.inc(outcome='circuit_open')
+        logger.warning(f"❌ Circuit to n8n is open, not sending{label} "
+                       f"(next probe in {self.breaker.retry_in():.0f} seconds)")
+        return False
+    
+    def _record_attempt_failure(self, status: Optional[int]) -> None:
+        """
+        Report a failed attempt to the circuit breaker
+        
+        Args:
+            status: HTTP status of the error response, None if n8n did not answer
+        """
+        if status is None or status >= 500 or status == 429:
+            self.breaker.record_failure()
+        else:
+            # n8n answered: the payload was rejected, the webhook is not down
+            self.breaker.record_success()
+    
+    def _retry_wait(self, attempt: int, deadline: float, label: str) -> Optional[float]:
+        """
+        Get the delay before retrying after a failed attempt
+        
+        Args:
+            attempt: 0-based number of the failed attempt
+            deadline: time.monotonic() by which the retries must be over
+            label: Chunk label for the log message
+        
+        Returns:
+            Jittered exponential delay, or None to give up now: the failure
+            opened the circuit, or the wait would run past the retry budget
+        """
+        if self.breaker.retry_in() > 0:
+            logger.error(f"❌ Circuit to n8n opened, not retrying{label}")
+            return None
+        wait_time = jittered_backoff(attempt, self.retry_delay, self.retry_max_delay)
+        if time.monotonic() + wait_time > deadline:
+            logger.error(f"❌ Retry budget of {self.retry_budget:g}s used up, not retrying{label}")
+            return None
+        return wait_time
+    
+    def _send_with_retry(self, chunk: dict) -> bool:
+        """
+        Send one chunk with retry logic
+        
+        Attempts go through the circuit breaker: while it is open the chunk
+        fails immediately instead of waiting on timeouts and retries. The
+        waits between attempts block the calling thread, so retries stop as
+        soon as the circuit opens or N8N_RETRY_BUDGET seconds have passed.
+        
+        Args:
+            chunk: Chunk from _split_chunks
+        
+        Returns:
+            True if successful, False after all attempts failed
+        """
+        label = f" chunk {chunk['sequence']}/{chunk['total_chunks']}" if chunk['sequence'] else ''
+        
+        last_exception = None
+        deadline = time.monotonic() + self.retry_budget
+        for attempt in range(self.max_retries):
+            if not self._circuit_allows(label):
+                return False
+            try:
+                self._send_request(chunk['body'])
+                self.breaker.record_success()
+                metrics.N8N_PUSH_ATTEMPTS.inc(outcome='success')
+                logger.info(f"✅ Successfully sent{label} to n8n (attempt {attempt + 1})")
+                return True
+            except requests.exceptions.RequestException as e:
+                last_exception = e
+                response = getattr(e, 'response', None)
+                self._record_attempt_failure(response.status_code if response is not None else None)
+                metrics.N8N_PUSH_ATTEMPTS.inc(outcome=type(e).__name__)
+                if attempt < self.max_retries - 1:
+                    wait_time = self._retry_wait(attempt, deadline, label)
+                    if wait_time is None:
+                        break
+                    logger.warning(
+                        f"Attempt {attempt + 1}/{self.max_retries}{label} failed: {e}. "
+                        f"Retrying in {wait_time:.1f} seconds..."
+                    )
+                    time.sleep(wait_time)
+                else:
+                    logger.error(f"All {self.max_retries} attempts failed{label}")
+            except BaseException:
+                # Not an answer from n8n (or cancelled): free a half-open probe without judging the webhook
+                self.breaker.release_probe()
+                raise
+        
+        # Handle specific exception types
+        if isinstance(last_exception, requests.exceptions.Timeout):
+            logger.error(f"❌ Timeout sending to n8n after {self.read_timeout} seconds")
+        elif isinstance(last_exception, requests.exceptions.ConnectionError):
+            logger.error(f"❌ Connection error to n8n: {last_exception}")
+        elif isinstance(last_exception, requests.exceptions.HTTPError):
+            logger.error(f"❌ HTTP error from n8n: {last_exception}")
+            if hasattr(last_exception, 'response') and last_exception.response is not None:
+                logger.error(f"Response: {last_exception.response.text}")
+        else:
+            logger.error(f"❌ Unexpected error pushing to n8n: {last_exception}")
+        
+        return False
@@ -0,0 +1,201 @@
+"""
+Multi-core conversion of large QBXML responses
+
+Responses of at least QBXML_PARALLEL_MIN_BYTES characters (or bytes, for a
+body spilled to disk, which is memory-mapped) are split into
+shards at *Ret element boundaries (InvoiceRet, CustomerRet, ...), and the
+shards are parsed and validated in a pool of QBXML_PARALLEL_WORKERS
+processes. Records come back in document order. Smaller responses, and
+everything when the pool is disabled (the default), are converted inline.
+"""
+import multiprocessing
+import re
+import threading
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils import get_env_var, logger, source_length
+
+# Start tag of a *QueryRs element (group 3 is set for an empty, self-closing one)
+_QUERY_RS_START = re.compile(r'<(\w+QueryRs)(\s[^>]*?)?(/?)>')
+_QUERY_RS_START_BYTES = re.compile(rb'<(\w+QueryRs)(\s[^>]*?)?(/?)>')
+
+# XMLConverter of a pool process
+_converter = None
+
+
+def _encoder(source):
+    """Return the function turning str literals into the source's type"""
+    if isinstance(source, str):
+        return lambda value: value
+    return lambda value: value.encode('utf-8')
+
+
+def split_response(source, ret_tags: Dict[str, Tuple[str, ...]],
+                   shard_chars: int) -> Optional[List[Tuple[str, Dict, List[Tuple[int, int]]]]]:
+    """
+    Split a response into shards at *Ret boundaries
+
+    Args:
+        source: QBXML text, or bytes / a memory map of a spilled body
+        ret_tags: *Ret element names of each supported *QueryRs
+        shard_chars: Approximate shard size in characters (bytes)
+
+    Returns:
+        (response tag, response attributes, shard (start, end) offsets) per
+        supported *QueryRs in document order, or None if the response cannot
+        be split safely (comments, CDATA, unexpected structure)
+    """
+    encode = _encoder(source)
+    pattern = _QUERY_RS_START if isinstance(source, str) else _QUERY_RS_START_BYTES
+    start = source.find(encode('<QBXMLMsgsRs'))
+    if start < 0 or source.find(encode('<!--')) >= 0 or source.find(encode('<![CDATA[')) >= 0:
+        return None
+
+    responses = []
+    position = start
+    while True:
+        match = pattern.search(source, position)
+        if match is None:
+            return responses
+        rs_tag, attributes, empty = match.groups()
+        attrs = ET.fromstring(encode('<') + rs_tag + (attributes or encode('')) + encode('/>')).attrib
+        rs_tag = rs_tag if isinstance(rs_tag, str) else rs_tag.decode('utf-8')
+        if empty:
+            position = match.end()
+            if rs_tag in ret_tags:
+                responses.append((rs_tag, attrs, []))
+            continue
+
+        end = source.find(encode(f"</{rs_tag}>"), match.end())
+        if end < 0:
+            return None
+        position = end + len(rs_tag) + 3
+        if rs_tag not in ret_tags:
+            continue
+
+        # Records are direct children, and a *Ret element never contains one of its own kind
+        ret_end = re.compile(encode('</(?:%s)>' % '|'.join(ret_tags[rs_tag])))
+        spans = []
+        shard_start = match.end()
+        while shard_start < end:
+            closing = ret_end.search(source, min(shard_start + shard_chars, end), end)
+            shard_end = closing.end() if closing else end
+            spans.append((shard_start, shard_end))
+            shard_start = shard_end
+        responses.append((rs_tag, attrs, spans))
+
+
+def shard_document(source, rs_tag: str, start: int, end: int):
+    """
+    Build the standalone QBXML document of one shard
+
+    Args:
+        source: Source passed to split_response
+        rs_tag: Response tag of the shard
+        start: Start offset from split_response
+        end: End offset from split_response
+
+    Returns:
+        QBXML text or bytes (same type as the source slice)
+    """
+    encode = _encoder(source)
+    return (encode(f"<QBXML><QBXMLMsgsRs><{rs_tag}>") + source[start:end]
+            + encode(f"</{rs_tag}></QBXMLMsgsRs></QBXML>"))
+
+
+def _init_worker(fields: Dict[str, Tuple[str, ...]]) -> None:
+    """Build the pool process's converter with the parent's field projection"""
+    global _converter
+    from field_projection import FieldProjection
+    from xml_converter import XMLConverter
+    _converter = XMLConverter(projection=FieldProjection(fields=fields))
+    _converter.track_edit_sequences = True
+
+
+def _convert_shard(shard) -> Tuple:
+    """Convert one shard in a pool process (see XMLConverter.convert_shard)"""
+    return _converter.convert_shard(shard)
+
+
+class ParallelConversion:
+    def __init__(self, projection, workers: Optional[int] = None):
+        """
+        Initialize the process pool settings (the pool starts on first use)
+
+        Args:
+            projection: FieldProjection the pool processes must parse with
+            workers: Pool processes (optional, will use env var if not provided; 0 disables)
+        """
+        self.workers = workers if workers is not None else int(
+            get_env_var('QBXML_PARALLEL_WORKERS', default='0', required=False))
+        self.min_chars = int(get_env_var('QBXML_PARALLEL_MIN_BYTES', default=str(8 * 1024 * 1024), required=False))
+        self.shard_chars = max(1, int(get_env_var('QBXML_PARALLEL_SHARD_BYTES', default=str(1024 * 1024),
+                                                  required=False)))
+        self.fields = {entity: projection.fields(entity) for entity in projection.entities()}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def wants(self, source) -> bool:
+        """Return True if a response (text, bytes or spilled file) is large enough to convert in the pool"""
+        return self.workers > 0 and source_length(source) >= self.min_chars
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Start the pool (clean interpreters: forking a threaded server is unsafe)"""
+        with self._lock:
+            if self._pool is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(method),
+                    initializer=_init_worker, initargs=(self.fields,)
+                )
+                logger.info(f"Started {self.workers} QBXML conversion processes ({method})")
+            return self._pool
+
+    def map(self, shards: Iterable) -> Optional[List[Tuple]]:
+        """
+        Convert shards in the pool
+
+        Shards are built lazily and at most two per process are in flight,
+        so a large spilled response is never copied into memory whole.
+
+        Args:
+            shards: Shard documents (see shard_document)
+
+        Returns:
+            XMLConverter.convert_shard results in shard order, or None if a
+            pool process died (the pool is restarted on next use)
+
+        Raises:
+            xml.etree.ElementTree.ParseError: If a shard is malformed
+        """
+        pool = self._get_pool()
+        results = []
+        pending = deque()
+        try:
+            for shard in shards:
+                pending.append(pool.submit(_convert_shard, shard))
+                if len(pending) >= 2 * self.workers:
+                    results.append(pending.popleft().result())
+            while pending:
+                results.append(pending.popleft().result())
+            return results
+        except BrokenProcessPool as e:
+            logger.error(f"❌ QBXML conversion pool failed, converting inline: {e}")
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            return None
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self) -> None:
+        """Stop the pool processes"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
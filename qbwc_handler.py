@@ -1,24 +1,90 @@
+import hmac
+import itertools
+import time
 import uuid
-import os
-from typing import Optional
+from datetime import datetime
+from typing import IO, Optional, Union
+from xml.sax.saxutils import quoteattr
 from xml_converter import XMLConverter
+from field_projection import FieldProjection
+from records import Payload
 from n8n_client import N8NClient
-from utils import get_env_var, logger
+from watermark_store import WatermarkStore
+from fingerprint_index import FingerprintIndex
+from session_store import create_session_store
+from spool import Spool, SpoolWorker
+from companies import CompanyConfig, DEFAULT_COMPANY, load_companies
+from scheduler import FairScheduler, SchedulerBusy
+import tracing
+from utils import get_env_var, logger, qb_timestamp, set_log_ticket, source_length
+
+# QBXML request per sync entity; transaction queries filter on
+# ModifiedDateRangeFilter, list queries on FromModifiedDate/ToModifiedDate
+ENTITY_REQUESTS = {
+    'Invoice': {'request': 'InvoiceQueryRq', 'list_query': False},
+    'ReceivePayment': {'request': 'ReceivePaymentQueryRq', 'list_query': False},
+    'Customer': {'request': 'CustomerQueryRq', 'list_query': True},
+    'Item': {'request': 'ItemQueryRq', 'list_query': True},
+}
 
 class QBWCHandler:
     def __init__(self):
         """Initialize QBWC Handler"""
-        self.sessions = {}
-        self.xml_converter = XMLConverter()
+        self.sessions = create_session_store()
+        # Skip records that are unchanged since they were last pushed
+        self.fingerprint_index = None
+        if get_env_var('FINGERPRINT_ENABLED', default='true', required=False).lower() == 'true':
+            self.fingerprint_index = FingerprintIndex()
+        # Fields sent to n8n: drive both IncludeRetElement in queries and the parser
+        self.projection = FieldProjection()
+        self.xml_converter = XMLConverter(fingerprint_index=self.fingerprint_index, projection=self.projection)
         self.n8n_client = N8NClient()
-        self.qbwc_user = get_env_var('QBWC_USER', default='admin', required=False)
-        self.qbwc_pass = get_env_var('QBWC_PASS', required=True)
+        # Clients of company webhooks other than N8N_WEBHOOK_URL
+        self.company_clients = {}
+        # Companies by Web Connector username (QBWC_USER/QBWC_PASS and COMPANIES_CONFIG)
+        self.companies = load_companies()
+        self.companies_by_name = {company.name: company for company in self.companies.values()}
+        # Caps heavy conversions per company and across the process
+        self.scheduler = FairScheduler()
+        # Records per iterator page (MaxReturned); 0 disables paging
+        self.page_size = int(get_env_var('QBWC_PAGE_SIZE', default='500', required=False))
+        # Entities synced in each QBWC session, in order
+        self.sync_entities = [
+            entity.strip() for entity in
+            get_env_var('QBWC_SYNC_ENTITIES', default='Invoice', required=False).split(',')
+            if entity.strip()
+        ]
+        # Requests combined into one QBXMLMsgsRq (only when paging bounds each response)
+        self.batch_max_requests = max(1, int(get_env_var('QBWC_BATCH_MAX_REQUESTS', default='4', required=False)))
+        unknown = [entity for entity in self.sync_entities if entity not in ENTITY_REQUESTS]
+        if unknown:
+            raise ValueError(f"Unknown QBWC_SYNC_ENTITIES: {unknown} "
+                             f"(supported: {', '.join(ENTITY_REQUESTS)})")
+        for company in self.companies.values():
+            unknown = [entity for entity in company.sync_entities or [] if entity not in ENTITY_REQUESTS]
+            if unknown:
+                raise ValueError(f"Unknown sync_entities for company {company.name}: {unknown} "
+                                 f"(supported: {', '.join(ENTITY_REQUESTS)})")
+        # Only query records modified since the last successful sync
+        self.incremental_sync = get_env_var('QBWC_INCREMENTAL_SYNC', default='true',
+                                            required=False).lower() == 'true'
+        self.watermark_store = WatermarkStore() if self.incremental_sync else None
+        # Spool converted payloads to disk and deliver them in the background
+        self.spool = None
+        self.spool_worker = None
+        if get_env_var('N8N_SPOOL_ENABLED', default='true', required=False).lower() == 'true':
+            self.spool = Spool()
+            self.spool_worker = SpoolWorker(self.spool, self.n8n_client)
+            self.spool_worker.start()
+        # 'ndjson' streams records to n8n while a response is parsed, instead
+        # of building (and spooling) the whole payload first
+        self.stream_push = get_env_var('N8N_PUSH_MODE', default='json', required=False).lower() == 'ndjson'
         logger.info("QBWC Handler initialized")
     
     def server_version(self) -> str:
         """Return server version"""
         version = "1.0.0"
-        logger.debug(f"Server version requested: {version}")
+        logger.debug("Server version requested: %s", version)
         return version
     
     def client_version(self, client_version: str) -> str:
@@ -32,7 +98,7 @@ class QBWCHandler:
             "OK" if valid, warning message otherwise
         """
         if client_version:
-            logger.debug(f"Client version: {client_version}")
+            logger.debug("Client version: %s", client_version)
             return "OK"
         logger.warning("Client version not provided")
         return "W:Server version mismatch"
@@ -46,27 +112,96 @@ class QBWCHandler:
             password: Password
         
         Returns:
-            Ticket string if authenticated, error message otherwise
+            Ticket, company file ("" = the one open in QuickBooks), postpone seconds and,
+            when the company has a sync interval, the minimum seconds between
+            runs, newline-separated; error message otherwise
         """
         logger.info(f"Authentication attempt for user: {username}")
         
-        if username == self.qbwc_user and password == self.qbwc_pass:
+        company = self.companies.get(username)
+        if company and hmac.compare_digest((password or '').encode('utf-8'), company.password.encode('utf-8')):
             ticket = str(uuid.uuid4())
-            self.sessions[ticket] = {
+            set_log_ticket(ticket)
+            self.sessions.set(ticket, {
                 'authenticated': True,
-                'jobs': [],
+                'jobs': [self._new_job(entity, request_id) for request_id, entity
+                         in enumerate(company.sync_entities or self.sync_entities, start=1)],
+                'pending_request_ids': [],
                 'username': username,
-                'created_at': os.urandom(8).hex()  # Simple timestamp placeholder
-            }
-            logger.info(f"✅ Authentication successful, ticket: {ticket[:8]}...")
-            return f"{ticket}\nnone\n0"
+                'company': company.name,
+                'created_at': datetime.now().isoformat(),
+                'records_received': 0,
+                'sync_complete': False,
+                'last_error': None,
+                'company_file': None
+            })
+            logger.info(f"✅ Authentication successful for company {company.name}, ticket: {ticket[:8]}...")
+            result = f"{ticket}\n{company.company_file or ''}\n0"
+            if company.sync_interval:
+                result += f"\n{company.sync_interval}"
+            return result
         
         logger.warning(f"❌ Authentication failed for user: {username}")
         return "nvu\nInvalid credentials"
     
+    def _new_job(self, entity: str, request_id: int) -> dict:
+        """
+        Create the sync job state for one entity type
+        
+        Args:
+            entity: Entity name (key of ENTITY_REQUESTS)
+            request_id: requestID used for this job's queries
+        
+        Returns:
+            Job dictionary stored in the session's job queue
+        """
+        return {
+            'entity': entity,
+            'request_id': str(request_id),
+            'iterator_id': None,
+            'records_received': 0,
+            'progress': 0.0,
+            'from_modified_date': None,
+            'pending_watermark': None,
+            'push_failed': False,
+            'done': False
+        }
+    
+    def _company(self, session: dict) -> Optional[CompanyConfig]:
+        """
+        Return the configuration of the company a session belongs to
+        
+        Returns:
+            CompanyConfig, or None if the company was removed from the
+            configuration since the session started (its data must not go
+            to another company's webhook)
+        """
+        name = session.get('company') or DEFAULT_COMPANY
+        company = self.companies_by_name.get(name)
+        if company is None:
+            logger.error(f"❌ Company {name} of this session is no longer configured")
+        return company
+    
+    def _fail_unknown_company(self, session: dict) -> str:
+        """Stop the sync of a session whose company is no longer configured"""
+        return self._fail_sync(session, f"Company {session.get('company') or DEFAULT_COMPANY} is no longer configured")
+    
+    def _n8n_client_for(self, company: CompanyConfig) -> N8NClient:
+        """Return the client of a company's webhook"""
+        if not company.webhook_url or company.webhook_url == self.n8n_client.webhook_url:
+            return self.n8n_client
+        client = self.company_clients.get(company.webhook_url)
+        if client is None:
+            client = self.company_clients.setdefault(company.webhook_url, N8NClient(company.webhook_url))
+        return client
+    
+    def _pending_jobs(self, session: dict) -> list:
+        """Return the unfinished jobs of a session, in queue order"""
+        return [job for job in session.get('jobs', []) if not job['done']]
+    
     def send_request_xml(self, ticket: str, hcp_response: str, company_file: str) -> str:
         """
-        Generate QBXML request for invoices
+        Generate QBXML request for the next job in the session's queue
         
         Args:
             ticket: Session ticket
@@ -74,76 +209,528 @@ class QBWCHandler:
             company_file: Company file name
         
         Returns:
-            QBXML string or empty string if invalid ticket
+            QBXML string or empty string if invalid ticket or nothing left to do
         """
-        if ticket not in self.sessions:
+        session = self.sessions.get(ticket)
+        if session is None:
             logger.warning(f"Invalid ticket: {ticket[:8]}...")
             return ""
         
-        logger.info(f"Generating invoice query for company: {company_file}")
+        jobs = self._pending_jobs(session)
+        if session.get('sync_complete') or not jobs:
+            logger.info(f"Sync already complete for ticket: {ticket[:8]}...")
+            return ""
+        
+        company = self._company(session)
+        if company is None:
+            self._fail_unknown_company(session)
+            self.sessions.set(ticket, session)
+            return ""
+        if company.company_file and company_file and company_file.lower() != company.company_file.lower():
+            # Never send one company's data to another company's webhook
+            logger.error(f"❌ Company {company.name} expects {company.company_file}, QBWC opened {company_file}")
+            self._fail_sync(session, f"Company file mismatch: expected {company.company_file}")
+            self.sessions.set(ticket, session)
+            return ""
+        
+        # Without paging a single response is unbounded, so send one request at a time
+        batch = jobs[:self.batch_max_requests] if self.page_size else jobs[:1]
+        session['company_file'] = company_file
+        for job in batch:
+            if job['from_modified_date'] is None:
+                job['from_modified_date'] = self._get_from_modified_date(
+                    company.namespace + company_file, job['entity'], company.start_date)
+        session['pending_request_ids'] = [job['request_id'] for job in batch]
+        self.sessions.set(ticket, session)
+        
+        for job in batch:
+            logger.info(f"Generating {job['entity']} query for company: {company_file} "
+                       f"(modified since {job['from_modified_date']})")
+        
+        return self._wrap_qbxml([self._build_query(job, job['request_id']) for job in batch])
+    
+    def _get_from_modified_date(self, company_file: str, entity: str = 'Invoice',
+                                start_date: str = '2000-01-01') -> str:
+        """
+        Get the FromModifiedDate for a company's next query of an entity
+        
+        Args:
+            company_file: Company file name (prefixed with the company namespace)
+            entity: Entity name
+            start_date: Company's full-history start date
+        
+        Returns:
+            Stored watermark, or the full-history start date
+        """
+        if self.watermark_store:
+            try:
+                watermark = self.watermark_store.get(company_file, entity)
+                if watermark:
+                    return watermark
+            except Exception as e:
+                logger.error(f"Error reading {entity} watermark for {company_file}: {e}", exc_info=True)
+        return start_date
+    
+    def _build_query(self, job: dict, request_id: str) -> str:
+        """
+        Build the *QueryRq element for a job, using an iterator when paging is enabled
+        
+        Args:
+            job: Job dictionary holding the iterator state
+            request_id: requestID attribute value
+        
+        Returns:
+            QBXML request element
+        """
+        request = ENTITY_REQUESTS[job['entity']]
+        name = request['request']
+        from_date = job.get('from_modified_date') or '2000-01-01'
+        
+        if request['list_query']:
+            # List queries only return active records unless asked otherwise
+            filters = f"""      <ActiveStatus>All</ActiveStatus>
+      <FromModifiedDate>{from_date}</FromModifiedDate>
+      <ToModifiedDate>2099-12-31</ToModifiedDate>"""
+        else:
+            filters = f"""      <ModifiedDateRangeFilter>
+        <FromModifiedDate>{from_date}</FromModifiedDate>
+        <ToModifiedDate>2099-12-31</ToModifiedDate>
+      </ModifiedDateRangeFilter>"""
+        
+        # Only ask QuickBooks for the projected elements
+        projection = self.projection.query_elements(job['entity'])
+        if projection:
+            filters = f"{filters}\n{projection}"
+        
+        if not self.page_size:
+            return f"""    <{name} requestID="{request_id}">
+{filters}
+    </{name}>"""
+        if job.get('iterator_id'):
+            # Filters are only allowed on the first iterator request
+            return f"""    <{name} requestID="{request_id}" iterator="Continue" iteratorID={quoteattr(job['iterator_id'])}>
+      <MaxReturned>{self.page_size}</MaxReturned>
+    </{name}>"""
+        return f"""    <{name} requestID="{request_id}" iterator="Start">
+      <MaxReturned>{self.page_size}</MaxReturned>
+{filters}
+    </{name}>"""
+    
+    def _wrap_qbxml(self, query_elements: list) -> str:
+        """
+        Wrap request elements in a QBXML document
+        
+        Requests are independent, so a failing one must not stop the others.
         
-        # Build QBXML query for invoices
-        qbxml = """<?xml version="1.0" encoding="utf-8"?>
+        Args:
+            query_elements: *QueryRq element strings
+        
+        Returns:
+            QBXML string
+        """
+        body = "\n".join(query_elements)
+        return f"""<?xml version="1.0" encoding="utf-8"?>
 <?qbxml version="13.0"?>
 <QBXML>
-  <QBXMLMsgsRq onError="stopOnError">
-    <InvoiceQueryRq requestID="1">
-      <ModifiedDateRangeFilter>
-        <FromModifiedDate>2000-01-01</FromModifiedDate>
-        <ToModifiedDate>2099-12-31</ToModifiedDate>
-      </ModifiedDateRangeFilter>
-    </InvoiceQueryRq>
+  <QBXMLMsgsRq onError="continueOnError">
+{body}
   </QBXMLMsgsRq>
 </QBXML>"""
-        
-        return qbxml
     
-    def receive_response_xml(self, ticket: str, response_xml: str, hresult: str, message: str) -> str:
+    def receive_response_xml(self, ticket: str, response_xml: Union[str, IO[bytes]], hresult: str,
+                             message: str) -> str:
         """
         Process QBXML response from QuickBooks
         
         Args:
             ticket: Session ticket
-            response_xml: QBXML response string
+            response_xml: QBXML response string, or a binary file holding a
+                large response spilled to disk (see request_body)
             hresult: HRESULT error code
             message: Error message
         
         Returns:
-            "0" for success, "100" for more data
+            Percent complete ("100" when done, less to request the next page),
+            or "-1" on error (QBWC then calls getLastError)
+        """
+        with tracing.span('handler.receive_response_xml', bytes=source_length(response_xml)):
+            session = self.sessions.get(ticket)
+            if session is None:
+                logger.warning(f"Invalid ticket in receive_response_xml: {ticket[:8]}...")
+                return "0"
+            
+            try:
+                return self._process_response(session, response_xml, hresult, message)
+            finally:
+                # Persist iterator and watermark state for the next call (any worker)
+                self.sessions.set(ticket, session)
+    
+    def _process_response(self, session: dict, response_xml: Union[str, IO[bytes]], hresult: str,
+                          message: str) -> str:
+        """
+        Convert and deliver one response, updating the session state
+        
+        Args:
+            session: Session dictionary
+            response_xml: QBXML response string or spilled body file
+            hresult: HRESULT error code
+            message: Error message
+        
+        Returns:
+            receiveResponseXML result (percent complete or "-1")
+        """
+        batch, early_result = self._begin_response(session, response_xml, hresult, message)
+        if early_result is not None:
+            return early_result
+        
+        company = self._company(session)
+        if company is None:
+            return self._fail_unknown_company(session)
+        try:
+            logger.info(f"Processing response XML for {[job['entity'] for job in batch]} "
+                       f"(length: {source_length(response_xml)} bytes)")
+            
+            delivered = None
+            if self.stream_push:
+                results, delivered = self._stream_response(batch, response_xml, company)
+            else:
+                # Convert every *QueryRs in one pass, within the company's share of conversion slots
+                with self.scheduler.slot(company.name, company.max_concurrent):
+                    results = {result['request_id']: result for result
+                               in self.xml_converter.convert_responses(response_xml, company.namespace)}
+        except SchedulerBusy as e:
+            return self._fail_sync(session, str(e))
+        except Exception as e:
+            logger.error(f"Error processing response XML: {e}", exc_info=True)
+            return self._fail_sync(session, f"Error processing response XML: {e}")
+        
+        if delivered is None:
+            delivered = {result['request_id']: self._deliver_result(result, company)
+                         for result in self._deliverable_results(batch, results)}
+        return self._finish_response(session, batch, results, delivered)
+    
+    def _begin_response(self, session: dict, response_xml: Union[str, IO[bytes]], hresult: str,
+                        message: str) -> tuple:
         """
-        if ticket not in self.sessions:
-            logger.warning(f"Invalid ticket in receive_response_xml: {ticket[:8]}...")
-            return "0"
+        Check a response and take the batch of jobs it answers
+        
+        Args:
+            session: Session dictionary
+            response_xml: QBXML response string or spilled body file
+            hresult: HRESULT error code
+            message: Error message
         
+        Returns:
+            (jobs of the pending batch, None) or (None, receiveResponseXML
+            result) when there is nothing to convert
+        """
         # Check for errors from QuickBooks
         if hresult and hresult != "0":
             logger.error(f"Error from QuickBooks: {hresult} - {message}")
-            return "0"
+            return None, self._fail_sync(session, f"QuickBooks error {hresult}: {message}")
         
-        if not response_xml:
+        if not source_length(response_xml):
             logger.warning("Empty response XML received")
-            return "0"
+            return None, self._fail_sync(session, "Empty response XML received")
         
-        try:
-            logger.info(f"Processing response XML (length: {len(response_xml)} bytes)")
-            
-            # Convert QBXML to JSON
-            json_data = self.xml_converter.qbxml_to_json(response_xml)
+        jobs = {job['request_id']: job for job in self._pending_jobs(session)}
+        batch = [jobs[request_id] for request_id in session.get('pending_request_ids', []) if request_id in jobs]
+        session['pending_request_ids'] = []
+        if not batch:
+            logger.warning("Response received but no sync job is pending")
+            return None, str(self._session_progress(session))
+        return batch, None
+    
+    def _stream_response(self, batch: list, response_xml: Union[str, IO[bytes]], company: CompanyConfig) -> tuple:
+        """
+        Convert a response while streaming its records to the company's webhook
+        
+        Each *QueryRs goes out as its own NDJSON stream (N8NClient.push_stream),
+        fed by the converter as it parses. A stream cannot be replayed, so a
+        retry parses the response again and only sends the streams that
+        failed, within the client's retry budget and only while the circuit is
+        closed. Each attempt holds one of the company's conversion slots.
+        Payloads are not spooled in this mode.
+        
+        Args:
+            batch: Jobs the response answers
+            response_xml: QBXML response string or spilled body file
+            company: Company the response belongs to
+        
+        Returns:
+            (converter results by request id, delivery outcome by request id)
+        
+        Raises:
+            xml.etree.ElementTree.ParseError: If the XML is malformed
+            SchedulerBusy: If no conversion slot became free in time
+        """
+        client = self._n8n_client_for(company)
+        group_size = client.chunk_size if client.chunk_size > 0 else 500
+        wanted = {job['request_id'] for job in batch}
+        batch_ids = {}
+        delivered = {}
+        deadline = time.monotonic() + client.retry_budget
+        for attempt in range(client.max_retries):
+            queries = []
+            with tracing.span('handler.stream_response', attempt=attempt + 1), \
+                    self.scheduler.slot(company.name, company.max_concurrent):
+                groups = self.xml_converter.stream_responses(response_xml, queries, company.namespace, group_size)
+                # Groups of one *QueryRs are contiguous; skipping a stream skips the rest of its groups
+                for _, query_groups in itertools.groupby(groups, key=lambda item: id(item[0])):
+                    query_info, records = next(query_groups)
+                    request_id = query_info['request_id']
+                    if (delivered.get(request_id) or request_id not in wanted
+                            or query_info['status_severity'] == 'Error'):
+                        continue
+                    header = {"type": query_info['type'], "timestamp": datetime.now().isoformat(),
+                              "batch_id": batch_ids.setdefault(request_id, str(uuid.uuid4()))}
+                    delivered[request_id] = client.push_stream(
+                        header, itertools.chain([records], (rest for _, rest in query_groups)))
+            results = {query_info['request_id']: query_info for query_info in queries}
             
-            # Send to n8n
-            if json_data:
-                success = self.n8n_client.push_data(json_data)
-                if success:
-                    logger.info("✅ Successfully processed and sent data to n8n")
-                else:
-                    logger.error("❌ Failed to send data to n8n")
+            failed = [request_id for request_id, ok in delivered.items() if not ok]
+            if not failed:
+                break
+            if attempt < client.max_retries - 1:
+                wait_time = client._retry_wait(attempt, deadline, f" for {len(failed)} streams")
+                if wait_time is None:
+                    break
+                logger.warning(f"Attempt {attempt + 1}/{client.max_retries} failed for {len(failed)} streams. "
+                               f"Retrying in {wait_time:.1f} seconds...")
+                time.sleep(wait_time)
+        return results, delivered
+    
+    def _deliverable_results(self, batch: list, results: dict) -> list:
+        """Return the converted results of a batch that carry a payload for n8n"""
+        deliverable = []
+        for job in batch:
+            result = results.get(job['request_id'])
+            if result and result['status_severity'] != 'Error' and result.get('payload'):
+                deliverable.append(result)
+        return deliverable
+    
+    def _deliver_result(self, result: dict, company: CompanyConfig) -> bool:
+        """
+        Deliver one converted response, logging instead of raising
+        
+        Args:
+            result: Converter result (query info plus 'payload')
+            company: Company the response belongs to
+        
+        Returns:
+            True if the payload was spooled or pushed successfully
+        """
+        with tracing.span('handler.deliver', entity=result['entity'], spooled=bool(self.spool)):
+            try:
+                return self._deliver(result['payload'], company)
+            except Exception as e:
+                logger.error(f"Error delivering {result['entity']} data: {e}", exc_info=True)
+                return False
+    
+    def _finish_response(self, session: dict, batch: list, results: dict, delivered: dict) -> str:
+        """
+        Advance every job of a batch once its payloads were delivered
+        
+        Args:
+            session: Session dictionary
+            batch: Jobs the response answers
+            results: Converter results by request id
+            delivered: Delivery outcome by request id (payloads only)
+        
+        Returns:
+            receiveResponseXML result (percent complete)
+        """
+        for job in batch:
+            result = results.get(job['request_id'])
+            if result is None:
+                logger.error(f"No response for {job['entity']} request {job['request_id']}")
+                self._fail_job(session, job, f"No response for {job['entity']} query")
+                continue
+            if result['status_severity'] == 'Error':
+                logger.error(f"{job['entity']} query failed: {result['status_code']} - {result['status_message']}")
+                self._fail_job(session, job, f"{job['entity']} query failed: {result['status_message']}")
+                continue
+            self._process_job_result(session, job, result, delivered.get(job['request_id'], False))
+        
+        progress = self._session_progress(session)
+        logger.info(f"Sync progress: {progress}% ({session['records_received']} records received)")
+        return str(progress)
+    
+    def _process_job_result(self, session: dict, job: dict, result: dict, delivered: bool) -> None:
+        """
+        Record the delivery of one converted response and advance its job
+        
+        Args:
+            session: Session dictionary
+            job: Job dictionary the response belongs to
+            result: Converter result (query info plus 'payload')
+            delivered: Whether the payload reached the spool or n8n
+        """
+        if result.get('payload') or result.get('streamed_count'):
+            if delivered:
+                logger.info(f"✅ Successfully processed and sent {result['type']} to n8n")
+                self._commit_fingerprints(result)
             else:
-                logger.warning("No data to send to n8n (empty or invalid response)")
-                
+                job['push_failed'] = True
+                logger.error(f"❌ Failed to send {result['type']} to n8n")
+        else:
+            logger.warning(f"No {result['type']} to send to n8n (empty or unchanged)")
+        
+        self._track_watermark(job, result.get('max_time_modified'))
+        self._update_job(job, result)
+        session['records_received'] += result.get('record_count', 0)
+        if job['done']:
+            self._commit_watermark(session, job)
+    
+    def _deliver(self, payload: Payload, company: CompanyConfig) -> bool:
+        """
+        Hand converted data over for delivery to the company's n8n webhook
+        
+        With the spool enabled the payload is persisted and acknowledged right
+        away; the spool worker pushes it to n8n in the background.
+        
+        Args:
+            payload: Converted records
+            company: Company the records belong to
+        
+        Returns:
+            True if the payload was spooled or pushed successfully
+        """
+        if not self.spool:
+            return self._n8n_client_for(company).push_data(payload)
+        
+        try:
+            entry_id = self.spool.enqueue(payload, webhook_url=company.webhook_url)
         except Exception as e:
-            logger.error(f"Error processing response XML: {e}", exc_info=True)
+            logger.error(f"Error writing payload to spool: {e}", exc_info=True)
+            return False
         
-        return "0"  # 0 = success, 100 = more data
+        logger.info(f"Payload spooled for delivery (entry {entry_id})")
+        self.spool_worker.notify()
+        return True
+    
+    def _commit_fingerprints(self, response_info: dict) -> None:
+        """
+        Record fingerprints of delivered records so unchanged ones are skipped next time
+        
+        Args:
+            response_info: Response details from the converter
+        """
+        if not self.fingerprint_index or not response_info.get('fingerprints'):
+            return
+        try:
+            self.fingerprint_index.commit(response_info['fingerprints'])
+        except Exception as e:
+            logger.error(f"Error saving record fingerprints: {e}", exc_info=True)
+    
+    def _update_job(self, job: dict, response_info: dict) -> None:
+        """
+        Update a job's iterator state and progress from a response
+        
+        Args:
+            job: Job dictionary
+            response_info: Response status and iterator attributes from the converter
+        """
+        job['records_received'] += response_info.get('record_count', 0)
+        iterator_id = response_info.get('iterator_id')
+        remaining = response_info.get('iterator_remaining_count', 0)
+        
+        if not self.page_size or not iterator_id or remaining <= 0:
+            job['iterator_id'] = None
+            job['done'] = True
+            job['progress'] = 1.0
+            return
+        
+        job['iterator_id'] = iterator_id
+        received = job['records_received']
+        job['progress'] = received / (received + remaining)
+    
+    def _session_progress(self, session: dict) -> int:
+        """
+        Compute percent complete across the session's job queue
+        
+        Args:
+            session: Session dictionary
+        
+        Returns:
+            Percent complete (100 when every job is done)
+        """
+        jobs = session.get('jobs', [])
+        if not jobs or all(job['done'] for job in jobs):
+            session['sync_complete'] = True
+            return 100
+        return min(99, int(sum(job['progress'] for job in jobs) * 100 / len(jobs)))
+    
+    def _track_watermark(self, job: dict, time_modified: Optional[str]) -> None:
+        """
+        Remember the newest TimeModified seen by a job
+        
+        Args:
+            job: Job dictionary
+            time_modified: Newest TimeModified of the current page
+        """
+        pending = job.get('pending_watermark')
+        new_time = qb_timestamp(time_modified)
+        if new_time is not None and (not pending or new_time > (qb_timestamp(pending) or 0)):
+            job['pending_watermark'] = time_modified
+    
+    def _commit_watermark(self, session: dict, job: dict) -> None:
+        """
+        Persist a job's watermark once every page was pushed successfully
+        
+        Iterator pages are not ordered by TimeModified, so the watermark is
+        only advanced at the end of a job without push failures.
+        
+        Args:
+            session: Session dictionary
+            job: Finished job dictionary
+        """
+        if not self.watermark_store or not job.get('pending_watermark'):
+            return
+        if job.get('push_failed'):
+            logger.warning(f"Not advancing {job['entity']} watermark: some data failed to reach n8n")
+            return
+        company = self._company(session)
+        if company is None:
+            return
+        try:
+            self.watermark_store.update(company.namespace + (session.get('company_file') or ''),
+                                        job['pending_watermark'], job['entity'])
+        except Exception as e:
+            logger.error(f"Error saving watermark: {e}", exc_info=True)
+    
+    def _fail_job(self, session: dict, job: dict, error: str) -> None:
+        """
+        Stop one job after a failed request; the other jobs carry on
+        
+        Args:
+            session: Session dictionary
+            job: Failed job dictionary
+            error: Error message (reported by getLastError)
+        """
+        job['iterator_id'] = None
+        job['done'] = True
+        job['progress'] = 1.0
+        job['push_failed'] = True
+        session['last_error'] = error
+    
+    def _fail_sync(self, session: dict, error: str) -> str:
+        """
+        Stop the sync for a session and remember the error for getLastError
+        
+        Args:
+            session: Session dictionary
+            error: Error message
+        
+        Returns:
+            "-1" (QBWC error response)
+        """
+        for job in session.get('jobs', []):
+            job['iterator_id'] = None
+            job['done'] = True
+        session['sync_complete'] = True
+        session['last_error'] = error
+        return "-1"
     
     def connection_error(self, ticket: str, hresult: str, message: str) -> str:
         """
@@ -171,8 +758,10 @@ class QBWCHandler:
         Returns:
             Error message or "No error"
         """
-        # In a production system, you might want to track errors per ticket
-        logger.debug(f"Last error requested for ticket: {ticket[:8] if ticket else 'N/A'}...")
+        logger.debug("Last error requested for ticket: %s...", ticket[:8] if ticket else 'N/A')
+        session = self.sessions.get(ticket)
+        if session and session.get('last_error'):
+            return session['last_error']
         return "No error"
     
     def close_connection(self, ticket: str) -> str:
@@ -185,9 +774,10 @@ class QBWCHandler:
         Returns:
             "OK"
         """
-        if ticket in self.sessions:
-            username = self.sessions[ticket].get('username', 'unknown')
-            del self.sessions[ticket]
+        session = self.sessions.get(ticket)
+        if session is not None:
+            username = session.get('username', 'unknown')
+            self.sessions.delete(ticket)
             logger.info(f"Connection closed for ticket: {ticket[:8]}... (user: {username})")
         else:
             logger.warning(f"Attempted to close non-existent ticket: {ticket[:8] if ticket else 'N/A'}...")
@@ -0,0 +1,203 @@
+"""
+Typed records sent to n8n and their JSON encoding
+
+Parsers build slotted record classes instead of dictionaries, and a payload
+is serialized to bytes exactly once on its way to n8n (with orjson when it is
+installed, the standard library otherwise).
+"""
+import json
+from dataclasses import dataclass, field, make_dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+try:
+    import orjson
+except ImportError:  # Optional fast encoder
+    orjson = None
+
+
+class Record:
+    """
+    Base class of parsed records
+
+    Records also support item access (record['txn_id'], 'memo' in record,
+    record.get(...)), so validators written for dictionaries keep working.
+    """
+    __slots__ = ()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the record as a dictionary (field order preserved)"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+
+@dataclass(slots=True)
+class InvoiceRecord(Record):
+    ref_number: str
+    txn_id: str
+    date: str
+    due_date: str
+    subtotal: float
+    total_amount: float
+    balance_remaining: float
+    customer: str
+    memo: str
+    is_paid: bool
+
+
+@dataclass(slots=True)
+class CustomerRecord(Record):
+    list_id: str
+    name: str
+    full_name: str
+    is_active: bool
+    company_name: str
+    email: str
+    phone: str
+    balance: float
+    total_balance: float
+
+
+@dataclass(slots=True)
+class PaymentRecord(Record):
+    txn_id: str
+    ref_number: str
+    date: str
+    customer: str
+    total_amount: float
+    payment_method: str
+    memo: str
+    applied_to: List[Dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class ItemRecord(Record):
+    list_id: str
+    name: str
+    full_name: str
+    is_active: bool
+    description: str
+    price: float
+    quantity_on_hand: float
+    item_type: str = ''
+
+
+@lru_cache(maxsize=None)
+def record_class(base: Type[Record], fields: Tuple[str, ...]) -> Type[Record]:
+    """
+    Get the record class holding a projection of fields
+
+    Args:
+        base: Record class of the entity's default fields
+        fields: Field names, in payload order
+
+    Returns:
+        base itself when fields are its own fields, otherwise a slotted
+        record class with exactly those fields
+    """
+    if fields == base.__slots__:
+        return base
+    return make_dataclass(base.__name__, [(name, Any) for name in fields], bases=(Record,), slots=True)
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serialize to compact JSON bytes
+
+    Args:
+        obj: JSON-compatible object, records included
+
+    Returns:
+        UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+class Payload:
+    """A batch of records for n8n: header fields ("type", "timestamp", ...) plus the records"""
+    __slots__ = ('fields', 'records')
+
+    def __init__(self, fields: Dict[str, Any], records: List[Any]):
+        """
+        Initialize payload
+
+        Args:
+            fields: Header fields sent next to the records; "count" is always
+                set from the number of records
+            records: Record objects or dictionaries
+        """
+        self.fields = fields
+        self.records = records
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Payload':
+        """Wrap a decoded payload dictionary (records stay dictionaries)"""
+        records = data.get('data')
+        fields = {key: value for key, value in data.items() if key != 'data'}
+        return cls(fields, records if isinstance(records, list) else [])
+
+    @property
+    def type(self) -> Optional[str]:
+        return self.fields.get('type')
+
+    def header(self, count: Optional[int] = None, **extra) -> Dict[str, Any]:
+        """Header fields with the record count and any extra fields"""
+        header = dict(self.fields)
+        header['count'] = len(self.records) if count is None else count
+        header.update(extra)
+        return header
+
+    def encode(self, **extra) -> bytes:
+        """
+        Serialize the whole payload
+
+        Args:
+            **extra: Extra header fields (e.g. batch_id, sequence, total_chunks)
+
+        Returns:
+            JSON bytes
+        """
+        document = self.header(**extra)
+        document['data'] = self.records
+        return dumps(document)
+
+    def encode_records(self) -> List[bytes]:
+        """Serialize each record on its own (used to split by size)"""
+        return [dumps(record) for record in self.records]
+
+    def assemble(self, encoded_records: List[bytes], **extra) -> bytes:
+        """
+        Build a payload document from already serialized records
+
+        Args:
+            encoded_records: Output of encode_records (or a slice of it)
+            **extra: Extra header fields
+
+        Returns:
+            JSON bytes equivalent to encode() for those records
+        """
+        header = dumps(self.header(count=len(encoded_records), **extra))
+        return header[:-1] + b',"data":[' + b','.join(encoded_records) + b']}'
@@ -0,0 +1,297 @@
+"""
+Request bodies of /qbwc
+
+Bodies may be gzip- or deflate-encoded (Content-Encoding) and are limited to
+QBWC_MAX_BODY_BYTES once decoded. A QBXML response larger than
+QBWC_SPILL_THRESHOLD_BYTES is written to an anonymous temporary file while it
+is read, and the converter streams it from there, so memory use does not
+grow with the size of the response.
+"""
+import tempfile
+import zlib
+from typing import IO, Awaitable, Callable, Iterable, Iterator, List, Optional, Union
+from utils import get_env_var, logger
+
+# Bytes read from (or inflated into) memory at a time
+READ_CHUNK_SIZE = 64 * 1024
+# Raw bytes of an async request handed to the executor at a time
+EXECUTOR_BATCH_BYTES = 1024 * 1024
+
+# zlib window bits per Content-Encoding
+_DECODERS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+class BodyError(ValueError):
+    """Raised when a request body cannot be accepted"""
+    status = 400
+
+
+class BodyTooLarge(BodyError):
+    """Raised when a body is larger than QBWC_MAX_BODY_BYTES"""
+    status = 413
+
+
+class UnsupportedEncoding(BodyError):
+    """Raised for a Content-Encoding other than gzip or deflate"""
+    status = 415
+
+
+def max_body_bytes() -> int:
+    """Return the largest accepted (decoded) body size"""
+    # ASYNC_MAX_BODY_BYTES was the async-only limit before the limit applied to both modes
+    default = get_env_var('ASYNC_MAX_BODY_BYTES', default=str(512 * 1024 * 1024), required=False)
+    return int(get_env_var('QBWC_MAX_BODY_BYTES', default=default, required=False))
+
+
+def check_content_length(content_length: Optional[int]) -> None:
+    """
+    Reject a body by its declared size before reading it
+
+    Raises:
+        BodyTooLarge: If Content-Length exceeds QBWC_MAX_BODY_BYTES
+    """
+    limit = max_body_bytes()
+    if content_length and content_length > limit:
+        raise BodyTooLarge(f"Request body of {content_length} bytes exceeds the {limit} byte limit")
+
+
+class BodyDecoder:
+    def __init__(self, content_encoding: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        Initialize body decoder
+
+        Args:
+            content_encoding: Content-Encoding header (optional, identity if not provided)
+            max_bytes: Largest decoded size (optional, will use env var if not provided)
+
+        Raises:
+            UnsupportedEncoding: If the encoding is neither gzip nor deflate
+        """
+        encoding = (content_encoding or 'identity').strip().lower()
+        if encoding not in _DECODERS and encoding != 'identity':
+            raise UnsupportedEncoding(f"Unsupported Content-Encoding: {content_encoding}")
+        self._inflater = zlib.decompressobj(_DECODERS[encoding]) if encoding in _DECODERS else None
+        self.max_bytes = max_bytes or max_body_bytes()
+        self.size = 0
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """
+        Decode the next part of the body
+
+        Inflated output is produced at most READ_CHUNK_SIZE bytes at a time and
+        counted against the limit, so a small compressed body cannot expand
+        into unbounded memory.
+
+        Returns:
+            Decoded pieces
+
+        Raises:
+            BodyTooLarge: If the decoded body exceeds the limit
+            BodyError: If the compressed data is corrupt
+        """
+        if self._inflater is None:
+            return [self._count(chunk)] if chunk else []
+        pieces = []
+        try:
+            data = self._inflater.decompress(chunk, READ_CHUNK_SIZE)
+            while data:
+                pieces.append(self._count(data))
+                tail = self._inflater.unconsumed_tail
+                data = self._inflater.decompress(tail, READ_CHUNK_SIZE) if tail else b''
+        except zlib.error as e:
+            raise BodyError(f"Corrupt compressed request body: {e}") from e
+        return pieces
+
+    def close(self) -> List[bytes]:
+        """
+        Finish decoding
+
+        Returns:
+            Remaining decoded pieces
+
+        Raises:
+            BodyError: If a compressed body is truncated
+        """
+        if self._inflater is None:
+            return []
+        try:
+            rest = self._inflater.flush()
+        except zlib.error as e:
+            raise BodyError(f"Corrupt compressed request body: {e}") from e
+        if not self._inflater.eof:
+            raise BodyError("Truncated compressed request body")
+        return [self._count(rest)] if rest else []
+
+    def _count(self, data: bytes) -> bytes:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise BodyTooLarge(f"Request body exceeds the {self.max_bytes} byte limit")
+        return data
+
+
+def decode_chunks(chunks: Iterable[bytes], decoder: BodyDecoder) -> Iterator[bytes]:
+    """
+    Decode and size-check a body as it is read
+
+    Args:
+        chunks: Raw body chunks
+        decoder: Decoder of the request's Content-Encoding (its size is the
+            decoded byte count once the body is read)
+
+    Yields:
+        Decoded chunks
+
+    Raises:
+        BodyError: See BodyDecoder
+    """
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.close()
+
+
+class BodyBuffer:
+    def __init__(self, threshold: Optional[int] = None):
+        """
+        Initialize a buffer that moves to a temporary file once it grows large
+
+        Args:
+            threshold: Bytes kept in memory (optional, will use env var if not provided)
+        """
+        self.threshold = threshold if threshold is not None else int(
+            get_env_var('QBWC_SPILL_THRESHOLD_BYTES', default=str(8 * 1024 * 1024), required=False))
+        self.spill_dir = get_env_var('QBWC_SPILL_DIR', default=tempfile.gettempdir(), required=False)
+        self.size = 0
+        self._pieces = []
+        self._file = None
+
+    def write(self, data: bytes) -> None:
+        """Append UTF-8 encoded data"""
+        self.size += len(data)
+        if self._file is not None:
+            self._file.write(data)
+            return
+        self._pieces.append(data)
+        if self.size > self.threshold:
+            # Anonymous file: removed by the OS as soon as it is closed
+            self._file = tempfile.TemporaryFile(dir=self.spill_dir)
+            self._file.writelines(self._pieces)
+            self._pieces = []
+
+    def getvalue(self) -> Union[str, IO[bytes]]:
+        """
+        Return the buffered body
+
+        Returns:
+            The decoded text when it stayed in memory, otherwise the
+            temporary file (binary, rewound; the caller closes it)
+        """
+        if self._file is None:
+            return b''.join(self._pieces).decode('utf-8')
+        self._file.flush()
+        self._file.seek(0)
+        logger.info(f"Request body of {self.size} bytes spilled to disk")
+        return self._file
+
+    def discard(self) -> None:
+        """Drop the buffered data"""
+        self._pieces = []
+        if self._file is not None:
+            self._file.close()
+
+
+def read_body(chunks: Iterable[bytes], decoder: BodyDecoder) -> Union[str, IO[bytes]]:
+    """
+    Read a whole request body, spilling it to disk when it is large
+
+    Args:
+        chunks: Raw body chunks
+        decoder: Decoder of the request's Content-Encoding
+
+    Returns:
+        Body text, or a temporary file holding it (see BodyBuffer.getvalue)
+
+    Raises:
+        BodyError: See BodyDecoder
+    """
+    buffer = BodyBuffer()
+    try:
+        for data in decode_chunks(chunks, decoder):
+            buffer.write(data)
+    except BaseException:
+        buffer.discard()
+        raise
+    return buffer.getvalue()
+
+
+async def feed_body_async(stream, decoder: BodyDecoder, consume: Callable[[bytes], None],
+                          run_blocking: Callable[..., Awaitable]) -> None:
+    """
+    Read an aiohttp request body, decoding and consuming it off the event loop
+
+    Chunks are read on the loop and handed to the executor about
+    EXECUTOR_BATCH_BYTES at a time, in order, where they are inflated and
+    passed to consume (a parser, a BodyBuffer that may write to disk), so a
+    large upload does not stall the server's other connections. The app
+    turns aiohttp's own decompression off for this.
+
+    Args:
+        stream: aiohttp StreamReader (request.content)
+        decoder: Decoder of the request's Content-Encoding (its size is the
+            decoded byte count once the body is read)
+        consume: Blocking function called with each decoded piece
+        run_blocking: Coroutine function running a blocking call in the executor
+
+    Raises:
+        BodyError: See BodyDecoder
+    """
+    def feed(chunks: List[bytes], last: bool) -> None:
+        for chunk in chunks:
+            for data in decoder.feed(chunk):
+                consume(data)
+        if last:
+            for data in decoder.close():
+                consume(data)
+
+    pending = []
+    size = 0
+    async for chunk in stream.iter_chunked(READ_CHUNK_SIZE):
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= EXECUTOR_BATCH_BYTES:
+            await run_blocking(feed, pending, False)
+            pending = []
+            size = 0
+    await run_blocking(feed, pending, True)
+
+
+async def read_body_async(stream, decoder: BodyDecoder,
+                          run_blocking: Callable[..., Awaitable]) -> Union[str, IO[bytes]]:
+    """
+    Read a whole aiohttp request body (see read_body and feed_body_async)
+
+    Args:
+        stream: aiohttp StreamReader (request.content)
+        decoder: Decoder of the request's Content-Encoding
+        run_blocking: Coroutine function running a blocking call in the executor
+
+    Returns:
+        Body text, or a temporary file holding it
+    """
+    buffer = BodyBuffer()
+    try:
+        await feed_body_async(stream, decoder, buffer.write, run_blocking)
+        return await run_blocking(buffer.getvalue)
+    except BaseException:
+        buffer.discard()
+        raise
+
+
+def release(body) -> None:
+    """Close a spilled body once the request is done (no-op for text)"""
+    if hasattr(body, 'close'):
+        body.close()
+
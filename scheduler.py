@@ -0,0 +1,207 @@
+"""
+Fair scheduling of QBXML conversions across companies
+
+Converting a large response is the heaviest thing the adapter does. The
+scheduler caps conversions running at once in the process
+(SCHEDULER_MAX_CONVERSIONS) and per company (SCHEDULER_MAX_PER_COMPANY or the
+company's max_concurrent). When a slot frees up it goes to the waiting
+company with the fewest conversions running, then the one served least
+recently, oldest request first, so one huge company file cannot starve the
+other companies' sessions.
+"""
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+from utils import get_env_var, logger
+import metrics
+import tracing
+
+
+class SchedulerBusy(Exception):
+    """Raised when no conversion slot became free within SCHEDULER_MAX_WAIT"""
+
+
+class _Waiter:
+    __slots__ = ('company', 'limit', 'order', 'wake', 'granted')
+
+    def __init__(self, company: str, limit: int, order: int, wake):
+        self.company = company
+        self.limit = limit
+        self.order = order
+        self.wake = wake
+        self.granted = False
+
+
+class FairScheduler:
+    def __init__(self, max_total: Optional[int] = None, max_per_company: Optional[int] = None,
+                 max_wait: Optional[float] = None):
+        """
+        Initialize scheduler
+
+        Args:
+            max_total: Conversions running at once in the process
+                (optional, will use env var if not provided)
+            max_per_company: Default conversions running at once per company
+                (optional, will use env var if not provided)
+            max_wait: Seconds a conversion may wait for a slot
+                (optional, will use env var if not provided)
+        """
+        self.max_total = max(1, max_total or int(get_env_var(
+            'SCHEDULER_MAX_CONVERSIONS', default=str(os.cpu_count() or 2), required=False)))
+        self.max_per_company = max(1, max_per_company or int(get_env_var(
+            'SCHEDULER_MAX_PER_COMPANY', default='1', required=False)))
+        # Stay below QBWC's receiveResponseXML timeout
+        self.max_wait = max_wait or float(get_env_var('SCHEDULER_MAX_WAIT', default='60', required=False))
+        self._lock = threading.Lock()
+        self._active = Counter()
+        self._total = 0
+        self._waiters = []
+        self._order = itertools.count()
+        # Grant sequence number of each company's latest slot (round-robin between companies)
+        self._last_grant = {}
+        self._grants = itertools.count()
+
+    def stats(self) -> dict:
+        """Return the running and waiting conversion counts"""
+        with self._lock:
+            return {'active': self._total, 'waiting': len(self._waiters)}
+
+    def _limit(self, limit: Optional[int]) -> int:
+        return max(1, min(limit or self.max_per_company, self.max_total))
+
+    def _try_acquire(self, company: str, limit: int, wake) -> Optional[_Waiter]:
+        """
+        Take a slot right away, or queue a waiter (lock held by the caller)
+
+        Waiters only exist while the global cap or their own company's cap
+        is reached, so a request that fits both caps never jumps a queue
+        that could have used the slot.
+
+        Returns:
+            None if the slot was taken, otherwise the queued waiter
+        """
+        if self._total < self.max_total and self._active[company] < limit:
+            self._grant(company)
+            return None
+        waiter = _Waiter(company, limit, next(self._order), wake)
+        self._waiters.append(waiter)
+        return waiter
+
+    def _grant(self, company: str) -> None:
+        self._active[company] += 1
+        self._total += 1
+        self._last_grant[company] = next(self._grants)
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiters, least-busy then least recently served company first (lock held)"""
+        while self._total < self.max_total:
+            eligible = [waiter for waiter in self._waiters if self._active[waiter.company] < waiter.limit]
+            if not eligible:
+                return
+            waiter = min(eligible, key=lambda w: (self._active[w.company],
+                                                  self._last_grant.get(w.company, -1), w.order))
+            self._waiters.remove(waiter)
+            self._grant(waiter.company)
+            waiter.granted = True
+            waiter.wake()
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """
+        Give up waiting after a timeout
+
+        Returns:
+            True if the slot was granted in the meantime (the caller owns it)
+        """
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def release(self, company: str) -> None:
+        """Free a slot taken by acquire() or acquire_async()"""
+        with self._lock:
+            self._active[company] -= 1
+            if self._active[company] <= 0:
+                del self._active[company]
+            self._total -= 1
+            self._dispatch()
+
+    def acquire(self, company: str, limit: Optional[int] = None) -> None:
+        """
+        Wait for a conversion slot
+
+        Args:
+            company: Company name
+            limit: Company's own cap (optional, SCHEDULER_MAX_PER_COMPANY if not provided)
+
+        Raises:
+            SchedulerBusy: If no slot became free within max_wait
+        """
+        start = time.perf_counter()
+        event = threading.Event()
+        with self._lock:
+            waiter = self._try_acquire(company, self._limit(limit), event.set)
+        if waiter is not None and not event.wait(self.max_wait) and not self._abandon(waiter):
+            self._timed_out(company, start)
+        self._acquired(company, start)
+
+    async def acquire_async(self, company: str, limit: Optional[int] = None) -> None:
+        """Wait for a conversion slot without blocking the event loop (see acquire)"""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            # Slots are released from executor threads
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self._lock:
+            waiter = self._try_acquire(company, self._limit(limit), wake)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    self._timed_out(company, start)
+            except asyncio.CancelledError:
+                if self._abandon(waiter):
+                    self.release(company)
+                raise
+        self._acquired(company, start)
+
+    def _acquired(self, company: str, start: float) -> None:
+        waited = time.perf_counter() - start
+        metrics.QBXML_CONVERSION_WAIT.observe(waited)
+        if waited >= 1:
+            logger.info(f"Conversion slot for {company} after waiting {waited:.1f}s")
+
+    def _timed_out(self, company: str, start: float) -> None:
+        metrics.QBXML_CONVERSION_WAIT.observe(time.perf_counter() - start)
+        logger.warning(f"❌ No conversion slot for {company} within {self.max_wait:g}s")
+        raise SchedulerBusy(f"Server busy: no conversion slot within {self.max_wait:g} seconds")
+
+    @contextmanager
+    def slot(self, company: str, limit: Optional[int] = None):
+        """Hold a conversion slot for the duration of a with block"""
+        with tracing.span('scheduler.acquire', company=company):
+            self.acquire(company, limit)
+        try:
+            yield
+        finally:
+            self.release(company)
+
+    @asynccontextmanager
+    async def slot_async(self, company: str, limit: Optional[int] = None):
+        """Hold a conversion slot for the duration of an async with block"""
+        with tracing.span('scheduler.acquire', company=company):
+            await self.acquire_async(company, limit)
+        try:
+            yield
+        finally:
+            self.release(company)
@@ -0,0 +1,180 @@
+"""
+QBWC session stores
+
+MemorySessionStore keeps tickets inside one process. SQLiteSessionStore keeps
+them in a database file shared by every gunicorn worker on the host, so a
+ticket issued by one worker is valid on the others. Both expire idle tickets
+after SESSION_TTL seconds and cap the number of live tickets.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from typing import Optional
+from utils import get_env_var, logger
+
+
+class SessionStore:
+    """Session store interface"""
+
+    def __init__(self, ttl: float, max_tickets: int):
+        """
+        Initialize session store
+
+        Args:
+            ttl: Seconds a ticket stays valid after its last update
+            max_tickets: Maximum number of live tickets; the least recently
+                updated ticket is evicted when the cap is exceeded
+        """
+        self.ttl = ttl
+        self.max_tickets = max_tickets
+
+    def get(self, ticket: str) -> Optional[dict]:
+        """Return the session for a ticket, or None if unknown or expired"""
+        raise NotImplementedError
+
+    def set(self, ticket: str, session: dict) -> None:
+        """Create or update the session for a ticket and refresh its expiry"""
+        raise NotImplementedError
+
+    def delete(self, ticket: str) -> bool:
+        """Delete a ticket; returns True if it existed"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        """Return the number of live tickets"""
+        raise NotImplementedError
+
+    def __contains__(self, ticket: str) -> bool:
+        return self.get(ticket) is not None
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, ttl: float, max_tickets: int):
+        super().__init__(ttl, max_tickets)
+        self._sessions = OrderedDict()  # ticket -> (expires_at, session), oldest first
+        self._lock = threading.Lock()
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [ticket for ticket, (expires_at, _) in self._sessions.items() if expires_at <= now]
+        for ticket in expired:
+            del self._sessions[ticket]
+        if expired:
+            logger.info(f"Evicted {len(expired)} expired sessions")
+
+    def get(self, ticket: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._sessions.get(ticket)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._sessions[ticket]
+                return None
+            return entry[1]
+
+    def set(self, ticket: str, session: dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._sessions.pop(ticket, None)
+            self._sessions[ticket] = (now + self.ttl, session)
+            self._evict_expired(now)
+            while len(self._sessions) > self.max_tickets:
+                evicted, _ = self._sessions.popitem(last=False)
+                logger.warning(f"Session cap reached, evicted ticket: {evicted[:8]}...")
+
+    def delete(self, ticket: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(ticket, None) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._evict_expired(time.time())
+            return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, ttl: float, max_tickets: int, db_path: Optional[str] = None):
+        """
+        Initialize SQLite session store
+
+        Args:
+            ttl: Seconds a ticket stays valid after its last update
+            max_tickets: Maximum number of live tickets
+            db_path: SQLite database path (optional, will use env var if not provided)
+        """
+        super().__init__(ttl, max_tickets)
+        self.db_path = db_path or get_env_var('SESSION_DB_PATH', default='sessions.db', required=False)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " ticket TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new SQLite connection (connections are not shared between threads)"""
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get(self, ticket: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT data FROM sessions WHERE ticket = ? AND expires_at > ?",
+                (ticket, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, ticket: str, session: dict) -> None:
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (ticket, data, expires_at, updated_at) VALUES (?, ?, ?, ?)",
+                (ticket, json.dumps(session), now + self.ttl, now)
+            )
+            expired = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+            if expired:
+                logger.info(f"Evicted {expired} expired sessions")
+            count = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            if count > self.max_tickets:
+                conn.execute(
+                    "DELETE FROM sessions WHERE ticket IN "
+                    "(SELECT ticket FROM sessions ORDER BY updated_at LIMIT ?)",
+                    (count - self.max_tickets,)
+                )
+                logger.warning(f"Session cap reached, evicted {count - self.max_tickets} tickets")
+
+    def delete(self, ticket: str) -> bool:
+        with closing(self._connect()) as conn, conn:
+            return conn.execute("DELETE FROM sessions WHERE ticket = ?", (ticket,)).rowcount > 0
+
+    def __len__(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+
+def create_session_store() -> SessionStore:
+    """
+    Create the session store configured by SESSION_STORE ("sqlite" or "memory")
+
+    Returns:
+        SessionStore instance
+    """
+    backend = get_env_var('SESSION_STORE', default='sqlite', required=False).lower()
+    ttl = float(get_env_var('SESSION_TTL', default='3600', required=False))
+    max_tickets = int(get_env_var('SESSION_MAX_TICKETS', default='1000', required=False))
+
+    if backend == 'memory':
+        store = MemorySessionStore(ttl, max_tickets)
+    elif backend == 'sqlite':
+        store = SQLiteSessionStore(ttl, max_tickets)
+    else:
+        raise ValueError(f"Unknown SESSION_STORE backend: {backend}")
+
+    logger.info(f"Session store: {backend} (ttl={ttl}s, max_tickets={max_tickets})")
+    return store
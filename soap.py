@@ -0,0 +1,247 @@
+"""
+QBWC SOAP envelopes
+
+The Web Connector posts SOAP 1.1 envelopes to /qbwc. Requests are parsed
+incrementally while the body is read, so a large `response` field is
+unescaped and decoded exactly once (into a temporary file when it is large),
+and responses are rendered from envelope templates compiled at import time.
+"""
+from typing import IO, Dict, Iterable, Optional, Tuple, Union
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+from request_body import BodyBuffer, release
+
+QBWC_NAMESPACE = 'http://developer.intuit.com/'
+SOAP_ENVELOPE_NAMESPACES = (
+    'http://schemas.xmlsoap.org/soap/envelope/',
+    'http://www.w3.org/2003/05/soap-envelope',
+)
+CONTENT_TYPE = 'text/xml; charset=utf-8'
+
+# Bytes read from the request body at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+# QBWC web methods; each returns a string except authenticate (string array)
+SOAP_ACTIONS = (
+    'serverVersion', 'clientVersion', 'authenticate', 'sendRequestXML',
+    'receiveResponseXML', 'connectionError', 'getLastError', 'closeConnection'
+)
+
+_ENVELOPE_PREFIX = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+    '<soap:Body>'
+)
+_ENVELOPE_SUFFIX = '</soap:Body></soap:Envelope>'
+
+
+def _compile_templates() -> Dict[str, Tuple[bytes, bytes]]:
+    """Build the (prefix, suffix) bytes wrapped around each action's result"""
+    templates = {}
+    for action in SOAP_ACTIONS:
+        prefix = (f'{_ENVELOPE_PREFIX}<{action}Response xmlns="{QBWC_NAMESPACE}">'
+                  f'<{action}Result>')
+        suffix = f'</{action}Result></{action}Response>{_ENVELOPE_SUFFIX}'
+        templates[action] = (prefix.encode('utf-8'), suffix.encode('utf-8'))
+    return templates
+
+
+_RESPONSE_TEMPLATES = _compile_templates()
+_FAULT_PREFIX = (f'{_ENVELOPE_PREFIX}<soap:Fault><faultcode>soap:Server</faultcode>'
+                 f'<faultstring>').encode('utf-8')
+_FAULT_SUFFIX = f'</faultstring></soap:Fault>{_ENVELOPE_SUFFIX}'.encode('utf-8')
+
+
+class SoapError(ValueError):
+    """Raised when a request body is not a QBWC SOAP envelope"""
+
+
+def is_soap_request(method: str, args, content_type: Optional[str]) -> bool:
+    """
+    Tell SOAP envelopes from the query-string protocol
+
+    Query-string calls always carry ?action=...; the Web Connector posts
+    text/xml envelopes without it.
+
+    Args:
+        method: HTTP method
+        args: Query-string arguments
+        content_type: Request Content-Type header
+
+    Returns:
+        True if the request should be parsed as a SOAP envelope
+    """
+    return method == 'POST' and not args.get('action') and 'xml' in (content_type or '')
+
+
+# Parameters whose text can be large (the QBXML response): kept in a BodyBuffer
+SPILLED_PARAMS = ('response',)
+
+
+class SoapRequestParser:
+    """
+    Incremental parser for one QBWC SOAP request
+
+    Feed the body as it is received, then call close() to get the action
+    and its parameters. Parameter text is collected as the parser produces
+    it, and the QBXML response moves to a temporary file once it grows past
+    QBWC_SPILL_THRESHOLD_BYTES, so no full-size copy of it is kept in memory.
+    """
+
+    def __init__(self):
+        self._parser = expat.ParserCreate(namespace_separator=' ')
+        self._parser.buffer_text = True
+        self._parser.buffer_size = READ_CHUNK_SIZE
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._text
+        self._depth = 0
+        self._in_body = False
+        self._in_call = False
+        self._param = None
+        self._value = None
+        self.action = None
+        self.params = {}
+
+    def feed(self, chunk: bytes) -> None:
+        """Parse the next part of the body"""
+        self._parse(chunk, False)
+
+    def close(self) -> Tuple[str, Dict[str, Union[str, IO[bytes]]]]:
+        """
+        Finish parsing
+
+        Returns:
+            (action, parameters) where parameters maps element names
+            (ticket, response, strUserName, ...) to their text; a large
+            response is a temporary file instead (see BodyBuffer.getvalue)
+
+        Raises:
+            SoapError: If the body is malformed or is not a QBWC call
+        """
+        self._parse(b'', True)
+        if self.action is None:
+            raise SoapError("SOAP Body does not contain a QBWC call")
+        if self.action not in SOAP_ACTIONS:
+            raise SoapError(f"Unknown SOAP action: {self.action}")
+        return self.action, self.params
+
+    def discard(self) -> None:
+        """Release parameters spilled to disk (after an error)"""
+        if isinstance(self._value, BodyBuffer):
+            self._value.discard()
+        for value in self.params.values():
+            release(value)
+
+    def _parse(self, data: bytes, final: bool) -> None:
+        try:
+            self._parser.Parse(data, final)
+        except expat.ExpatError as e:
+            raise SoapError(f"Malformed SOAP request: {e}") from e
+
+    def _start(self, name: str, attrs: Dict) -> None:
+        self._depth += 1
+        namespace, _, local = name.rpartition(' ')
+        if self._depth == 1 and (local != 'Envelope' or namespace not in SOAP_ENVELOPE_NAMESPACES):
+            raise SoapError(f"Not a SOAP envelope: {name}")
+        if self._depth == 2:
+            self._in_body = local == 'Body'
+        elif self._depth == 3 and self._in_body and self.action is None:
+            self._in_call = True
+            self.action = local
+        elif self._depth == 4 and self._in_call:
+            # Parameter of the call
+            self._param = local
+            self._value = BodyBuffer() if local in SPILLED_PARAMS else []
+
+    def _text(self, data: str) -> None:
+        if self._depth != 4 or self._param is None:
+            return
+        if isinstance(self._value, BodyBuffer):
+            self._value.write(data.encode('utf-8'))
+        else:
+            self._value.append(data)
+
+    def _end(self, name: str) -> None:
+        if self._depth == 4 and self._param is not None:
+            value = self._value
+            self.params[self._param] = value.getvalue() if isinstance(value, BodyBuffer) else ''.join(value)
+            self._param = None
+            self._value = None
+        elif self._depth == 3:
+            self._in_call = False
+        self._depth -= 1
+
+
+def parse_request(chunks: Iterable[bytes]) -> Tuple[str, Dict[str, Union[str, IO[bytes]]]]:
+    """
+    Parse a QBWC SOAP request
+
+    Args:
+        chunks: Request body, as an iterable of (decoded) byte chunks
+
+    Returns:
+        (action, parameters)
+
+    Raises:
+        SoapError: If the body is malformed or is not a QBWC call
+    """
+    parser = SoapRequestParser()
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser.close()
+    except BaseException:
+        parser.discard()
+        raise
+
+
+def _authenticate_strings(result: str) -> list:
+    """
+    Map the handler's newline-separated authenticate result to QBWC's string array
+
+    QBWC reads [ticket, company file ("" = the one open in QuickBooks) /
+    "none" (nothing to do) / "nvu" / "busy", ...]; a rejected login has no
+    ticket.
+    """
+    values = result.split('\n')
+    if values and values[0] in ('nvu', 'busy'):
+        values = ['', values[0]]
+    return values
+
+
+def render_response(action: str, result: str) -> bytes:
+    """
+    Render a QBWC SOAP response
+
+    Args:
+        action: QBWC action
+        result: Handler result (authenticate: newline-separated values)
+
+    Returns:
+        SOAP envelope bytes
+    """
+    prefix, suffix = _RESPONSE_TEMPLATES[action]
+    if action == 'authenticate':
+        body = ''.join(f'<string>{escape(value)}</string>' for value in _authenticate_strings(result))
+    elif action == 'clientVersion' and result == 'OK':
+        # QBWC accepts the client version on an empty result
+        body = ''
+    else:
+        body = escape(result)
+    return prefix + body.encode('utf-8') + suffix
+
+
+def render_fault(message: str) -> bytes:
+    """
+    Render a SOAP fault
+
+    Args:
+        message: Fault string
+
+    Returns:
+        SOAP envelope bytes
+    """
+    return _FAULT_PREFIX + escape(message).encode('utf-8') + _FAULT_SUFFIX
@@ -0,0 +1,370 @@
+"""
+Durable outbound spool for n8n pushes
+
+Converted payloads are written to a SQLite spool and acknowledged to QBWC
+right away. A background SpoolWorker drains the spool to n8n with
+at-least-once delivery, in order per webhook; delivered entries are
+compacted periodically.
+
+Usage:
+    python spool.py status    # Show pending entries
+    python spool.py replay    # Deliver everything left in the spool now
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+from typing import List, Optional, Tuple, Union
+from records import Payload
+from utils import get_env_var, logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process drain lock
+    fcntl = None
+
+
+class SpoolLocked(Exception):
+    """Raised when another process (a running server's SpoolWorker) is draining the spool"""
+
+
+def acquire_drain_lock(db_path: str):
+    """
+    Take the host-wide drain lock of a spool without waiting
+
+    Only one process may drain a spool at a time, so entries are delivered
+    once and in order per webhook even with several gunicorn workers.
+
+    Args:
+        db_path: Spool database path
+
+    Returns:
+        The open lock file (held until closed; True where fcntl is not
+        available), or None if another process holds the lock
+    """
+    if fcntl is None:
+        return True
+    lock_file = open(f"{db_path}.lock", 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+class Spool:
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Initialize spool
+
+        Args:
+            db_path: SQLite database path (optional, will use env var if not provided)
+        """
+        self.db_path = db_path or get_env_var('N8N_SPOOL_PATH', default='spool.db', required=False)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " payload TEXT NOT NULL,"
+                " created_at TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " last_error TEXT,"
+                " delivered_at TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS spool_pending ON spool (delivered_at, id)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(spool)")]
+            if 'item_count' not in columns:
+                conn.execute("ALTER TABLE spool ADD COLUMN item_count INTEGER")
+            if 'webhook_url' not in columns:
+                conn.execute("ALTER TABLE spool ADD COLUMN webhook_url TEXT")
+        # Clients of per-company webhooks, created on first use
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        logger.info(f"Spool initialized at: {self.db_path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new SQLite connection (connections are not shared between threads)"""
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def enqueue(self, payload: Union[Payload, bytes, str], webhook_url: Optional[str] = None) -> int:
+        """
+        Append a payload to the spool
+
+        Args:
+            payload: records.Payload (serialized here, once) or JSON payload for n8n
+            webhook_url: Company webhook (optional, the worker's client URL if not provided)
+
+        Returns:
+            Spool entry id
+        """
+        item_count = None
+        if isinstance(payload, Payload):
+            item_count = len(payload.records)
+            payload = payload.encode()
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "INSERT INTO spool (payload, item_count, webhook_url, created_at) VALUES (?, ?, ?, ?)",
+                (payload, item_count, webhook_url, datetime.now().isoformat())
+            )
+            return cursor.lastrowid
+
+    def peek_heads(self) -> List[Tuple[int, Optional[str]]]:
+        """
+        Get the oldest undelivered entry of each webhook
+
+        Returns:
+            List of (entry id, webhook URL) in spool order; the webhook URL
+            is None for the default webhook
+        """
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT MIN(id), webhook_url FROM spool WHERE delivered_at IS NULL"
+                " GROUP BY webhook_url ORDER BY MIN(id)"
+            ).fetchall()
+
+    def get(self, entry_id: int) -> Tuple[Union[bytes, str], Optional[int]]:
+        """Return the payload and item count of an entry"""
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT payload, item_count FROM spool WHERE id = ?", (entry_id,)).fetchone()
+
+    def mark_delivered(self, entry_id: int) -> None:
+        """Mark an entry as delivered"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE spool SET delivered_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (datetime.now().isoformat(), entry_id)
+            )
+
+    def mark_failed(self, entry_id: int, error: str) -> None:
+        """Record a failed delivery attempt for an entry"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE spool SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+                (error[:500], entry_id)
+            )
+
+    def pending_count(self) -> int:
+        """Return the number of undelivered entries"""
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM spool WHERE delivered_at IS NULL").fetchone()[0]
+
+    def compact(self) -> int:
+        """
+        Delete delivered entries and truncate the write-ahead log
+
+        Returns:
+            Number of entries removed
+        """
+        with closing(self._connect()) as conn:
+            with conn:
+                removed = conn.execute("DELETE FROM spool WHERE delivered_at IS NOT NULL").rowcount
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if removed:
+            logger.info(f"Spool compacted: {removed} delivered entries removed")
+        return removed
+
+    def client_for(self, n8n_client, webhook_url: Optional[str]):
+        """
+        Get the client delivering to an entry's webhook
+
+        Args:
+            n8n_client: Client of the default webhook
+            webhook_url: Entry webhook (None for the default webhook)
+
+        Returns:
+            n8n_client itself, or a client of the same class for the company webhook
+        """
+        if not webhook_url or webhook_url == n8n_client.webhook_url:
+            return n8n_client
+        with self._clients_lock:
+            client = self._clients.get(webhook_url)
+            if client is None:
+                client = self._clients[webhook_url] = type(n8n_client)(webhook_url)
+            return client
+
+    def deliver_next(self, n8n_client) -> Optional[bool]:
+        """
+        Deliver the oldest undelivered entry whose webhook circuit is not open
+
+        Entries are delivered in order per webhook; a webhook that is down
+        does not hold back the entries of other companies.
+
+        Args:
+            n8n_client: N8NClient of the default webhook
+
+        Returns:
+            True if delivered, False if delivery failed or every pending
+            webhook is unavailable, None if the spool is empty
+        """
+        entries = self.peek_heads()
+        if not entries:
+            return None
+
+        for entry_id, webhook_url in entries:
+            client = self.client_for(n8n_client, webhook_url)
+            if client.breaker.retry_in():
+                continue
+            payload, item_count = self.get(entry_id)
+            # Stable batch id so n8n can de-duplicate chunks of a redelivered entry
+            if client.push_data(payload, batch_id=f"spool-{entry_id}", item_count=item_count):
+                self.mark_delivered(entry_id)
+                logger.info(f"✅ Spool entry {entry_id} delivered to n8n")
+                return True
+
+            self.mark_failed(entry_id, "push_data failed")
+            logger.warning(f"Spool entry {entry_id} delivery failed, will retry")
+            return False
+        return False
+
+    def retry_in(self, n8n_client) -> float:
+        """
+        Seconds until a pending webhook accepts deliveries again
+
+        Args:
+            n8n_client: N8NClient of the default webhook
+
+        Returns:
+            Shortest circuit delay among the webhooks with pending entries
+        """
+        delays = [self.client_for(n8n_client, webhook_url).breaker.retry_in()
+                  for _, webhook_url in self.peek_heads()]
+        return min(delays, default=0.0)
+
+
+class SpoolWorker(threading.Thread):
+    def __init__(self, spool: Spool, n8n_client):
+        """
+        Initialize background delivery worker
+
+        Args:
+            spool: Spool to drain
+            n8n_client: N8NClient used to push payloads
+        """
+        super().__init__(name='spool-worker', daemon=True)
+        self.spool = spool
+        self.n8n_client = n8n_client
+        self.poll_interval = float(get_env_var('N8N_SPOOL_POLL_INTERVAL', default='5', required=False))
+        self.max_backoff = float(get_env_var('N8N_SPOOL_MAX_BACKOFF', default='300', required=False))
+        self.compact_interval = float(get_env_var('N8N_SPOOL_COMPACT_INTERVAL', default='600', required=False))
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._lock_file = None
+
+    def notify(self) -> None:
+        """Wake the worker up after a new entry was enqueued"""
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        """Stop the worker"""
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _acquire_drain_lock(self) -> bool:
+        """
+        Make sure only one process on the host drains the spool, so entries
+        are delivered in order even with several gunicorn workers
+
+        Returns:
+            True if this process owns the drain lock
+        """
+        if self._lock_file is not None:
+            return True
+        self._lock_file = acquire_drain_lock(self.spool.db_path)
+        if self._lock_file is None:
+            return False
+        logger.info(f"Spool worker acquired drain lock (pid {os.getpid()})")
+        return True
+
+    def run(self) -> None:
+        """Drain the spool until stopped"""
+        backoff = 0.0
+        last_compact = time.monotonic()
+
+        while not self._stopped.is_set():
+            wait = self.poll_interval
+            try:
+                if self._acquire_drain_lock():
+                    result = self.spool.deliver_next(self.n8n_client)
+                    if result is True:
+                        backoff = 0.0
+                        wait = 0
+                    elif result is False:
+                        backoff = min(self.max_backoff, max(self.poll_interval, backoff * 2))
+                        # No point retrying before the circuit lets a probe through
+                        wait = max(backoff, self.spool.retry_in(self.n8n_client))
+
+                    if time.monotonic() - last_compact >= self.compact_interval:
+                        self.spool.compact()
+                        last_compact = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error in spool worker: {e}", exc_info=True)
+
+            if backoff:
+                # Keep backing off after a failure even if new entries arrive
+                self._stopped.wait(wait)
+            elif wait:
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+
+
+def replay(spool: Optional[Spool] = None, n8n_client=None) -> int:
+    """
+    Deliver every entry left in the spool, stopping at the first failure
+
+    Args:
+        spool: Spool to replay (optional, opened from env vars if not provided)
+        n8n_client: N8NClient (optional, created from env vars if not provided)
+
+    Returns:
+        Number of entries still pending
+
+    Raises:
+        SpoolLocked: If a SpoolWorker of a running server holds the drain lock
+    """
+    from n8n_client import N8NClient
+    spool = spool or Spool()
+    lock_file = acquire_drain_lock(spool.db_path)
+    if lock_file is None:
+        raise SpoolLocked(f"Spool {spool.db_path} is being drained by another process (a running server)")
+    try:
+        n8n_client = n8n_client or N8NClient()
+        delivered = 0
+        while True:
+            result = spool.deliver_next(n8n_client)
+            if result is None:
+                break
+            if result is False:
+                logger.error("Replay stopped: delivery failed")
+                break
+            delivered += 1
+
+        spool.compact()
+    finally:
+        if lock_file is not True:
+            lock_file.close()
+    pending = spool.pending_count()
+    logger.info(f"Replay finished: {delivered} delivered, {pending} pending")
+    return pending
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if command == 'replay':
+        try:
+            sys.exit(1 if replay() else 0)
+        except SpoolLocked as e:
+            logger.error(f"❌ {e}")
+            sys.exit(1)
+    elif command == 'status':
+        print(f"Pending entries: {Spool().pending_count()}")
+    else:
+        print(__doc__)
+        sys.exit(2)
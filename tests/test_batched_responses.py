@@ -0,0 +1,73 @@
+"""
+Tests of XMLConverter.convert_responses on a batched QBXMLMsgsRs
+"""
+import pytest
+from xml_converter import XMLConverter
+
+MIXED_RESPONSE = '''<?xml version="1.0" ?>
+<QBXML><QBXMLMsgsRs>
+<InvoiceQueryRs requestID="1" statusCode="3120" statusSeverity="Error" statusMessage="Object not found"/>
+<CustomerQueryRs requestID="2" statusCode="0" statusSeverity="Info" statusMessage="Status OK">
+<CustomerRet><ListID>80000001-1</ListID><TimeModified>2024-03-05T10:22:11-08:00</TimeModified>
+<Name>Acme</Name><FullName>Acme</FullName><IsActive>true</IsActive>
+<Balance>10.00</Balance><TotalBalance>12.50</TotalBalance></CustomerRet>
+<CustomerRet><ListID>80000002-1</ListID><TimeModified>2024-03-06T09:00:00-08:00</TimeModified>
+<Name>Globex</Name><FullName>Globex</FullName><IsActive>false</IsActive></CustomerRet>
+</CustomerQueryRs>
+<ReceivePaymentQueryRs requestID="3" statusCode="1" statusSeverity="Warn"
+ statusMessage="A query request did not find a matching object in QuickBooks"/>
+<ItemQueryRs requestID="4" statusCode="530" statusSeverity="Warn" statusMessage="Some fields were truncated">
+<ItemServiceRet><ListID>90000001-1</ListID><Name>Consulting</Name><FullName>Consulting</FullName>
+<IsActive>true</IsActive></ItemServiceRet>
+</ItemQueryRs>
+</QBXMLMsgsRs></QBXML>'''
+
+
+@pytest.fixture(params=[True, False], ids=['streaming', 'xmltodict'])
+def converter(request):
+    converter = XMLConverter()
+    converter.streaming = request.param
+    converter.parallel.workers = 0
+    return converter
+
+
+def test_every_response_gets_a_result_in_document_order(converter):
+    results = converter.convert_responses(MIXED_RESPONSE, namespace='acme')
+    assert [(result['request_id'], result['type'], result['status_severity']) for result in results] == [
+        ('1', 'invoices', 'Error'), ('2', 'customers', 'Info'), ('3', 'payments', 'Warn'), ('4', 'items', 'Warn')]
+    assert all(result['namespace'] == 'acme' for result in results)
+
+
+def test_error_response_has_no_payload_and_keeps_its_status(converter):
+    error = converter.convert_responses(MIXED_RESPONSE)[0]
+    assert error['payload'] is None
+    assert error['status_code'] == '3120'
+    assert error['status_message'] == 'Object not found'
+    assert error['record_count'] == 0
+
+
+def test_error_does_not_affect_the_other_responses(converter):
+    customers = converter.convert_responses(MIXED_RESPONSE)[1]
+    assert customers['record_count'] == 2
+    assert customers['payload'].type == 'customers'
+    records = [record.to_dict() for record in customers['payload'].records]
+    assert [(record['list_id'], record['full_name'], record['is_active']) for record in records] == [
+        ('80000001-1', 'Acme', True), ('80000002-1', 'Globex', False)]
+    assert records[0]['total_balance'] == 12.5
+    assert customers['max_time_modified'] == '2024-03-06T09:00:00-08:00'
+
+
+def test_warning_without_records_has_no_payload(converter):
+    payments = converter.convert_responses(MIXED_RESPONSE)[2]
+    assert payments['status_code'] == '1'
+    assert payments['payload'] is None
+
+
+def test_warning_with_records_is_converted(converter):
+    items = converter.convert_responses(MIXED_RESPONSE)[3]
+    assert items['status_code'] == '530'
+    assert [record['list_id'] for record in items['payload'].records] == ['90000001-1']
+
+
+def test_malformed_document_gives_no_results(converter):
+    assert converter.convert_responses(MIXED_RESPONSE[:-40]) == []
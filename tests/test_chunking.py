@@ -0,0 +1,98 @@
+"""
+Tests of N8NClient._split_chunks: item count and byte limits per chunk
+"""
+import json
+import pytest
+from n8n_client import N8NClient
+from records import Payload, dumps
+
+
+@pytest.fixture
+def client():
+    client = N8NClient('http://n8n.test/chunking')
+    client.chunk_size = 0
+    client.chunk_max_bytes = 0
+    return client
+
+
+def make_payload(count: int, memo_size: int = 10) -> Payload:
+    records = [{'txn_id': str(index), 'memo': 'x' * memo_size} for index in range(count)]
+    return Payload({'type': 'invoices'}, records)
+
+
+def decode(chunks: list) -> list:
+    return [json.loads(chunk['body']) for chunk in chunks]
+
+
+def test_small_payload_is_one_chunk_without_batch_fields(client):
+    client.chunk_size = 10
+    payload = make_payload(10)
+
+    chunks = client._split_chunks(payload)
+    assert len(chunks) == 1
+    assert chunks[0]['sequence'] is None
+    assert chunks[0]['body'] == payload.encode()
+
+
+def test_split_by_item_count(client):
+    client.chunk_size = 4
+    payload = make_payload(10)
+
+    chunks = client._split_chunks(payload, batch_id='batch-1')
+    documents = decode(chunks)
+    assert [document['count'] for document in documents] == [4, 4, 2]
+    assert [(chunk['sequence'], chunk['total_chunks'], chunk['batch_id']) for chunk in chunks] == \
+        [(1, 3, 'batch-1'), (2, 3, 'batch-1'), (3, 3, 'batch-1')]
+    assert all(document['sequence'] == chunk['sequence'] and document['total_chunks'] == 3
+               and document['batch_id'] == 'batch-1' and document['type'] == 'invoices'
+               for document, chunk in zip(documents, chunks))
+    assert [record for document in documents for record in document['data']] == payload.records
+
+
+def test_generated_batch_id_is_shared_by_the_chunks(client):
+    client.chunk_size = 3
+
+    chunks = client._split_chunks(make_payload(7))
+    assert len({chunk['batch_id'] for chunk in chunks}) == 1
+    assert chunks[0]['batch_id']
+
+
+def test_split_by_serialized_size(client):
+    client.chunk_max_bytes = 200
+    payload = make_payload(20, memo_size=30)
+    record_bytes = len(dumps(payload.records[0])) + 1
+
+    chunks = client._split_chunks(payload)
+    documents = decode(chunks)
+    assert len(chunks) > 1
+    for document in documents:
+        assert document['count'] == len(document['data'])
+        assert document['count'] * record_bytes <= client.chunk_max_bytes
+    # Chunks are filled up to the limit
+    assert documents[0]['count'] == client.chunk_max_bytes // record_bytes
+    assert [record for document in documents for record in document['data']] == payload.records
+
+
+def test_record_larger_than_the_byte_limit_goes_alone(client):
+    client.chunk_max_bytes = 50
+    payload = make_payload(3, memo_size=100)
+
+    documents = decode(client._split_chunks(payload))
+    assert [document['count'] for document in documents] == [1, 1, 1]
+
+
+def test_count_and_byte_limits_combined(client):
+    client.chunk_size = 3
+    client.chunk_max_bytes = 10_000
+    payload = make_payload(8)
+
+    documents = decode(client._split_chunks(payload))
+    assert [document['count'] for document in documents] == [3, 3, 2]
+
+
+def test_empty_payload_is_one_chunk(client):
+    client.chunk_size = 2
+
+    chunks = client._split_chunks(make_payload(0))
+    assert len(chunks) == 1
+    assert json.loads(chunks[0]['body'])['data'] == []
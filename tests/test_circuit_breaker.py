@@ -0,0 +1,134 @@
+"""
+Tests of the n8n circuit breaker state machine
+"""
+import types
+import pytest
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the breaker's monotonic clock with one the test moves forward"""
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+
+    def advance(seconds: float) -> None:
+        now[0] += seconds
+
+    return advance
+
+
+def make_breaker(**kwargs) -> CircuitBreaker:
+    options = {'failure_threshold': 3, 'reset_timeout': 10, 'max_reset_timeout': 100, 'probe_timeout': 30}
+    options.update(kwargs)
+    return CircuitBreaker('http://n8n.test/webhook', **options)
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.allow_request()
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    assert 5 <= breaker.retry_in() <= 10
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_a_single_probe_through(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+    clock(10)
+
+    assert breaker.state == HALF_OPEN
+    assert breaker.retry_in() == 0
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_successful_probe_closes_the_circuit(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+    clock(10)
+    assert breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+    assert breaker.snapshot()['trips'] == 0
+
+
+def test_failed_probe_reopens_for_longer(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+    clock(10)
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    # Second trip: between half and all of 2 * reset_timeout
+    assert 10 <= breaker.retry_in() <= 20
+    assert breaker.snapshot()['trips'] == 2
+
+
+def test_open_time_is_capped(clock):
+    breaker = make_breaker(max_reset_timeout=15)
+    open_breaker(breaker)
+    for _ in range(5):
+        clock(100)
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.retry_in() <= 15
+
+
+def test_probe_that_never_reports_back_is_replaced(clock):
+    breaker = make_breaker(probe_timeout=30)
+    open_breaker(breaker)
+    clock(10)
+    assert breaker.allow_request()
+
+    clock(29)
+    assert not breaker.allow_request()
+    clock(1)
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_release_probe_frees_the_probe_without_an_outcome(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+    clock(10)
+    assert breaker.allow_request()
+
+    breaker.release_probe()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_release_probe_while_closed_changes_nothing(clock):
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.release_probe()
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()['consecutive_failures'] == 1
@@ -0,0 +1,90 @@
+"""
+The streaming, xmltodict and parallel conversion paths give the same output
+on the benchmark generator's documents
+"""
+import pytest
+from benchmarks.qbxml_generator import InvoiceGenerator
+from xml_converter import XMLConverter
+
+
+def generated_documents() -> dict:
+    def generator() -> InvoiceGenerator:
+        return InvoiceGenerator(lines_per_invoice=3, customer_ref_list_ratio=0.3, missing_field_ratio=0.2,
+                                invalid_ratio=0.05, seed=7)
+
+    # Two pages of one query in a single QBXMLMsgsRs, the first with an iterator
+    pages = generator()
+    batched = ''.join(['<?xml version="1.0" ?>\n<QBXML><QBXMLMsgsRs>',
+                       *pages.iter_query_rs(120, request_id='1', iterator_id='{a1b2}', iterator_remaining=40),
+                       *pages.iter_query_rs(60, request_id='2', first_index=500),
+                       '</QBXMLMsgsRs></QBXML>'])
+    return {'single': generator().response(250), 'batched': batched}
+
+
+DOCUMENTS = generated_documents()
+
+
+def normalize(results: list) -> list:
+    """Results as plain data, without the conversion timestamp"""
+    normalized = []
+    for result in results:
+        result = dict(result)
+        payload = result.pop('payload')
+        if payload is not None:
+            result['fields'] = {key: value for key, value in payload.fields.items() if key != 'timestamp'}
+            result['records'] = [record.to_dict() for record in payload.records]
+        normalized.append(result)
+    return normalized
+
+
+def convert(document: str, streaming: bool) -> list:
+    converter = XMLConverter()
+    converter.streaming = streaming
+    converter.parallel.workers = 0
+    return normalize(converter.convert_responses(document, namespace='acme'))
+
+
+@pytest.mark.parametrize('name', DOCUMENTS)
+def test_streaming_and_xmltodict_agree(name):
+    streaming = convert(DOCUMENTS[name], streaming=True)
+    assert streaming == convert(DOCUMENTS[name], streaming=False)
+    assert all(result['records'] for result in streaming)
+
+
+def test_generated_invalid_invoices_are_skipped():
+    result = convert(DOCUMENTS['single'], streaming=True)[0]
+    assert result['record_count'] == 250
+    assert 0 < len(result['records']) < 250
+
+
+@pytest.mark.parametrize('name', DOCUMENTS)
+def test_parallel_agrees_with_streaming(name):
+    converter = XMLConverter()
+    converter.parallel.workers = 2
+    converter.parallel.min_chars = 0
+    converter.parallel.shard_chars = 20_000
+    pool_results = []
+    pool_map = converter.parallel.map
+    converter.parallel.map = lambda shards: pool_results.append(pool_map(shards)) or pool_results[-1]
+    try:
+        parallel = normalize(converter.convert_responses(DOCUMENTS[name], namespace='acme'))
+    finally:
+        converter.parallel.shutdown()
+
+    # The pool converted several shards (no inline fallback)
+    assert pool_results and all(shards is not None and len(shards) > 1 for shards in pool_results)
+    assert parallel == convert(DOCUMENTS[name], streaming=True)
+
+
+@pytest.mark.parametrize('name', DOCUMENTS)
+def test_stream_responses_hands_out_the_same_records(name):
+    converter = XMLConverter()
+    converter.parallel.workers = 0
+    queries = []
+    streamed = {}
+    for query_info, records in converter.stream_responses(DOCUMENTS[name], queries, 'acme', group_size=50):
+        streamed.setdefault(query_info['request_id'], []).extend(record.to_dict() for record in records)
+
+    expected = convert(DOCUMENTS[name], streaming=True)
+    assert [query_info['request_id'] for query_info in queries] == [result['request_id'] for result in expected]
+    assert streamed == {result['request_id']: result['records'] for result in expected}
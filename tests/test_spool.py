@@ -0,0 +1,125 @@
+"""
+Tests of the outbound spool: delivery order per webhook and open circuits
+"""
+import json
+import pytest
+from circuit_breaker import CircuitBreaker
+from records import Payload
+from spool import Spool, SpoolLocked, acquire_drain_lock, fcntl, replay
+
+DEFAULT_URL = 'http://n8n.test/default'
+COMPANY_URL = 'http://n8n.test/company'
+
+
+class FakeClient:
+    """Stands in for N8NClient: records pushes, fails for the webhooks in `failing`"""
+    pushes = []
+    failing = set()
+    breakers = {}
+
+    def __init__(self, webhook_url: str):
+        self.webhook_url = webhook_url
+        self.breaker = self.breakers.setdefault(
+            webhook_url, CircuitBreaker(webhook_url, failure_threshold=1, reset_timeout=60, probe_timeout=60))
+
+    def push_data(self, payload, batch_id=None, item_count=None) -> bool:
+        self.pushes.append((self.webhook_url, json.loads(payload)['ref'], batch_id, item_count))
+        return self.webhook_url not in self.failing
+
+
+@pytest.fixture
+def client():
+    FakeClient.pushes = []
+    FakeClient.failing = set()
+    FakeClient.breakers = {}
+    return FakeClient(DEFAULT_URL)
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return Spool(str(tmp_path / 'spool.db'))
+
+
+def delivered(client) -> list:
+    return [(url, ref) for url, ref, _, _ in client.pushes]
+
+
+def test_entries_are_delivered_in_order(spool, client):
+    for ref in ('a', 'b', 'c'):
+        spool.enqueue(json.dumps({'ref': ref}))
+
+    assert [spool.deliver_next(client) for _ in range(4)] == [True, True, True, None]
+    assert delivered(client) == [(DEFAULT_URL, 'a'), (DEFAULT_URL, 'b'), (DEFAULT_URL, 'c')]
+    assert spool.pending_count() == 0
+
+
+def test_order_is_kept_per_webhook(spool, client):
+    spool.enqueue(json.dumps({'ref': 'default-1'}))
+    spool.enqueue(json.dumps({'ref': 'company-1'}), webhook_url=COMPANY_URL)
+    spool.enqueue(json.dumps({'ref': 'default-2'}))
+    spool.enqueue(json.dumps({'ref': 'company-2'}), webhook_url=COMPANY_URL)
+
+    while spool.deliver_next(client):
+        pass
+    assert delivered(client) == [(DEFAULT_URL, 'default-1'), (COMPANY_URL, 'company-1'),
+                                 (DEFAULT_URL, 'default-2'), (COMPANY_URL, 'company-2')]
+
+
+def test_failed_entry_stays_at_the_head(spool, client):
+    first = spool.enqueue(json.dumps({'ref': 'a'}))
+    spool.enqueue(json.dumps({'ref': 'b'}))
+    FakeClient.failing.add(DEFAULT_URL)
+    client.breaker.failure_threshold = 10
+
+    assert spool.deliver_next(client) is False
+    assert spool.peek_heads() == [(first, None)]
+
+    FakeClient.failing.clear()
+    assert spool.deliver_next(client) is True
+    assert spool.deliver_next(client) is True
+    assert delivered(client) == [(DEFAULT_URL, 'a'), (DEFAULT_URL, 'a'), (DEFAULT_URL, 'b')]
+
+
+def test_webhook_with_open_circuit_is_skipped(spool, client):
+    spool.enqueue(json.dumps({'ref': 'company-1'}), webhook_url=COMPANY_URL)
+    spool.enqueue(json.dumps({'ref': 'default-1'}))
+    company_breaker = spool.client_for(client, COMPANY_URL).breaker
+    company_breaker.allow_request()
+    company_breaker.record_failure()
+
+    assert spool.deliver_next(client) is True
+    assert delivered(client) == [(DEFAULT_URL, 'default-1')]
+
+    # Only the unavailable webhook is left: nothing is sent until its circuit allows it
+    assert spool.deliver_next(client) is False
+    assert spool.pending_count() == 1
+    assert spool.retry_in(client) > 0
+    assert delivered(client) == [(DEFAULT_URL, 'default-1')]
+
+
+def test_payload_is_pushed_with_a_stable_batch_id(spool, client):
+    entry_id = spool.enqueue(Payload({'type': 'invoices', 'ref': 'a'}, [{'txn_id': '1'}, {'txn_id': '2'}]))
+
+    assert spool.deliver_next(client) is True
+    assert client.pushes == [(DEFAULT_URL, 'a', f"spool-{entry_id}", 2)]
+
+
+def test_replay_drains_the_spool(spool, client):
+    spool.enqueue(json.dumps({'ref': 'a'}))
+    spool.enqueue(json.dumps({'ref': 'b'}), webhook_url=COMPANY_URL)
+
+    assert replay(spool, client) == 0
+    assert delivered(client) == [(DEFAULT_URL, 'a'), (COMPANY_URL, 'b')]
+
+
+@pytest.mark.skipif(fcntl is None, reason="no drain lock without fcntl")
+def test_replay_refuses_while_the_spool_is_being_drained(spool, client):
+    spool.enqueue(json.dumps({'ref': 'a'}))
+    lock_file = acquire_drain_lock(spool.db_path)
+    try:
+        with pytest.raises(SpoolLocked):
+            replay(spool, client)
+    finally:
+        lock_file.close()
+    assert client.pushes == []
+    assert spool.pending_count() == 1
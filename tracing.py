@@ -0,0 +1,233 @@
+"""
+Span tracing and sampled profiling of the QBWC request pipeline
+
+With TRACE_ENABLED, the stages of each request (endpoint, body parsing,
+conversion slot, QBXML conversion, serialization, webhook POSTs) are recorded
+as spans tagged with the session ticket. A background thread appends them to
+TRACE_DIR/trace_<pid>.json in the Chrome trace event format, which Perfetto
+(ui.perfetto.dev) and chrome://tracing open directly; spans of a thread (or,
+in async mode, of a request's task) nest on one track.
+
+With PROFILE_SAMPLE_RATE above 0, that share of requests runs under cProfile
+and the stats are saved to PROFILE_DIR for pstats, snakeviz and the like.
+"""
+import asyncio
+import atexit
+import cProfile
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+from utils import get_env_var, get_log_ticket, logger
+
+# TRACE_ENABLED and PROFILE_SAMPLE_RATE, read on first use (after the app loads .env)
+_trace_enabled = None
+_profile_sample_rate = None
+# Spans waiting for the writer (oldest dropped if the writer falls behind)
+_events = deque(maxlen=100000)
+_writer = None
+_writer_lock = threading.Lock()
+# Tracks named in this process's trace file
+_named_tracks = set()
+# Thread currently running under cProfile (profiles cannot nest)
+_profiling = threading.local()
+
+
+def trace_enabled() -> bool:
+    """Return True if spans are recorded (TRACE_ENABLED)"""
+    global _trace_enabled
+    if _trace_enabled is None:
+        _trace_enabled = get_env_var('TRACE_ENABLED', default='false', required=False).lower() == 'true'
+    return _trace_enabled
+
+
+def profile_sample_rate() -> float:
+    """Return the share of requests run under cProfile (PROFILE_SAMPLE_RATE)"""
+    global _profile_sample_rate
+    if _profile_sample_rate is None:
+        _profile_sample_rate = float(get_env_var('PROFILE_SAMPLE_RATE', default='0', required=False))
+    return _profile_sample_rate
+
+
+def _track() -> tuple:
+    """Return the (track id, track name) of the caller: its asyncio task, or its thread"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return id(task), task.get_name()
+    thread = threading.current_thread()
+    return threading.get_native_id(), thread.name
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Record the duration of a with block as a span
+
+    Args:
+        name: Span name ("component.operation")
+        **attributes: Span attributes (JSON-serializable)
+
+    Yields:
+        The attribute dictionary, to add attributes known only inside the block
+    """
+    if not trace_enabled():
+        yield attributes
+        return
+    start_us = time.time_ns() // 1000
+    start = time.perf_counter_ns()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes['error'] = type(e).__name__
+        raise
+    finally:
+        duration_us = (time.perf_counter_ns() - start) // 1000
+        # Read at the end: the endpoint learns the ticket only once the request is parsed
+        ticket = get_log_ticket()
+        if ticket:
+            attributes['ticket'] = ticket
+        track, track_name = _track()
+        _events.append({'name': name, 'cat': name.split('.', 1)[0], 'ph': 'X', 'ts': start_us,
+                        'dur': duration_us, 'tid': track, 'track_name': track_name, 'args': attributes})
+        _ensure_writer()
+
+
+def _ensure_writer() -> None:
+    """Start the writer of this process (again after a fork)"""
+    global _writer
+    if _writer is not None and _writer.pid == os.getpid():
+        return
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid():
+            _named_tracks.clear()
+            _writer = TraceWriter()
+            _writer.start()
+
+
+class TraceWriter(threading.Thread):
+    def __init__(self, interval: Optional[float] = None):
+        """
+        Initialize the background writer of this process's trace file
+
+        Args:
+            interval: Seconds between writes (optional, will use env var if not provided)
+        """
+        super().__init__(name='trace-writer', daemon=True)
+        self.pid = os.getpid()
+        self.interval = interval or float(get_env_var('TRACE_FLUSH_INTERVAL', default='1', required=False))
+        self.max_bytes = int(get_env_var('TRACE_MAX_BYTES', default=str(100 * 1024 * 1024), required=False))
+        directory = get_env_var('TRACE_DIR', default=os.path.join(tempfile.gettempdir(), 'qbwc_traces'),
+                                required=False)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"trace_{self.pid}.json")
+        self._file = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        atexit.register(self.flush)
+
+    def stop(self) -> None:
+        """Stop the writer after writing the remaining spans"""
+        self._stopped.set()
+        self.flush()
+
+    def run(self) -> None:
+        logger.info(f"Writing trace spans to {self.path}")
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error writing trace spans: {e}", exc_info=True)
+
+    def flush(self) -> None:
+        """Append the buffered spans to the trace file"""
+        with self._lock:
+            # A forked child inherits this writer (and its atexit hook), but has its own
+            if not _events or self.pid != os.getpid():
+                return
+            if self._file is None:
+                self._open()
+            lines = []
+            while _events:
+                event = _events.popleft()
+                event['pid'] = self.pid
+                track_name = event.pop('track_name')
+                if event['tid'] not in _named_tracks:
+                    _named_tracks.add(event['tid'])
+                    lines.append(self._metadata('thread_name', track_name, event['tid']))
+                lines.append(json.dumps(event, default=str) + ',\n')
+            self._file.writelines(lines)
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes:
+                # Keep one previous file, so the trace cannot fill the disk
+                self._file.close()
+                os.replace(self.path, self.path + '.1')
+                self._open()
+
+    def _open(self) -> None:
+        """
+        Start a new trace file
+
+        The JSON array is never closed: trace viewers accept a file that ends
+        after the last event, so spans are simply appended.
+        """
+        self._file = open(self.path, 'w', encoding='utf-8')
+        _named_tracks.clear()
+        self._file.write('[\n' + self._metadata('process_name', f"qbwc {self.pid}"))
+
+    def _metadata(self, kind: str, value: str, tid: int = 0) -> str:
+        return json.dumps({'name': kind, 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': value}}) + ',\n'
+
+
+@contextmanager
+def profiled(name: str):
+    """
+    Run a with block under cProfile for a sampled share of calls
+
+    Only the calling thread is profiled, and a block inside a profiled one
+    is not sampled again.
+
+    Args:
+        name: Prefix of the saved profile (e.g. "qbwc")
+
+    Yields:
+        Dictionary of labels added to the profile's file name
+        (e.g. {'action': 'receiveResponseXML'})
+    """
+    labels = {}
+    rate = profile_sample_rate()
+    if rate <= 0 or getattr(_profiling, 'active', False) or random.random() >= rate:
+        yield labels
+        return
+    profile = cProfile.Profile()
+    _profiling.active = True
+    profile.enable()
+    try:
+        yield labels
+    finally:
+        profile.disable()
+        _profiling.active = False
+        _save_profile(profile, name, labels)
+
+
+def _save_profile(profile: cProfile.Profile, name: str, labels: dict) -> None:
+    """Write a profile to PROFILE_DIR (a failure is logged, never raised)"""
+    try:
+        directory = get_env_var('PROFILE_DIR', default=os.path.join(tempfile.gettempdir(), 'qbwc_profiles'),
+                                required=False)
+        os.makedirs(directory, exist_ok=True)
+        parts = [datetime.now().strftime('%Y%m%d-%H%M%S-%f'), name, *map(str, labels.values()),
+                 get_log_ticket() or 'noticket', str(os.getpid())]
+        path = os.path.join(directory, '_'.join(part for part in parts if part) + '.prof')
+        profile.dump_stats(path)
+        logger.info(f"Saved profile {path}")
+    except Exception as e:
+        logger.error(f"❌ Error saving profile: {e}", exc_info=True)
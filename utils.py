@@ -2,18 +2,148 @@
 Utility functions for the QBWC Adapter
 """
 import os
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import queue
+import threading
+from collections import Counter
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from typing import Optional
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
+# Ticket of the QBWC session being served, added to log records for correlation
+_log_ticket = contextvars.ContextVar('log_ticket', default=None)
+
+
+def set_log_ticket(ticket: Optional[str]) -> None:
+    """
+    Set the QBWC ticket logged with records emitted from the current request
+    
+    Args:
+        ticket: Session ticket (only its first 8 characters are logged) or None
+    """
+    _log_ticket.set(ticket[:8] if ticket else None)
+
+
+def get_log_ticket() -> Optional[str]:
+    """Return the (shortened) QBWC ticket of the current request, or None"""
+    return _log_ticket.get()
+
+
+class TicketFilter(logging.Filter):
+    """Attach the current ticket to each record (runs in the thread that logs)"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.ticket = _log_ticket.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, ticket (+ exception)"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, LOG_DATE_FORMAT),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'ticket': getattr(record, 'ticket', None)
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _PreparedQueueHandler(QueueHandler):
+    """Queue handler that keeps exceptions apart from the message (for JSON output)"""
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge arguments now: they may change or be unpicklable by the time the listener runs
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging() -> Optional[QueueListener]:
+    """
+    Configure the root logger from LOG_LEVEL, LOG_FORMAT (text or json) and LOG_QUEUE
+    
+    With LOG_QUEUE (default) callers only enqueue records; a background
+    listener thread formats and writes them to stderr.
+    
+    Returns:
+        The started queue listener, or None when logging synchronously
+    """
+    # Read directly: get_env_var logs, and logging is not configured yet
+    level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    output = logging.StreamHandler()
+    if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+    
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    
+    if os.getenv('LOG_QUEUE', 'true').lower() != 'true':
+        output.addFilter(TicketFilter())
+        root.addHandler(output)
+        return None
+    
+    handler = _PreparedQueueHandler(queue.SimpleQueue())
+    handler.addFilter(TicketFilter())
+    root.addHandler(handler)
+    listener = QueueListener(handler.queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
 
+# Per-record messages: log the first LOG_SAMPLE_FIRST of a kind, then one in LOG_SAMPLE_EVERY
+LOG_SAMPLE_FIRST = int(os.getenv('LOG_SAMPLE_FIRST', '10'))
+LOG_SAMPLE_EVERY = max(1, int(os.getenv('LOG_SAMPLE_EVERY', '100')))
+_sample_counts = Counter()
+_sample_lock = threading.Lock()
+
+
+def log_sampled(level: int, key: str, message: str, *args, **kwargs) -> None:
+    """
+    Log a message emitted once per record, sampled so large syncs do not flood the log
+    
+    Args:
+        level: Logging level
+        key: Kind of message counted together (e.g. "invoice-validation")
+        message: %-style message (formatted only when it is logged)
+        *args: Message arguments
+        **kwargs: logger.log keyword arguments (exc_info, ...)
+    """
+    if not logger.isEnabledFor(level):
+        return
+    with _sample_lock:
+        _sample_counts[key] += 1
+        count = _sample_counts[key]
+    if count <= LOG_SAMPLE_FIRST:
+        logger.log(level, message, *args, **kwargs)
+    elif count % LOG_SAMPLE_EVERY == 0:
+        logger.log(level, message + " (%d so far, sampled 1/%d)", *args, count, LOG_SAMPLE_EVERY, **kwargs)
+
 
 def get_env_var(name: str, default: Optional[str] = None, required: bool = True) -> str:
     """
@@ -36,7 +166,7 @@ def get_env_var(name: str, default: Optional[str] = None, required: bool = True)
         raise ValueError(f"Required environment variable {name} is not set")
     
     if value:
-        logger.debug(f"Environment variable {name} is set")
+        logger.debug("Environment variable %s is set", name)
     else:
         logger.warning(f"Environment variable {name} is not set, using default: {default}")
     
@@ -59,10 +189,47 @@ def safe_float(value, default=0.0):
             return default
         return float(value)
     except (ValueError, TypeError):
-        logger.warning(f"Could not convert {value} to float, using default {default}")
+        log_sampled(logging.WARNING, 'safe-float', "Could not convert %s to float, using default %s", value, default)
         return default
 
 
+def qb_timestamp(value) -> Optional[float]:
+    """
+    Convert a QuickBooks date/datetime string to a POSIX timestamp
+    
+    Args:
+        value: QuickBooks DATETIMETYPE or DATETYPE string
+            (e.g. "2024-03-05T10:22:11-08:00" or "2024-03-05")
+    
+    Returns:
+        Timestamp (comparable across UTC offsets) or None if invalid
+    """
+    try:
+        if not value:
+            return None
+        return datetime.fromisoformat(str(value)).timestamp()
+    except (ValueError, TypeError):
+        log_sampled(logging.WARNING, 'qb-timestamp', "Could not parse QuickBooks datetime: %s", value)
+        return None
+
+
+def source_length(source) -> int:
+    """
+    Get the size of a QBXML source
+    
+    Args:
+        source: Text, bytes or a binary file (e.g. a spilled request body)
+    
+    Returns:
+        Characters of text, bytes of bytes or files, 0 for None
+    """
+    if source is None:
+        return 0
+    if hasattr(source, 'fileno'):
+        return os.fstat(source.fileno()).st_size
+    return len(source)
+
+
 def validate_invoice_data(invoice_data: dict) -> bool:
     """
     Validate invoice data before sending
@@ -88,6 +255,55 @@ def validate_invoice_data(invoice_data: dict) -> bool:
     if not invoice_data['txn_id']:
         raise ValueError("TxnID cannot be empty")
     
-    logger.debug(f"Invoice data validated: {invoice_data.get('ref_number', 'N/A')}")
+    logger.debug("Invoice data validated: %s", invoice_data.get('ref_number', 'N/A'))
+    return True
+
+
+def validate_payment_data(payment_data: dict) -> bool:
+    """
+    Validate received payment data before sending
+    
+    Args:
+        payment_data: Payment data dictionary
+    
+    Returns:
+        True if valid
+    
+    Raises:
+        ValueError: If validation fails
+    """
+    for field in ['txn_id', 'date', 'total_amount']:
+        if field not in payment_data:
+            raise ValueError(f"Missing required field: {field}")
+    
+    if payment_data['total_amount'] < 0:
+        raise ValueError("Total amount cannot be negative")
+    
+    if not payment_data['txn_id']:
+        raise ValueError("TxnID cannot be empty")
+    
+    logger.debug("Payment data validated: %s", payment_data.get('ref_number', 'N/A'))
     return True
 
+
+def validate_list_data(list_data: dict) -> bool:
+    """
+    Validate list record data (customers, items) before sending
+    
+    Args:
+        list_data: List record dictionary
+    
+    Returns:
+        True if valid
+    
+    Raises:
+        ValueError: If validation fails
+    """
+    if not list_data.get('list_id'):
+        raise ValueError("ListID cannot be empty")
+    
+    if not list_data.get('full_name') and not list_data.get('name'):
+        raise ValueError("Name cannot be empty")
+    
+    logger.debug("List record validated: %s", list_data.get('full_name', 'N/A'))
+    return True
@@ -0,0 +1,98 @@
+"""
+Persistent per-company modified-date watermarks for incremental sync
+"""
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+from typing import Optional
+from utils import get_env_var, logger, qb_timestamp
+
+
+class WatermarkStore:
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Initialize watermark store
+
+        Args:
+            db_path: SQLite database path (optional, will use env var if not provided)
+        """
+        self.db_path = db_path or get_env_var('WATERMARK_DB_PATH', default='watermarks.db', required=False)
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entity_watermarks ("
+                " company_file TEXT NOT NULL,"
+                " entity TEXT NOT NULL,"
+                " time_modified TEXT NOT NULL,"
+                " updated_at TEXT NOT NULL,"
+                " PRIMARY KEY (company_file, entity))"
+            )
+            # Carry over invoice watermarks from the single-entity table
+            legacy = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'watermarks'"
+            ).fetchone()
+            if legacy:
+                conn.execute(
+                    "INSERT OR IGNORE INTO entity_watermarks (company_file, entity, time_modified, updated_at) "
+                    "SELECT company_file, 'Invoice', time_modified, updated_at FROM watermarks"
+                )
+                conn.execute("DROP TABLE watermarks")
+        logger.info(f"Watermark store initialized at: {self.db_path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new SQLite connection (connections are not shared between threads)"""
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get(self, company_file: str, entity: str = 'Invoice') -> Optional[str]:
+        """
+        Get the watermark for a company file and entity
+
+        Args:
+            company_file: QuickBooks company file name
+            entity: Synced entity (Invoice, Customer, ...)
+
+        Returns:
+            Highest TimeModified pushed successfully, or None
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT time_modified FROM entity_watermarks WHERE company_file = ? AND entity = ?",
+                (company_file or '', entity)
+            ).fetchone()
+        return row[0] if row else None
+
+    def update(self, company_file: str, time_modified: str, entity: str = 'Invoice') -> bool:
+        """
+        Advance the watermark for a company file and entity (never moves it backwards)
+
+        Args:
+            company_file: QuickBooks company file name
+            time_modified: TimeModified value of the newest record pushed
+            entity: Synced entity (Invoice, Customer, ...)
+
+        Returns:
+            True if the watermark was advanced
+        """
+        new_time = qb_timestamp(time_modified)
+        if new_time is None:
+            logger.warning(f"Ignoring invalid watermark value: {time_modified}")
+            return False
+
+        with self._lock, closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT time_modified FROM entity_watermarks WHERE company_file = ? AND entity = ?",
+                (company_file or '', entity)
+            ).fetchone()
+            if row:
+                current_time = qb_timestamp(row[0])
+                if current_time is not None and current_time >= new_time:
+                    return False
+            conn.execute(
+                "INSERT OR REPLACE INTO entity_watermarks (company_file, entity, time_modified, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (company_file or '', entity, time_modified, datetime.now().isoformat())
+            )
+
+        logger.info(f"{entity} watermark for company '{company_file}' advanced to {time_modified}")
+        return True
@@ -1,111 +1,631 @@
 import xmltodict
-import json
+import itertools
+import logging
+import mmap
+import time
+import xml.etree.ElementTree as ET
 from datetime import datetime
-from typing import Optional, Dict, List
-from utils import logger, safe_float, validate_invoice_data
+from typing import Optional, Dict, FrozenSet, List, Iterator, Tuple, Union, IO
+from fingerprint_index import fingerprint_record
+from records import Payload, Record
+from field_projection import FieldProjection
+from parallel_conversion import ParallelConversion, shard_document, split_response
+import metrics
+import tracing
+from utils import (get_env_var, logger, log_sampled, safe_float, qb_timestamp, validate_invoice_data,
+                   validate_payment_data, validate_list_data, source_length)
+
+# Characters/bytes fed to the streaming parser at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Item*Ret elements returned by ItemQueryRs
+ITEM_RET_TAGS = (
+    'ItemServiceRet', 'ItemNonInventoryRet', 'ItemOtherChargeRet', 'ItemInventoryRet',
+    'ItemInventoryAssemblyRet', 'ItemFixedAssetRet', 'ItemSubtotalRet', 'ItemDiscountRet',
+    'ItemPaymentRet', 'ItemSalesTaxRet', 'ItemSalesTaxGroupRet', 'ItemGroupRet'
+)
+
+# Supported *QueryRs responses: payload type, entity, *Ret elements, parser
+# method, validator and the id field used for change detection
+QUERY_RESPONSES = {
+    'InvoiceQueryRs': {
+        'type': 'invoices', 'entity': 'Invoice', 'ret_tags': ('InvoiceRet',),
+        'parser': '_parse_invoice', 'validator': validate_invoice_data, 'id_field': 'txn_id'
+    },
+    'CustomerQueryRs': {
+        'type': 'customers', 'entity': 'Customer', 'ret_tags': ('CustomerRet',),
+        'parser': '_parse_customer', 'validator': validate_list_data, 'id_field': 'list_id'
+    },
+    'ReceivePaymentQueryRs': {
+        'type': 'payments', 'entity': 'ReceivePayment', 'ret_tags': ('ReceivePaymentRet',),
+        'parser': '_parse_payment', 'validator': validate_payment_data, 'id_field': 'txn_id'
+    },
+    'ItemQueryRs': {
+        'type': 'items', 'entity': 'Item', 'ret_tags': ITEM_RET_TAGS,
+        'parser': '_parse_item', 'validator': validate_list_data, 'id_field': 'list_id'
+    },
+}
+
+
+def _numbered(value) -> list:
+    """Return the (document position, value) pairs of one or more numbered xmltodict values"""
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
 
 class XMLConverter:
-    def qbxml_to_json(self, qbxml_string: str) -> Optional[str]:
+    def __init__(self, fingerprint_index=None, projection: Optional[FieldProjection] = None):
+        """
+        Initialize XML converter
+        
+        Args:
+            fingerprint_index: Optional FingerprintIndex used to drop records
+                that are unchanged since they were last pushed
+            projection: Fields extracted per entity (optional, built from env
+                vars if not provided; share the one used to build the queries)
+        """
+        self.fingerprint_index = fingerprint_index
+        self.projection = projection or FieldProjection()
+        # Stream *Ret elements instead of building the whole document tree
+        self.streaming = get_env_var('QBXML_STREAMING', default='true', required=False).lower() == 'true'
+        # EditSequence of each record, needed for change detection
+        self.track_edit_sequences = fingerprint_index is not None
+        # Optional process pool for large responses
+        self.parallel = ParallelConversion(self.projection)
+    
+    def qbxml_to_json(self, qbxml_string: str, response_info: Optional[Dict] = None) -> Optional[str]:
         """
         Convert QBXML to JSON with improved error handling
         
+        The *QueryRs element is dispatched to its parser by QUERY_RESPONSES
+        (invoices, customers, payments or items).
+        
         Args:
             qbxml_string: QBXML string to convert
+            response_info: Optional dict that is filled with the response type,
+                status and iterator attributes (statusCode, iteratorID,
+                iteratorRemainingCount)
         
         Returns:
             JSON string or None if conversion fails
         """
+        results = self.convert_responses(qbxml_string)
+        if not results:
+            return None
+        if len(results) > 1:
+            logger.warning(f"Only the first of {len(results)} responses is converted")
+        
+        result = results[0]
+        if response_info is not None:
+            response_info.update(result)
+        return result['payload'].encode().decode('utf-8') if result['payload'] else None
+    
+    def convert_responses(self, qbxml_string: Union[str, IO[bytes]], namespace: str = '') -> List[Dict]:
+        """
+        Convert every *QueryRs of a (possibly multi-request) QBXMLMsgsRs in a single pass
+        
+        A response with an error status yields a result without payload and
+        does not affect the other responses.
+        
+        Args:
+            qbxml_string: QBXML string to convert, or a binary file holding
+                it (a request body spilled to disk)
+            namespace: Prefix of the fingerprint keys (keeps companies apart)
+        
+        Returns:
+            One result per *QueryRs in document order: the query info dict
+            (request_id, type, entity, status and iterator attributes, ...)
+            plus 'payload' (records.Payload or None). Empty list if conversion fails.
+        """
         try:
-            if not qbxml_string or not qbxml_string.strip():
+            if not source_length(qbxml_string) or (isinstance(qbxml_string, str) and not qbxml_string.strip()):
                 logger.warning("Empty QBXML string received")
-                return None
+                return []
+            if hasattr(qbxml_string, 'seek'):
+                qbxml_string.seek(0)
             
-            qbxml_dict = xmltodict.parse(qbxml_string)
+            start = time.perf_counter()
+            queries = []
+            records = {}
+            with tracing.span('converter.parse', bytes=source_length(qbxml_string)) as attributes:
+                if self.parallel.wants(qbxml_string):
+                    attributes['mode'] = 'parallel'
+                    record_iter = self._iter_query_records_parallel(qbxml_string, queries)
+                elif self.streaming:
+                    attributes['mode'] = 'streaming'
+                    record_iter = self._iter_query_records(qbxml_string, queries)
+                else:
+                    attributes['mode'] = 'xmltodict'
+                    record_iter = self._iter_query_records_dict(qbxml_string, queries)
+                for query_info, record in record_iter:
+                    records.setdefault(id(query_info), []).append(record)
+                attributes['records'] = sum(len(parsed) for parsed in records.values())
             
-            if 'QBXML' not in qbxml_dict:
-                logger.warning("QBXML root element not found")
-                return None
+            for query_info in queries:
+                query_info['payload'] = None
+                query_info['namespace'] = namespace
+                parsed = records.get(id(query_info), [])
+                # Counted once per response so the per-record loop stays lock-free
+                metrics.QBXML_RECORDS_PARSED.inc(len(parsed), type=query_info['type'])
+                metrics.QBXML_RECORDS_SKIPPED.inc(query_info['record_count'] - len(parsed), type=query_info['type'])
+                if query_info['record_count']:
+                    with tracing.span('converter.build_result', entity=query_info['entity'], records=len(parsed)):
+                        query_info['payload'] = self._build_result(query_info, parsed)
+                elif query_info['status_severity'] != 'Error':
+                    logger.info(f"No {query_info['type']} found in response")
+            metrics.QBXML_PARSE_DURATION.observe(time.perf_counter() - start)
+            return queries
             
-            qbxml = qbxml_dict['QBXML']
-            if 'QBXMLMsgsRs' not in qbxml:
-                logger.warning("QBXMLMsgsRs not found in response")
-                return None
-            
-            msgs = qbxml['QBXMLMsgsRs']
-            if 'InvoiceQueryRs' in msgs:
-                return self._process_invoice_query(msgs['InvoiceQueryRs'])
-            else:
-                logger.warning(f"Unknown message type in QBXML response: {list(msgs.keys())}")
-                return None
-            
-        except xmltodict.expat.ExpatError as e:
+        except (xmltodict.expat.ExpatError, ET.ParseError) as e:
             logger.error(f"XML parsing error: {e}")
-            return None
+            return []
         except Exception as e:
             logger.error(f"Error converting QBXML to JSON: {e}", exc_info=True)
-            return None
+            return []
     
-    def _process_invoice_query(self, invoice_query_rs: Dict) -> Optional[str]:
+    def stream_responses(self, source: Union[str, IO[bytes]], queries: List[Dict], namespace: str = '',
+                         group_size: int = 500) -> Iterator[Tuple[Dict, List[Record]]]:
         """
-        Process InvoiceQueryRs response
+        Convert every *QueryRs of a response, handing out records while parsing
+        
+        Records are yielded in groups of up to group_size, checked against
+        the fingerprint index together, so only one group is held in memory
+        instead of the whole response (see N8NClient.push_stream).
         
         Args:
-            invoice_query_rs: InvoiceQueryRs dictionary
+            source: QBXML string or binary file
+            queries: List that receives one query info dict per *QueryRs; filled
+                like convert_responses (without 'payload'), plus 'streamed_count',
+                the number of records yielded
+            namespace: Prefix of the fingerprint keys (keeps companies apart)
+            group_size: Records per group
         
-        Returns:
-            JSON string or None
+        Yields:
+            (query info, records) tuples in document order, groups without
+            new or changed records left out
+        
+        Raises:
+            xml.etree.ElementTree.ParseError: If the XML is malformed
         """
-        try:
-            # Handle status code
-            status_code = invoice_query_rs.get('@statusCode', '0')
-            if status_code != '0':
-                status_message = invoice_query_rs.get('@statusMessage', 'Unknown error')
-                logger.warning(f"InvoiceQueryRs returned status {status_code}: {status_message}")
-                # Continue anyway, might have partial data
-            
-            # Extract invoices
-            invoices = invoice_query_rs.get('InvoiceRet', [])
-            if not invoices:
-                logger.info("No invoices found in response")
-                return None
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        parsed = {}
+        group_info = None
+        group = []
+        for query_info, record in self._iter_query_records(source, queries):
+            if query_info is not group_info:
+                query_info['namespace'] = namespace
+            if group and (query_info is not group_info or len(group) >= group_size):
+                group = self._stream_group(group_info, group)
+                if group:
+                    yield group_info, group
+                group = []
+            group_info = query_info
+            group.append(record)
+            parsed[id(query_info)] = parsed.get(id(query_info), 0) + 1
+        if group:
+            group = self._stream_group(group_info, group)
+            if group:
+                yield group_info, group
+        
+        for query_info in queries:
+            query_info['namespace'] = namespace
+            query_info.setdefault('streamed_count', 0)
+            count = parsed.get(id(query_info), 0)
+            metrics.QBXML_RECORDS_PARSED.inc(count, type=query_info['type'])
+            metrics.QBXML_RECORDS_SKIPPED.inc(query_info['record_count'] - count, type=query_info['type'])
+            if not query_info['record_count'] and query_info['status_severity'] != 'Error':
+                logger.info(f"No {query_info['type']} found in response")
+    
+    def _stream_group(self, query_info: Dict, records: List[Record]) -> List[Record]:
+        """Drop unchanged records of one streamed group and count the rest"""
+        if self.fingerprint_index:
+            records = self._drop_unchanged(query_info, records)
+        query_info['streamed_count'] = query_info.get('streamed_count', 0) + len(records)
+        return records
+    
+    def _iter_query_records(self, source: Union[str, bytes, IO], queries: List[Dict]) -> Iterator[Tuple[Dict, Record]]:
+        """
+        Stream records of every supported *QueryRs in a response
+        
+        Args:
+            source: QBXML string, bytes or file object
+            queries: List that receives one query info dict per *QueryRs, in
+                document order, as soon as the element starts
+        
+        Yields:
+            (query info, parsed record) tuples
+        """
+        path = []
+        message_types = []
+        query_info = None
+        spec = None
+        
+        for event, elem in self._iter_events(source):
+            if event == 'start':
+                path.append(elem)
+                if len(path) == 3 and path[0].tag == 'QBXML' and path[1].tag == 'QBXMLMsgsRs':
+                    message_types.append(elem.tag)
+                    spec = QUERY_RESPONSES.get(elem.tag)
+                    query_info = self._new_query_info(elem.tag, elem.attrib) if spec else None
+                    if query_info is not None:
+                        queries.append(query_info)
+                continue
+            
+            path.pop()
+            if len(path) > 3:
+                continue
+            if query_info is None or len(path) != 3 or elem.tag not in spec['ret_tags']:
+                # Response-level element finished, nothing left to keep
+                elem.clear()
+                continue
             
-            # Ensure invoices is a list
-            if not isinstance(invoices, list):
-                invoices = [invoices]
+            record = self._element_to_dict(elem, self.projection.elements(spec['entity']))
+            path[2].remove(elem)
             
-            # Parse invoices
-            parsed_invoices = []
-            for invoice in invoices:
-                if not invoice:
-                    continue
-                parsed = self._parse_invoice(invoice)
+            parsed = self._process_record(spec, elem.tag, record, query_info)
+            if parsed:
+                yield query_info, parsed
+        
+        if not message_types:
+            logger.warning("QBXMLMsgsRs not found in response")
+        elif not queries:
+            logger.warning(f"Unknown message type in QBXML response: {message_types}")
+    
+    def _iter_query_records_parallel(self, source: Union[str, IO[bytes]],
+                                     queries: List[Dict]) -> Iterator[Tuple[Dict, Record]]:
+        """
+        Same as _iter_query_records, converting shards of the response in the process pool
+        
+        A spilled file is memory-mapped, so shards are cut from the page cache
+        one at a time instead of reading the whole body into memory. Falls
+        back to streaming inline when the response cannot be split or the
+        pool fails.
+        
+        Args:
+            source: QBXML string or binary file
+            queries: List that receives one query info dict per *QueryRs
+        
+        Yields:
+            (query info, parsed record) tuples, in document order
+        """
+        view = source
+        if hasattr(source, 'fileno'):
+            view = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            ret_tags = {rs_tag: spec['ret_tags'] for rs_tag, spec in QUERY_RESPONSES.items()}
+            with tracing.span('converter.split_response'):
+                responses = split_response(view, ret_tags, self.parallel.shard_chars)
+            results = None
+            if responses:
+                shards = []
+                for rs_tag, attrs, spans in responses:
+                    query_info = self._new_query_info(rs_tag, attrs)
+                    queries.append(query_info)
+                    shards.extend((query_info, rs_tag, start, end) for start, end in spans)
+                logger.info(f"Converting {source_length(source)} characters in {len(shards)} shards "
+                           f"({self.parallel.workers} processes)")
+                with tracing.span('converter.parallel_map', shards=len(shards)):
+                    results = self.parallel.map(shard_document(view, rs_tag, start, end)
+                                                for _, rs_tag, start, end in shards)
+        finally:
+            if view is not source:
+                view.close()
+        
+        if results is None:
+            queries.clear()
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            yield from self._iter_query_records(source, queries)
+            return
+        
+        for (query_info, *_), (record_count, max_time_modified, edit_sequences, rows) in zip(shards, results):
+            query_info['record_count'] += record_count
+            timestamp = qb_timestamp(max_time_modified)
+            if timestamp is not None and (query_info['max_time_modified'] is None
+                                          or timestamp > qb_timestamp(query_info['max_time_modified'])):
+                query_info['max_time_modified'] = max_time_modified
+            if self.track_edit_sequences:
+                query_info['edit_sequences'].update(edit_sequences)
+            record_class = self.projection.record_class(query_info['entity'])
+            for row in rows:
+                yield query_info, record_class(*row)
+    
+    def convert_shard(self, shard: Union[str, bytes]) -> Tuple[int, Optional[str], Dict, List[tuple]]:
+        """
+        Convert one shard from split_response (runs in a pool process)
+        
+        Records are returned as field value tuples: projected record classes
+        are built at run time and cannot be pickled by reference.
+        
+        Args:
+            shard: QBXML document holding one *QueryRs
+        
+        Returns:
+            (record count, newest TimeModified, edit sequences, record field values)
+        """
+        queries = []
+        rows = [tuple(getattr(record, name) for name in record.__slots__)
+                for _, record in self._iter_query_records(shard, queries)]
+        query_info = queries[0]
+        return query_info['record_count'], query_info['max_time_modified'], query_info['edit_sequences'], rows
+    
+    def _iter_query_records_dict(self, qbxml_string: Union[str, IO[bytes]],
+                                 queries: List[Dict]) -> Iterator[Tuple[Dict, Record]]:
+        """
+        Same as _iter_query_records, using xmltodict on the whole document
+        
+        Args:
+            qbxml_string: QBXML string or binary file
+            queries: List that receives one query info dict per *QueryRs
+        
+        Yields:
+            (query info, parsed record) tuples
+        """
+        positions = itertools.count()
+        
+        def number(path, key, value):
+            # xmltodict groups repeated siblings by tag; remember the document order of
+            # responses and records (Item*Ret kinds are interleaved) to walk them in order
+            if len(path) in (3, 4) and path[0][0] == 'QBXML' and path[1][0] == 'QBXMLMsgsRs':
+                spec = QUERY_RESPONSES.get(path[2][0])
+                if spec and key == path[-1][0] and (len(path) == 3 or key in spec['ret_tags']):
+                    return key, (next(positions), value)
+            return key, value
+        
+        with tracing.span('converter.xmltodict_parse'):
+            qbxml_dict = xmltodict.parse(qbxml_string, postprocessor=number)
+        
+        if 'QBXML' not in qbxml_dict:
+            logger.warning("QBXML root element not found")
+            return
+        
+        qbxml = qbxml_dict['QBXML']
+        if not isinstance(qbxml, dict) or 'QBXMLMsgsRs' not in qbxml:
+            logger.warning("QBXMLMsgsRs not found in response")
+            return
+        
+        msgs = qbxml['QBXMLMsgsRs'] or {}
+        message_types = list(msgs.keys())
+        responses = [(position, rs_tag, query_rs) for rs_tag in message_types if rs_tag in QUERY_RESPONSES
+                     for position, query_rs in _numbered(msgs[rs_tag])]
+        for _, rs_tag, query_rs in sorted(responses, key=lambda response: response[0]):
+            spec = QUERY_RESPONSES[rs_tag]
+            query_rs = query_rs if isinstance(query_rs, dict) else {}
+            attrs = {key[1:]: value for key, value in query_rs.items() if key.startswith('@')}
+            query_info = self._new_query_info(rs_tag, attrs)
+            queries.append(query_info)
+            records = [(position, ret_tag, record) for ret_tag in spec['ret_tags']
+                       for position, record in _numbered(query_rs.get(ret_tag))]
+            for _, ret_tag, record in sorted(records, key=lambda entry: entry[0]):
+                parsed = self._process_record(spec, ret_tag, record, query_info)
                 if parsed:
-                    try:
-                        validate_invoice_data(parsed)
-                        parsed_invoices.append(parsed)
-                    except ValueError as e:
-                        logger.warning(f"Invoice validation failed: {e}, skipping invoice")
-                        continue
-            
-            if not parsed_invoices:
-                logger.warning("No valid invoices after parsing")
+                    yield query_info, parsed
+        
+        if not queries:
+            logger.warning(f"Unknown message type in QBXML response: {message_types}")
+    
+    def _iter_events(self, source: Union[str, bytes, IO]) -> Iterator:
+        """
+        Feed the source to a pull parser in chunks and yield its events
+        
+        Strings and bytes are sliced rather than wrapped in StringIO/BytesIO,
+        which would copy the whole document first.
+        
+        Args:
+            source: QBXML string, bytes or file object
+        
+        Yields:
+            (event, element) tuples for 'start' and 'end' events
+        """
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        if isinstance(source, (str, bytes)):
+            chunks = (source[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(source), STREAM_CHUNK_SIZE))
+        else:
+            chunks = iter(lambda: source.read(STREAM_CHUNK_SIZE), source.read(0))
+        
+        for chunk in chunks:
+            parser.feed(chunk)
+            yield from parser.read_events()
+        parser.close()
+        yield from parser.read_events()
+    
+    def _new_query_info(self, rs_tag: str, attrs: Dict) -> Dict:
+        """
+        Build the query info dict for a *QueryRs from its attributes
+        
+        Args:
+            rs_tag: Response element name (e.g. InvoiceQueryRs)
+            attrs: Attributes of the *QueryRs element
+        
+        Returns:
+            Dictionary with request_id, type, entity, status_code, status_severity, status_message,
+            iterator_id, iterator_remaining_count, record_count, max_time_modified
+            and edit_sequences (record id -> EditSequence, filled while parsing)
+        """
+        spec = QUERY_RESPONSES[rs_tag]
+        status_code = attrs.get('statusCode', '0')
+        if status_code != '0':
+            status_message = attrs.get('statusMessage', 'Unknown error')
+            logger.warning(f"{rs_tag} returned status {status_code}: {status_message}")
+            # Continue anyway, might have partial data
+        
+        try:
+            remaining = int(attrs.get('iteratorRemainingCount', 0) or 0)
+        except (ValueError, TypeError):
+            logger.warning(f"Invalid iteratorRemainingCount: {attrs.get('iteratorRemainingCount')}")
+            remaining = 0
+        
+        return {
+            "request_id": attrs.get('requestID'),
+            "type": spec['type'],
+            "entity": spec['entity'],
+            "status_code": status_code,
+            "status_severity": attrs.get('statusSeverity', 'Info'),
+            "status_message": attrs.get('statusMessage', ''),
+            "iterator_id": attrs.get('iteratorID'),
+            "iterator_remaining_count": remaining,
+            "record_count": 0,
+            "max_time_modified": None,
+            "edit_sequences": {}
+        }
+    
+    def _element_to_dict(self, elem: ET.Element, keep: Optional[FrozenSet[str]] = None) -> Union[Dict, str, None]:
+        """
+        Convert an element to the same structure xmltodict.parse produces
+        
+        Args:
+            elem: XML element
+            keep: Optional names of the child elements to convert (the field
+                projection); other children are skipped without being walked
+        
+        Returns:
+            Dictionary for elements with attributes or children, text for
+            leaf elements, None for empty elements
+        """
+        text = elem.text or ''
+        for child in elem:
+            if child.tail:
+                text += child.tail
+        text = text.strip() or None
+        
+        if not elem.attrib and len(elem) == 0:
+            return text
+        
+        result = {f'@{name}': value for name, value in elem.attrib.items()}
+        for child in elem:
+            if keep is not None and child.tag not in keep:
+                continue
+            value = self._element_to_dict(child)
+            if child.tag in result:
+                existing = result[child.tag]
+                if isinstance(existing, list):
+                    existing.append(value)
+                else:
+                    result[child.tag] = [existing, value]
+            else:
+                result[child.tag] = value
+        if text is not None:
+            result['#text'] = text
+        return result
+    
+    def _process_record(self, spec: Dict, ret_tag: str, record: Dict, query_info: Dict) -> Optional[Record]:
+        """
+        Parse and validate a single *Ret record and update the query info
+        
+        Args:
+            spec: QUERY_RESPONSES entry for the response
+            ret_tag: Name of the *Ret element
+            record: Record dictionary from QBXML
+            query_info: Query info dict (record_count, max_time_modified and
+                edit_sequences are updated)
+        
+        Returns:
+            Parsed record or None if it is empty or invalid
+        """
+        query_info['record_count'] += 1
+        if not record or not isinstance(record, dict):
+            if record:
+                log_sampled(logging.WARNING, 'record-format', "Invalid %s format: %s", ret_tag, type(record))
+            return None
+        
+        # Newest TimeModified in this response (used as the sync watermark)
+        time_modified = record.get('TimeModified')
+        timestamp = qb_timestamp(time_modified)
+        if timestamp is not None and (query_info['max_time_modified'] is None
+                                      or timestamp > qb_timestamp(query_info['max_time_modified'])):
+            query_info['max_time_modified'] = time_modified
+        
+        parsed = getattr(self, spec['parser'])(record)
+        if not parsed:
+            return None
+        if spec['entity'] == 'Item':
+            parsed.item_type = ret_tag[len('Item'):-len('Ret')]
+        
+        try:
+            spec['validator'](parsed)
+        except ValueError as e:
+            log_sampled(logging.WARNING, 'record-validation', "%s validation failed: %s, skipping record",
+                        spec['entity'], e)
+            return None
+        
+        if self.track_edit_sequences:
+            query_info['edit_sequences'][parsed[spec['id_field']]] = record.get('EditSequence')
+        return parsed
+    
+    def _build_result(self, query_info: Dict, records: List[Record]) -> Optional[Payload]:
+        """
+        Build the payload sent to n8n (serialized later, once, by the spool or client)
+        
+        Args:
+            query_info: Query info dict; receives 'fingerprints' to commit after
+                delivery and 'unchanged_count' when change detection is enabled
+            records: Parsed and validated records
+        
+        Returns:
+            Payload or None if there are no (changed) records
+        """
+        record_type = query_info['type']
+        if not records:
+            logger.warning(f"No valid {record_type} after parsing")
+            return None
+        
+        if self.fingerprint_index:
+            records = self._drop_unchanged(query_info, records)
+            if not records:
+                logger.info(f"All {record_type} unchanged since last push, nothing to send")
                 return None
-            
-            result = {
-                "type": "invoices",
-                "timestamp": datetime.now().isoformat(),
-                "count": len(parsed_invoices),
-                "data": parsed_invoices
-            }
-            
-            logger.info(f"Successfully parsed {len(parsed_invoices)} invoices")
-            return json.dumps(result)
-            
+        
+        logger.info(f"Successfully parsed {len(records)} {record_type}")
+        return Payload({"type": record_type, "timestamp": datetime.now().isoformat()}, records)
+    
+    def _drop_unchanged(self, query_info: Dict, records: List[Record]) -> List[Record]:
+        """
+        Filter out records whose fingerprint matches the one last pushed
+        
+        Invoices are keyed by their bare TxnID; other entities are prefixed
+        with the entity name (e.g. "Customer:80000001-1234567890"). Keys of
+        companies other than the default one also carry the company namespace
+        (e.g. "north/Customer:80000001-1234567890").
+        
+        Args:
+            query_info: Query info dict receiving 'fingerprints' (all records,
+                committed by the caller once delivery succeeded) and 'unchanged_count';
+                both add up over several calls
+            records: Parsed and validated records
+        
+        Returns:
+            Records that are new or changed
+        """
+        spec = QUERY_RESPONSES[f"{query_info['entity']}QueryRs"]
+        prefix = query_info.get('namespace', '') + ('' if spec['entity'] == 'Invoice' else f"{spec['entity']}:")
+        edit_sequences = query_info.get('edit_sequences') or {}
+        fingerprints = [
+            (prefix + record[spec['id_field']], edit_sequences.get(record[spec['id_field']]), fingerprint_record(record))
+            for record in records
+        ]
+        
+        try:
+            known = self.fingerprint_index.get_many([key for key, _, _ in fingerprints])
         except Exception as e:
-            logger.error(f"Error processing invoice query: {e}", exc_info=True)
-            return None
+            logger.error(f"Error reading fingerprint index, sending all records: {e}", exc_info=True)
+            return records
+        
+        changed = [
+            record for record, (key, _, fingerprint) in zip(records, fingerprints)
+            if known.get(key) != fingerprint
+        ]
+        
+        # Accumulated: a streamed response is checked one group of records at a time
+        query_info.setdefault('fingerprints', []).extend(fingerprints)
+        unchanged = len(records) - len(changed)
+        query_info['unchanged_count'] = query_info.get('unchanged_count', 0) + unchanged
+        if unchanged:
+            logger.info(f"Skipping {unchanged} unchanged {query_info['type']}")
+        return changed
     
-    def _parse_invoice(self, invoice: Dict) -> Optional[Dict]:
+    def _parse_invoice(self, invoice: Dict) -> Optional[Record]:
         """
         Parse invoice data from QBXML with improved error handling
         
@@ -113,12 +633,12 @@ class XMLConverter:
             invoice: Invoice dictionary from QBXML
         
         Returns:
-            Parsed invoice dictionary or None if parsing fails
+            Parsed invoice record or None if parsing fails
         """
         try:
             # Validate structure
             if not isinstance(invoice, dict):
-                logger.warning(f"Invalid invoice format: {type(invoice)}")
+                log_sampled(logging.WARNING, 'record-format', "Invalid invoice format: %s", type(invoice))
                 return None
             
             # Extract customer name
@@ -129,29 +649,34 @@ class XMLConverter:
             total_amount = safe_float(invoice.get('TotalAmount', 0))
             balance_remaining = safe_float(invoice.get('BalanceRemaining', 0))
             
-            # Build parsed invoice
-            parsed = {
-                "ref_number": invoice.get('RefNumber', ''),
-                "txn_id": invoice.get('TxnID', ''),
-                "date": invoice.get('TxnDate', ''),
-                "due_date": invoice.get('DueDate', ''),
-                "subtotal": subtotal,
-                "total_amount": total_amount,
-                "balance_remaining": balance_remaining,
-                "customer": customer_name,
-                "memo": invoice.get('Memo', ''),
-                "is_paid": balance_remaining == 0
+            # Build parsed invoice (projected fields only)
+            values = {
+                'ref_number': invoice.get('RefNumber', ''),
+                'txn_id': invoice.get('TxnID', ''),
+                'date': invoice.get('TxnDate', ''),
+                'due_date': invoice.get('DueDate', ''),
+                'subtotal': subtotal,
+                'total_amount': total_amount,
+                'balance_remaining': balance_remaining,
+                'customer': customer_name,
+                'memo': invoice.get('Memo', ''),
+                'is_paid': balance_remaining == 0
             }
+            if self.projection.wants('Invoice', 'line_items'):
+                values['line_items'] = self._parse_line_items(invoice)
+            if self.projection.wants('Invoice', 'custom_fields'):
+                values['custom_fields'] = self._parse_custom_fields(invoice)
+            parsed = self.projection.make_record('Invoice', values)
             
             # Validate required fields
-            if not parsed['txn_id']:
-                logger.warning("Invoice missing TxnID, skipping")
+            if not parsed.txn_id:
+                log_sampled(logging.WARNING, 'record-missing-id', "Invoice missing TxnID, skipping")
                 return None
             
             return parsed
             
         except Exception as e:
-            logger.error(f"Error parsing invoice: {e}", exc_info=True)
+            log_sampled(logging.ERROR, 'record-parse', "Error parsing invoice: %s", e, exc_info=True)
             return None
     
     def _extract_customer_name(self, invoice: Dict) -> str:
@@ -176,5 +701,188 @@ class XMLConverter:
             
             return ''
         except Exception as e:
-            logger.warning(f"Error extracting customer name: {e}")
+            log_sampled(logging.WARNING, 'record-parse', "Error extracting customer name: %s", e)
             return ''
+
+    def _parse_line_items(self, invoice: Dict) -> List[Dict]:
+        """
+        Parse the InvoiceLineRet elements of an invoice (IncludeLineItems)
+        
+        Args:
+            invoice: Invoice dictionary
+        
+        Returns:
+            List of line dictionaries
+        """
+        lines = invoice.get('InvoiceLineRet') or []
+        if not isinstance(lines, list):
+            lines = [lines]
+        return [
+            {
+                "txn_line_id": line.get('TxnLineID', ''),
+                "item": self._extract_ref_name(line, 'ItemRef'),
+                "description": line.get('Desc', '') or '',
+                "quantity": safe_float(line.get('Quantity', 0)),
+                "rate": safe_float(line.get('Rate', 0)),
+                "amount": safe_float(line.get('Amount', 0))
+            }
+            for line in lines if isinstance(line, dict)
+        ]
+    
+    def _parse_custom_fields(self, record: Dict) -> Dict[str, str]:
+        """
+        Parse the DataExtRet elements of a record (returned for OwnerID)
+        
+        Args:
+            record: Record dictionary
+        
+        Returns:
+            Custom field name -> value
+        """
+        data_ext = record.get('DataExtRet') or []
+        if not isinstance(data_ext, list):
+            data_ext = [data_ext]
+        return {
+            ext.get('DataExtName', ''): ext.get('DataExtValue', '') or ''
+            for ext in data_ext if isinstance(ext, dict) and ext.get('DataExtName')
+        }
+    
+    def _extract_ref_name(self, record: Dict, ref_name: str) -> str:
+        """
+        Extract FullName from a *Ref element (single or list)
+        
+        Args:
+            record: Record dictionary
+            ref_name: Reference element name (e.g. PaymentMethodRef)
+        
+        Returns:
+            Referenced full name or empty string
+        """
+        ref = record.get(ref_name)
+        if isinstance(ref, list):
+            ref = ref[0] if ref else None
+        if isinstance(ref, dict):
+            return ref.get('FullName', '') or ''
+        return ''
+    
+    def _parse_customer(self, customer: Dict) -> Optional[Record]:
+        """
+        Parse customer data from QBXML
+        
+        Args:
+            customer: CustomerRet dictionary from QBXML
+        
+        Returns:
+            Parsed customer record or None if parsing fails
+        """
+        try:
+            values = {
+                'list_id': customer.get('ListID', ''),
+                'name': customer.get('Name', ''),
+                'full_name': customer.get('FullName', ''),
+                'is_active': customer.get('IsActive', 'true') == 'true',
+                'company_name': customer.get('CompanyName', ''),
+                'email': customer.get('Email', ''),
+                'phone': customer.get('Phone', ''),
+                'balance': safe_float(customer.get('Balance', 0)),
+                'total_balance': safe_float(customer.get('TotalBalance', 0))
+            }
+            if self.projection.wants('Customer', 'custom_fields'):
+                values['custom_fields'] = self._parse_custom_fields(customer)
+            parsed = self.projection.make_record('Customer', values)
+            
+            if not parsed.list_id:
+                log_sampled(logging.WARNING, 'record-missing-id', "Customer missing ListID, skipping")
+                return None
+            
+            return parsed
+            
+        except Exception as e:
+            log_sampled(logging.ERROR, 'record-parse', "Error parsing customer: %s", e, exc_info=True)
+            return None
+    
+    def _parse_payment(self, payment: Dict) -> Optional[Record]:
+        """
+        Parse received payment data from QBXML
+        
+        Args:
+            payment: ReceivePaymentRet dictionary from QBXML
+        
+        Returns:
+            Parsed payment record or None if parsing fails
+        """
+        try:
+            applied = payment.get('AppliedToTxnRet') or []
+            if not isinstance(applied, list):
+                applied = [applied]
+            
+            values = {
+                'txn_id': payment.get('TxnID', ''),
+                'ref_number': payment.get('RefNumber', ''),
+                'date': payment.get('TxnDate', ''),
+                'customer': self._extract_customer_name(payment),
+                'total_amount': safe_float(payment.get('TotalAmount', 0)),
+                'payment_method': self._extract_ref_name(payment, 'PaymentMethodRef'),
+                'memo': payment.get('Memo', ''),
+                'applied_to': [
+                    {
+                        "txn_id": txn.get('TxnID', ''),
+                        "ref_number": txn.get('RefNumber', ''),
+                        "amount": safe_float(txn.get('PaymentAmount', 0))
+                    }
+                    for txn in applied if isinstance(txn, dict)
+                ]
+            }
+            if self.projection.wants('ReceivePayment', 'custom_fields'):
+                values['custom_fields'] = self._parse_custom_fields(payment)
+            parsed = self.projection.make_record('ReceivePayment', values)
+            
+            if not parsed.txn_id:
+                log_sampled(logging.WARNING, 'record-missing-id', "Payment missing TxnID, skipping")
+                return None
+            
+            return parsed
+            
+        except Exception as e:
+            log_sampled(logging.ERROR, 'record-parse', "Error parsing payment: %s", e, exc_info=True)
+            return None
+    
+    def _parse_item(self, item: Dict) -> Optional[Record]:
+        """
+        Parse item data from QBXML (any Item*Ret type)
+        
+        Args:
+            item: Item*Ret dictionary from QBXML
+        
+        Returns:
+            Parsed item record or None if parsing fails
+        """
+        try:
+            # Service/non-inventory/other charge items nest prices in SalesOrPurchase
+            sales = item.get('SalesOrPurchase') or item.get('SalesAndPurchase') or {}
+            if not isinstance(sales, dict):
+                sales = {}
+            
+            values = {
+                'list_id': item.get('ListID', ''),
+                'name': item.get('Name', ''),
+                'full_name': item.get('FullName', ''),
+                'is_active': item.get('IsActive', 'true') == 'true',
+                'description': item.get('SalesDesc') or sales.get('Desc') or sales.get('SalesDesc') or '',
+                'price': safe_float(item.get('SalesPrice') or sales.get('Price') or sales.get('SalesPrice') or 0),
+                'quantity_on_hand': safe_float(item.get('QuantityOnHand', 0)),
+                'item_type': ''
+            }
+            if self.projection.wants('Item', 'custom_fields'):
+                values['custom_fields'] = self._parse_custom_fields(item)
+            parsed = self.projection.make_record('Item', values)
+            
+            if not parsed.list_id:
+                log_sampled(logging.WARNING, 'record-missing-id', "Item missing ListID, skipping")
+                return None
+            
+            return parsed
+            
+        except Exception as e:
+            log_sampled(logging.ERROR, 'record-parse', "Error parsing item: %s", e, exc_info=True)
+            return None